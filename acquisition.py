@@ -0,0 +1,159 @@
+"""Shared acquisition service for monitoring several tilt beds at once.
+
+One ``AcquisitionService`` per server process owns every bed's feed, vitals
+store and online detector. Each bed runs its own ingest thread, so a bed's
+alarms are raised as its samples arrive, independently of other beds and of
+any page rerun. Sessions follow beds through ``subscribe``: every flushed
+batch publishes its sample count and new alerts to the subscribers of that
+bed. Publishing only updates a small per-subscription record and never
+waits on a reader, so a slow or abandoned browser tab cannot hold up
+acquisition.
+Bed stores count against the server's memory budget (see ``compaction``).
+"""
+import itertools
+import threading
+import time as _time
+
+import compaction
+from detectors import OnlineDetector
+from ingest import Ingestor
+from vitals_store import VitalsStore
+
+# Subscriptions not polled for this long are dropped (closed browser tabs)
+IDLE_TIMEOUT = 300.0
+
+
+class Subscription:
+    """Pending updates for a set of beds.
+
+    Sample counts are coalesced per bed and alerts are kept until polled, so
+    the pending state stays small however rarely the page polls and no alert
+    is ever dropped.
+    """
+
+    def __init__(self, service, bed_ids):
+        self.service = service
+        self.bed_ids = frozenset(bed_ids)
+        self._samples = {}
+        self._alerts = []
+        self._lock = threading.Lock()
+        self.last_poll = _time.monotonic()
+        self.active = True
+
+    def put(self, bed_id, samples, alerts):
+        with self._lock:
+            self._samples[bed_id] = self._samples.get(bed_id, 0) + samples
+            self._alerts.extend((bed_id, alert) for alert in alerts)
+
+    def poll(self):
+        """({bed_id: new samples}, [(bed_id, alert), ...]) since the last poll."""
+        with self._lock:
+            self.last_poll = _time.monotonic()
+            samples, alerts = self._samples, self._alerts
+            self._samples, self._alerts = {}, []
+        return samples, alerts
+
+    def close(self):
+        self.service.unsubscribe(self)
+
+
+class Bed:
+    """A monitored bed: its feed, vitals and detector."""
+
+    def __init__(self, bed_id, label, kind, target, baseline_hr, baseline_sbp, baseline_dbp=None,
+                 age=None, storage=None, test_id=None):
+        self.bed_id = bed_id
+        self.label = label
+        self.kind = kind
+        self.target = target
+        self.test_id = test_id
+        self.store = VitalsStore()
+        # Feeds are attached once the patient is tilted
+        self.store.current_phase = 1
+        self.detector = OnlineDetector(baseline_hr, baseline_sbp, baseline_dbp, age=age)
+        self.ingestor = None
+        self.storage = storage
+
+    @property
+    def key(self):
+        # Its entry in compaction.ACCOUNTANT
+        return f"bed:{self.bed_id}"
+
+    def start(self, on_flush):
+        self.ingestor = Ingestor(self.kind, self.target, self.store, self.detector,
+                                 storage=self.storage, test_id=self.test_id, on_flush=on_flush)
+        self.ingestor.start()
+
+    def stop(self):
+        if self.ingestor is not None:
+            self.ingestor.stop()
+
+    @property
+    def running(self):
+        return self.ingestor is not None and self.ingestor.running
+
+    def latest(self):
+        # Last sample as a dict, or None before the first one
+        with self.store.lock:
+            n = len(self.store)
+            if not n:
+                return None
+            return {c: v[0].item() for c, v in self.store.slice(n - 1, n).items()}
+
+
+class AcquisitionService:
+
+    def __init__(self, spill_dir=None):
+        self.spill_dir = spill_dir
+        self.beds = {}
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def add_bed(self, label, kind, target, baseline_hr, baseline_sbp, baseline_dbp=None, age=None,
+                storage=None, test_id=None):
+        bed = Bed(next(self._ids), label, kind, target, baseline_hr, baseline_sbp, baseline_dbp,
+                  age=age, storage=storage, test_id=test_id)
+        with self._lock:
+            self.beds[bed.bed_id] = bed
+        bed.start(lambda first, n, alerts: self.publish(bed, first, n, alerts))
+        return bed
+
+    def remove_bed(self, bed_id):
+        with self._lock:
+            bed = self.beds.pop(bed_id, None)
+        if bed is not None:
+            bed.stop()
+            compaction.ACCOUNTANT.remove(bed.key)
+
+    def list_beds(self):
+        with self._lock:
+            return sorted(self.beds.values(), key=lambda b: b.bed_id)
+
+    def subscribe(self, bed_ids):
+        subscription = Subscription(self, bed_ids)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.active = False
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, bed, first, n, alerts):
+        # Called on the bed's ingest thread after every flushed batch
+        compaction.compact_store(bed.key, bed.store, self.spill_dir)
+        now = _time.monotonic()
+        with self._lock:
+            idle = [s for s in self._subscriptions if now - s.last_poll > IDLE_TIMEOUT]
+            self._subscriptions.difference_update(idle)
+            for subscription in idle:
+                subscription.active = False
+            targets = [s for s in self._subscriptions if bed.bed_id in s.bed_ids]
+        for subscription in targets:
+            subscription.put(bed.bed_id, n, alerts)
+
+    def shutdown(self):
+        for bed in self.list_beds():
+            self.remove_bed(bed.bed_id)
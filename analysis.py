@@ -0,0 +1,28 @@
+"""Analysis step computations, kept free of Streamlit so they can be cached."""
+import numpy as np
+
+from patterns import classify_patterns
+from symptoms import summarize
+
+
+def analyze(baseline_hr, baseline_sbp, hr, sbp, time=None):
+    classified = classify_patterns(baseline_hr, baseline_sbp, hr, sbp, time)
+    return {
+        'pattern_code': int(classified['code'][0]),
+        'pattern': classified['label'][0],
+        'criteria_times': {name: None if np.isnan(t[0]) else float(t[0])
+                           for name, t in classified['first_time'].items()},
+    }
+
+
+def analyze_vitals(vitals, baseline_hr, baseline_sbp):
+    with vitals.lock:
+        result = analyze(baseline_hr, baseline_sbp, vitals.column('hr'), vitals.column('sbp'),
+                         vitals.column('time'))
+        result.update(
+            min_hr=vitals.min('hr'),
+            min_sbp=vitals.min('sbp'),
+            time_to_symptoms=vitals.first_time_with('Complete LOC'),
+            symptoms=summarize(vitals.column('time'), vitals.column('symptoms')),
+        )
+    return result
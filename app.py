@@ -1,11 +1,33 @@
 import streamlit as st
-import pandas as pd
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import numpy as np
 from datetime import datetime
-import json
-import base64
+import os
+import time
 from io import BytesIO
 
+from acquisition import AcquisitionService
+from analysis import analyze, analyze_vitals
+import checklists
+import compaction
+import content
+from detectors import ALERT_LABELS, OnlineDetector
+import events
+from hrv import HRVEngine
+import instrumentation
+import journal
+from ingest import FRAME_INTERVAL, Ingestor
+from patterns import CARDIOINHIBITORY, MIXED, POTS, VASODEPRESSOR
+import protocols
+from reports import generate_report, iter_report_chunks, report_filename
+from storage import jsonable, open_storage
+from symptoms import encode_symptoms
+from vitals_store import PHASES, VitalsStore
+import waveforms
+# pandas, altair (charts) and pyarrow (columnar, cohort) take over a second to
+# import; they're imported in the functions and steps that use them, so Home
+# and the checklists start without them
+
 # Page configuration
 st.set_page_config(
     page_title="Tilt Table Test Assistant",
@@ -14,7 +36,11 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Timings of this run (see instrumentation.py)
+profile = instrumentation.Profile()
+
 # Custom CSS for better styling
+css_start = profile.mark()
 st.markdown("""
 <style>
     .main-header {
@@ -82,12 +108,11 @@ st.markdown("""
     }
 </style>
 """, unsafe_allow_html=True)
+profile.record('css', css_start)
 
 # Initialize session state
 if 'current_step' not in st.session_state:
     st.session_state.current_step = 0
-if 'checklist_progress' not in st.session_state:
-    st.session_state.checklist_progress = {}
 if 'patient_data' not in st.session_state:
     st.session_state.patient_data = {}
 if 'test_results' not in st.session_state:
@@ -95,58 +120,764 @@ if 'test_results' not in st.session_state:
 if 'test_phase' not in st.session_state:
     st.session_state.test_phase = 'passive'
 
+# Performing Test phases, in the order of vitals_store.PHASES
+PHASE_OPTIONS = [
+    "1. Supine Baseline (5-10 min)",
+    "2. Passive Tilt (15-45 min)",
+    "3. Drug Provocation (if needed)",
+    "4. Recovery"
+]
+PASSIVE_PHASE = 1
+METRICS_WRITE_INTERVAL = 5.0  # s
+SCHEDULER_INTERVAL = 1.0  # s
+JOURNAL_DIR = os.environ.get('TILT_JOURNAL_DIR', 'journals')
+SPILL_DIR = os.environ.get('TILT_SPILL_DIR', 'spill')
+DEFAULT_ROOM = os.environ.get('TILT_ROOM', 'Room 1')
+
 # Helper functions
-def update_progress(category, item, value):
-    if category not in st.session_state.checklist_progress:
-        st.session_state.checklist_progress[category] = {}
-    st.session_state.checklist_progress[category][item] = value
-
-def get_progress_percentage(category, total_items):
-    if category not in st.session_state.checklist_progress:
-        return 0
-    completed = sum(1 for v in st.session_state.checklist_progress[category].values() if v)
-    return int((completed / total_items) * 100)
-
-def generate_report():
-    report = f"""
-    TILT TABLE TEST REPORT
-    Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-    
-    PATIENT INFORMATION:
-    - Patient ID: {st.session_state.patient_data.get('patient_id', 'N/A')}
-    - Age: {st.session_state.patient_data.get('age', 'N/A')}
-    - Gender: {st.session_state.patient_data.get('gender', 'N/A')}
-    - Weight: {st.session_state.patient_data.get('weight', 'N/A')} kg
-    - Indication: {st.session_state.patient_data.get('indication', 'N/A')}
-    
-    TEST PARAMETERS:
-    - Tilt Angle: {st.session_state.test_results.get('tilt_angle', 'N/A')} degrees
-    - Test Duration: {st.session_state.test_results.get('duration', 'N/A')} minutes
-    - Drug Provocation: {st.session_state.test_results.get('drug_used', 'None')}
-    
-    BASELINE VITALS:
-    - Baseline HR: {st.session_state.test_results.get('baseline_hr', 'N/A')} bpm
-    - Baseline SBP: {st.session_state.test_results.get('baseline_sbp', 'N/A')} mmHg
-    - Baseline DBP: {st.session_state.test_results.get('baseline_dbp', 'N/A')} mmHg
-    
-    RESULTS:
-    - Test Result: {st.session_state.test_results.get('result', 'N/A')}
-    - Minimum HR: {st.session_state.test_results.get('min_hr', 'N/A')} bpm
-    - Minimum SBP: {st.session_state.test_results.get('min_sbp', 'N/A')} mmHg
-    - Symptoms: {st.session_state.test_results.get('symptoms', 'N/A')}
-    - Time to Symptoms: {st.session_state.test_results.get('time_to_symptoms', 'N/A')} min
-    
-    INTERPRETATION:
-    {st.session_state.test_results.get('interpretation', 'N/A')}
-    
-    RECOMMENDATIONS:
-    {st.session_state.test_results.get('recommendations', 'N/A')}
-    """
-    return report
-
-def get_download_link(text, filename):
-    b64 = base64.b64encode(text.encode()).decode()
-    return f'<a href="data:file/txt;base64,{b64}" download="{filename}" style="text-decoration:none;"><button style="background-color:#1f77b4;color:white;padding:10px 20px;border:none;border-radius:5px;cursor:pointer;">Download Report</button></a>'
+@st.cache_resource
+def get_storage():
+    # One connection pool shared by every session on this server
+    return open_storage(os.environ.get('TILT_DB_URL', 'sqlite:///tilt_lab.db'))
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_analysis(store_uid, store_version, baseline_hr, baseline_sbp, _vitals):
+    # Keyed on the store's uid/version; the store itself is not hashed
+    return analyze_vitals(_vitals, baseline_hr, baseline_sbp)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_event_vitals(store_uid, store_version, times, _vitals):
+    # HR and SBP at (or just before) each event time; keyed like cached_analysis, so
+    # reruns that leave the store alone (typing the interpretation) skip the search
+    with _vitals.lock:
+        index = _vitals.index_at(times)
+        return {name: [float(_vitals.column(name)[i]) if i >= 0 else None for i in index] for name in ('hr', 'sbp')}
+
+@st.cache_resource
+def metrics_exporter():
+    # Optional /metrics endpoint plus the last time the metrics file was written
+    port = os.environ.get('TILT_METRICS_PORT')
+    return {'server': instrumentation.serve(int(port)) if port else None, 'written': 0.0}
+
+@st.cache_resource
+def spill_directory():
+    return compaction.spill_directory(SPILL_DIR)
+
+def compact_session():
+    # Spills this session's vitals to disk once it is over its memory budget
+    account = compaction.compact(st.session_state.test_results, spill_directory())
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        compaction.ACCOUNTANT.update(ctx.session_id, account['resident'], account['spilled'])
+    return account
+
+def publish_metrics(account):
+    registry = instrumentation.REGISTRY
+    registry.observe('rerun', profile.elapsed())
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        registry.set_gauge('session_memory_bytes', account['resident'], session=ctx.session_id[:8])
+        registry.set_gauge('session_spilled_bytes', account['spilled'], session=ctx.session_id[:8])
+    sessions, resident, spilled = compaction.ACCOUNTANT.totals()
+    registry.set_gauge('sessions', sessions)
+    registry.set_gauge('sessions_memory_bytes', resident)
+    exporter = metrics_exporter()
+    path = os.environ.get('TILT_METRICS_FILE')
+    if path and time.monotonic() - exporter['written'] >= METRICS_WRITE_INTERVAL:
+        exporter['written'] = time.monotonic()
+        registry.write_exposition(path)
+
+def render_debug_panel():
+    import pandas as pd
+    with st.sidebar.expander("🛠 Debug", expanded=True):
+        st.caption(f"Rerun: {profile.elapsed() * 1000:.1f} ms")
+        st.dataframe(pd.DataFrame([{'span': name, 'labels': ", ".join(f"{v}" for v in labels.values()),
+                                    'ms': round(seconds * 1000, 2)} for name, labels, seconds in profile.spans]),
+                     hide_index=True)
+        memory = instrumentation.memory_breakdown(st.session_state.test_results)
+        vitals = st.session_state.test_results.get('vitals')
+        st.caption(f"test_results: {sum(memory.values()) / 1024:,.1f} KiB"
+                   + (f" ({vitals.nbytes / 1024:,.1f} KiB of vitals spilled)" if vitals is not None and vitals.spilled else ""))
+        sessions, resident, spilled = compaction.ACCOUNTANT.totals()
+        st.caption(f"Server: {sessions} sessions, {resident / 2**20:,.1f} MiB in memory, {spilled / 2**20:,.1f} MiB spilled")
+        st.dataframe(pd.DataFrame({'key': list(memory), 'KiB': [round(b / 1024, 1) for b in memory.values()]}),
+                     hide_index=True)
+        stats = instrumentation.REGISTRY.snapshot()
+        st.dataframe(pd.DataFrame([{'metric': name, 'labels': ", ".join(f"{v}" for _, v in labels),
+                                    'count': h['count'], 'mean ms': round(h['mean'] * 1000, 2),
+                                    'max ms': round(h['max'] * 1000, 2)}
+                                   for (name, labels), h in sorted(stats.items())]),
+                     hide_index=True)
+
+@st.cache_resource
+def get_protocols():
+    # Built-in protocols plus the site's own JSON definitions
+    return protocols.load_protocols(os.environ.get('TILT_PROTOCOL_DIR', 'protocols'))
+
+@st.cache_resource(max_entries=32)
+def get_schedule(name, angle, max_tilt):
+    # Compiled once per protocol and setup, shared by every session
+    definition = get_protocols().get(name)
+    return protocols.compile_protocol(definition, angle, max_tilt) if definition else None
+
+@st.cache_resource
+def get_acquisition():
+    # Beds are shared by every session on this server
+    return AcquisitionService(spill_dir=spill_directory())
+
+def get_journal():
+    # Write-ahead journal of the current test, shared with its feed thread
+    test_id = st.session_state.get('test_id')
+    if test_id is None:
+        return None
+    return journal.open_journal(journal.journal_path(JOURNAL_DIR, test_id), lambda: journal.snapshot_record(
+        test_id, st.session_state.patient_data, st.session_state.test_results))
+
+def set_current_test(test_id):
+    # Closes the previous test's journal; the URL keeps the test for a reconnecting browser
+    previous = st.session_state.get('test_id')
+    if previous is not None and previous != test_id:
+        journal.close_journal(journal.journal_path(JOURNAL_DIR, previous))
+        stop_scheduler()
+    st.session_state.test_id = test_id
+    get_journal()
+    st.query_params['test'] = str(test_id)
+
+def save_setup():
+    get_journal().append('setup', patient_data=jsonable(st.session_state.patient_data))
+    storage = get_storage()
+    storage.save_patient(st.session_state.patient_data)
+    storage.update_test(st.session_state.test_id, setup=st.session_state.patient_data)
+
+def save_results():
+    if st.session_state.get('test_id') is not None:
+        # Form submissions are acknowledged once they're in the journal
+        wal = get_journal()
+        wal.append_results(st.session_state.test_results)
+        wal.sync()
+        get_storage().update_test(st.session_state.test_id, results=st.session_state.test_results)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_trend_data(store_uid, store_version, _vitals):
+    from charts import trend_data
+    return trend_data(_vitals)
+
+def render_trend_chart(vitals):
+    from charts import trend_chart
+    points, markers = cached_trend_data(vitals.uid, vitals.version, vitals)
+    st.altair_chart(trend_chart(points, markers))
+
+@st.cache_resource(max_entries=32)
+def get_waveform_reader(base):
+    # Memory-mapped, so holding one per open test costs no more than its index
+    return waveforms.WaveformReader(base)
+
+def render_waveforms(test_id):
+    base = waveforms.waveform_path(os.environ.get('TILT_WAVEFORM_DIR', 'waveforms'), test_id)
+    if not waveforms.exists(base):
+        st.caption("No waveform recording for this test")
+        return
+    reader = get_waveform_reader(base)
+    reader.refresh()
+    duration = reader.duration
+    col1, col2 = st.columns([3, 1])
+    with col2:
+        width = st.selectbox("Window (s)", [5, 10, 30, 60], index=1, key="waveform_width")
+    start = 0.0
+    if duration > width:
+        with col1:
+            start = st.slider("Start (s)", 0.0, float(np.floor(duration - width)), 0.0, step=1.0, key="waveform_start")
+    # Only the samples inside the visible window are read from the file
+    times, samples = reader.window(start, start + width)
+    from charts import waveform_chart, waveform_data
+    st.altair_chart(waveform_chart(waveform_data(times, samples, reader.channels)))
+    st.caption(f"{len(reader):,} samples at {reader.sample_rate:g} Hz ({duration / 60:.1f} min)")
+
+def archive_mtime(archive_dir):
+    from columnar import TESTS_FILE
+    path = os.path.join(archive_dir, TESTS_FILE)
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+@st.cache_data(show_spinner=False)
+def cached_filter_options(archive_dir, mtime):
+    import cohort
+    return cohort.filter_options(archive_dir)
+
+@st.cache_data(max_entries=32, show_spinner="Aggregating cohort...")
+def cached_cohort_stats(archive_dir, mtime, selections, date_range):
+    import cohort
+    table = cohort.load_cohort(archive_dir, dict(selections), date_range)
+    edges, counts, times = cohort.time_to_symptoms_histogram(table)
+    return {
+        'tests': table.num_rows,
+        'test_ids': table.column('test_id').to_pylist(),
+        'positive_pct': cohort.positive_rate(table),
+        'by_pattern': cohort.positivity(table, 'pattern'),
+        'by_indication': cohort.positivity(table, 'indication'),
+        'by_age_band': cohort.positivity(table, 'age_band'),
+        'histogram': {f"{e}-{e + 5}": int(c) for e, c in zip(edges.tolist(), counts.tolist())},
+        'median_time': float(np.median(times)) if len(times) else None,
+        'drug_yield': cohort.drug_phase_yield(table),
+    }
+
+def get_events():
+    results = st.session_state.test_results
+    results['events'] = events.as_event_log(results.get('events'))
+    return results['events']
+
+def current_test_time():
+    # Events without their own time are stamped at the latest recorded sample
+    vitals = st.session_state.test_results.get('vitals')
+    if not vitals:
+        return 0.0
+    return vitals.last_time()
+
+def log_event(time, kind, **detail):
+    event = get_events().add(time, kind, **detail)
+    if st.session_state.get('test_id') is not None:
+        get_journal().append('event', event=event)
+    return event
+
+def log_symptom_onsets(time, symptoms):
+    seen = {e['symptom'] for e in get_events().of_kind(events.SYMPTOM)}
+    for symptom in symptoms:
+        if symptom != "None" and symptom not in seen:
+            log_event(time, events.SYMPTOM, symptom=symptom)
+
+def record_phase_change():
+    phase = st.session_state.test_phase_selector
+    if 'vitals' not in st.session_state.test_results:
+        st.session_state.test_results['vitals'] = VitalsStore()
+    vitals = st.session_state.test_results['vitals']
+    previous, index = vitals.current_phase, PHASE_OPTIONS.index(phase)
+    # New samples, including those from a running feed, are tagged with this phase
+    vitals.current_phase = index
+    now = current_test_time()
+    log_event(now, events.PHASE, phase=PHASES[index])
+    tilted = (1, 2)
+    if index in tilted and previous not in tilted:
+        log_event(now, events.TILT_UP, angle=st.session_state.patient_data.get('tilt_angle'))
+    elif previous in tilted and index not in tilted:
+        log_event(now, events.TILT_DOWN)
+    if st.session_state.get('test_id') is not None:
+        get_storage().add_phase(st.session_state.test_id, PHASES[index])
+    save_results()
+
+def open_saved_test(test_id):
+    storage = get_storage()
+    test = storage.get_test(test_id)
+    st.session_state.patient_data = test['patient_data']
+    st.session_state.test_results = test['test_results']
+    vitals = None
+    progress = st.empty()
+    for vitals in storage.load_vitals(test_id):
+        progress.caption(f"Loading vitals: {len(vitals):,} samples")
+    progress.empty()
+    if vitals is not None:
+        st.session_state.test_results['vitals'] = vitals
+        st.session_state.test_phase_selector = PHASE_OPTIONS[vitals.current_phase]
+    set_current_test(test_id)
+
+def replay_detector(vitals):
+    # Alerts aren't saved; replaying the samples rebuilds the same detector state
+    if vitals is not None:
+        cols = vitals.slice()
+        get_detector().update_many(cols['time'], cols['hr'], cols['sbp'], cols['dbp'], cols['symptoms'])
+
+def recover_test(test_id):
+    # Rebuild a session from the test's journal, or from storage if it has none
+    path = journal.journal_path(JOURNAL_DIR, test_id)
+    if not os.path.exists(path):
+        if get_storage().get_test(test_id) is None:
+            return False
+        open_saved_test(test_id)
+        return True
+    # A journal still open in this process may hold records not yet committed
+    journal.open_journal(path).sync()
+    state = journal.recover(path)
+    st.session_state.patient_data = state['patient_data']
+    st.session_state.test_results = state['test_results']
+    vitals = state['test_results'].get('vitals')
+    replay_detector(vitals)
+    if vitals is not None:
+        st.session_state.test_phase_selector = PHASE_OPTIONS[vitals.current_phase]
+        # Bring storage up to date with samples that were still buffered
+        cols = vitals.slice()
+        storage = get_storage()
+        storage.append_vitals(test_id, np.arange(len(vitals)), cols['time'], cols['hr'], cols['sbp'],
+                              cols['dbp'], cols['symptoms'], cols['phase'])
+        storage.flush()
+    set_current_test(test_id)
+    save_results()
+    return True
+
+def finish_test():
+    ingestor = st.session_state.get('ingestor')
+    if ingestor is not None and ingestor.running:
+        ingestor.stop()
+    stop_scheduler()
+    save_results()
+    get_journal().close()
+    get_storage().flush()
+    # Later saves would reopen the closed journal and offer the test for recovery again
+    st.session_state.test_id = None
+    st.query_params.pop('test', None)
+
+def import_test_file(uploaded):
+    from columnar import import_test
+    patient_data, test_results, phases = import_test(uploaded)
+    st.session_state.patient_data = patient_data
+    st.session_state.test_results = test_results
+    vitals = test_results.get('vitals')
+    replay_detector(vitals)
+    # Keep a local copy so the imported test can be reopened later
+    storage = get_storage()
+    test_id = storage.create_test(patient_data)
+    storage.update_test(test_id, results=test_results)
+    for phase in phases:
+        storage.add_phase(test_id, phase['name'], phase.get('params'))
+    if vitals is not None:
+        cols = vitals.slice()
+        storage.append_vitals(test_id, np.arange(len(vitals)), cols['time'], cols['hr'], cols['sbp'],
+                              cols['dbp'], cols['symptoms'], cols['phase'])
+        storage.flush()
+    set_current_test(test_id)
+
+def test_export_download(patient_data, test_results):
+    patient_data, test_results = dict(patient_data), dict(test_results)
+    def build():
+        from columnar import export_test
+        buffer = BytesIO()
+        export_test(buffer, patient_data, test_results)
+        return buffer.getvalue()
+    return build
+
+@st.cache_resource
+def get_checklist_templates():
+    # Built once per server; each version's items are kept for remapping saved state
+    return checklists.register_templates(get_storage())
+
+def get_checklist_state(room):
+    return checklists.ChecklistState(get_storage(), room, checklists.current_shift(), get_checklist_templates())
+
+def tick_checklist(state, category, item, key):
+    state.set(category, item, st.session_state[key])
+
+def render_checklist(state, category, prefix):
+    # Boxes show the room's shared state; each tick is saved as it happens
+    for i, item in enumerate(state.templates[category].items):
+        key = f"{prefix}_{i}"
+        st.session_state[key] = state.checked(category, item)
+        st.checkbox(item, key=key, on_change=tick_checklist, args=(state, category, item, key))
+
+def toggle_contraindication(condition, key):
+    selected = set(st.session_state.patient_data.get('contraindications', ()))
+    if st.session_state[key]:
+        selected.add(condition)
+    else:
+        selected.discard(condition)
+    st.session_state.patient_data['contraindications'] = [c for c in content.CONTRAINDICATIONS if c in selected]
+    if st.session_state.get('test_id') is not None:
+        save_setup()
+
+def report_download(patient_data, test_results):
+    # Snapshot the dicts now; the report bytes are only built when the file is requested
+    # (download_button sends the file as one payload)
+    patient_data, test_results = dict(patient_data), dict(test_results)
+    return lambda: b"".join(iter_report_chunks(patient_data, test_results, test_results.get('vitals')))
+
+def get_detector():
+    results = st.session_state.test_results
+    if 'detector' not in results:
+        results['detector'] = OnlineDetector(
+            results.get('baseline_hr', 70), results.get('baseline_sbp', 120),
+            results.get('baseline_dbp', 80), age=st.session_state.patient_data.get('age'))
+    return results['detector']
+
+def render_alerts():
+    detector = st.session_state.test_results.get('detector')
+    if detector is None:
+        return
+    for alert in detector.alerts:
+        text = f"{alert['label']} — met at {alert['time']:.1f} min (onset {alert['onset']:.1f} min)"
+        if alert['kind'] == 'syncope':
+            st.error(text)
+        else:
+            st.warning(text)
+
+def live_vitals_panel():
+    # A session fed only by its feed reruns just this fragment, so its budget is checked here too
+    compact_session()
+    render_alerts()
+    vitals = st.session_state.test_results.get('vitals')
+    if not vitals:
+        st.caption("Waiting for samples...")
+        return
+    with vitals.lock:
+        i = len(vitals) - 1
+        t, hr, sbp, dbp = vitals.time[i], vitals.hr[i], vitals.sbp[i], vitals.dbp[i]
+        n = len(vitals)
+    baseline_hr = st.session_state.test_results.get('baseline_hr', 70)
+    baseline_sbp = st.session_state.test_results.get('baseline_sbp', 120)
+    
+    cols = st.columns(5)
+    cols[0].metric("Tilt Time", f"{t:.1f} min")
+    cols[1].metric("HR", f"{hr:.0f} bpm", f"{hr - baseline_hr:+.0f}")
+    cols[2].metric("SBP", f"{sbp:.0f} mmHg", f"{sbp - baseline_sbp:+.0f}")
+    cols[3].metric("DBP", f"{dbp:.0f} mmHg")
+    cols[4].metric("Samples", f"{n:,}")
+    
+    render_trend_chart(vitals)
+
+def bed_monitor_panel():
+    service = get_acquisition()
+    subscription = st.session_state.get('bed_subscription')
+    if subscription is None:
+        return
+    # Alerts were raised on each bed's ingest thread; this only shows them
+    _, alerts = subscription.poll()
+    for bed_id, alert in alerts:
+        bed = service.beds.get(bed_id)
+        st.toast(f"🛏️ {bed.label if bed else bed_id}: {alert['label']}", icon="🚨")
+    beds = [service.beds[i] for i in sorted(subscription.bed_ids) if i in service.beds]
+    for row in range(0, len(beds), 3):
+        for col, bed in zip(st.columns(3), beds[row:row + 3]):
+            with col, st.container(border=True):
+                st.markdown(f"**{bed.label}** {'🟢' if bed.running else '⚪'}")
+                latest = bed.latest()
+                if latest is None:
+                    st.caption("Waiting for samples...")
+                else:
+                    c1, c2 = st.columns(2)
+                    c1.metric("HR", f"{latest['hr']:.0f} bpm")
+                    c2.metric("SBP", f"{latest['sbp']:.0f} mmHg")
+                    st.caption(f"{latest['time']:.1f} min · {len(bed.store):,} samples")
+                if bed.ingestor is not None and bed.ingestor.error:
+                    st.error(f"Feed error: {bed.ingestor.error}")
+                for alert in bed.detector.alerts:
+                    st.error(f"{alert['label']} — {alert['time']:.1f} min")
+
+def render_live_feed():
+    st.subheader("Monitor Feed")
+    ingestor = st.session_state.get('ingestor')
+    streaming = ingestor is not None and ingestor.running
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        kind = st.selectbox("Source", ["file", "udp", "tcp", "sim"], key="feed_kind", disabled=streaming)
+    with col2:
+        target = st.text_input("File path or host:port", key="feed_target", disabled=streaming,
+                               placeholder="live_feed.csv, 127.0.0.1:5005 or mixed@10x20 (sim)")
+    with col3:
+        if streaming:
+            if st.button("⏹ Stop Feed", use_container_width=True):
+                ingestor.stop()
+                st.rerun()
+        elif st.button("▶ Start Feed", use_container_width=True, disabled=not target):
+            if 'vitals' not in st.session_state.test_results:
+                st.session_state.test_results['vitals'] = VitalsStore()
+            ingestor = Ingestor(kind, target, st.session_state.test_results['vitals'], get_detector(),
+                                storage=get_storage(), test_id=st.session_state.get('test_id'),
+                                journal=get_journal())
+            ingestor.start()
+            st.session_state.ingestor = ingestor
+            st.rerun()
+    
+    if ingestor is not None and ingestor.error:
+        st.error(f"Feed error: {ingestor.error}")
+    
+    # Only the live panel reruns at the frame rate while a feed is streaming
+    st.fragment(live_vitals_panel, run_every=FRAME_INTERVAL if streaming else None)()
+
+def stop_scheduler():
+    # One protocol timer per test: stopped explicitly, or when the test changes or finishes
+    st.session_state.pop('scheduler', None)
+    st.session_state.pop('scheduler_setup', None)
+
+def protocol_timer_panel():
+    scheduler = st.session_state.get('scheduler')
+    if scheduler is None:
+        return
+    col1, col2 = st.columns(2)
+    if col1.button("⏭ Next Phase", key="scheduler_next", use_container_width=True):
+        scheduler.advance()
+    if col2.button("⏹ Stop Timer", key="scheduler_stop", use_container_width=True):
+        stop_scheduler()
+        st.rerun()
+    
+    messages, pending = [], None
+    kind = scheduler.check(get_detector().met)
+    if kind is not None:
+        messages.append(("🛑", f"Stop criterion met ({ALERT_LABELS[kind]}): moving to recovery"))
+    for action in scheduler.tick():
+        if action['action'] == 'phase':
+            if PHASE_OPTIONS[action['phase']] != st.session_state.get('test_phase_selector', PHASE_OPTIONS[0]):
+                pending = action['phase']
+        elif action['action'] == 'dose':
+            messages.append(("💉", f"Give {action['drug']} {action['dose']} {action['unit'] or ''}".rstrip()))
+        else:
+            messages.append(("🩺", f"Record vitals ({PHASES[action['phase']]})"))
+    if pending is not None:
+        # Applied before the phase radio on the full rerun
+        st.session_state.pending_phase = pending
+        st.session_state.scheduler_messages = messages
+        st.rerun()
+    for icon, message in messages:
+        st.toast(message, icon=icon)
+    
+    schedule, position, state = scheduler.schedule, scheduler.position(), scheduler.state()
+    if scheduler.finished:
+        st.success("✅ Protocol complete")
+        return
+    st.progress(min(position / schedule.duration, 1.0),
+                text=f"{PHASES[state['phase']]} · {state['remaining']:.1f} min left in phase")
+    cols = st.columns(3)
+    # Test time, like the vitals: minutes since tilt-up, negative before it
+    cols[0].metric("Test Time", f"{scheduler.time():.1f} min")
+    cols[1].metric("Next Vitals", f"in {max(state['next_vitals'] - position, 0):.1f} min"
+                   if np.isfinite(state['next_vitals']) else "—")
+    cols[2].metric("Scheduled Dose", f"{state['dose']:g} {events.DOSE_UNITS.get(state['drug'], '')}"
+                   if state['dose'] is not None else "—")
+    if scheduler.stopped:
+        st.caption(f"Stopped at {scheduler.stopped['time']:.1f} min: {ALERT_LABELS[scheduler.stopped['reason']]}"
+                   if scheduler.stopped['reason'] in ALERT_LABELS else
+                   f"Stopped at {scheduler.stopped['time']:.1f} min")
+
+def render_protocol_timer():
+    patient = st.session_state.patient_data
+    setup = (patient.get('protocol'), patient.get('tilt_angle'), patient.get('max_duration'))
+    scheduler = st.session_state.get('scheduler')
+    if scheduler is not None:
+        # A running timer keeps the schedule it started with until it is stopped
+        with st.expander(f"⏱ Protocol Timer — {scheduler.schedule.name}", expanded=True):
+            if st.session_state.get('scheduler_setup') != setup:
+                st.warning("The protocol setup changed after this timer started. It keeps its schedule; "
+                           "stop it to start one with the new setup.")
+            # Ticks on its own timer; phase changes rerun the whole page
+            st.fragment(protocol_timer_panel, run_every=None if scheduler.finished else SCHEDULER_INTERVAL)()
+        return
+    schedule = get_schedule(*setup)
+    if schedule is None:
+        return
+    with st.expander(f"⏱ Protocol Timer — {schedule.name}"):
+        origin = schedule.origin
+        st.markdown("\n".join(
+            f"- **{s['phase']}** {s['start'] - origin:g}–{s['end'] - origin:g} min"
+            + (f" at {s['angle']:g}°" if s['angle'] else "")
+            + (f", vitals every {s['vitals_every']:g} min" if s['vitals_every'] else "")
+            for s in schedule.steps))
+        for dose in schedule.doses:
+            st.caption(f"💉 {dose['drug']} {dose['dose']:g} {dose['unit'] or ''} at {dose['time'] - origin:g} min")
+        if st.button("▶ Start Protocol Timer", key="scheduler_start"):
+            scheduler = protocols.PhaseScheduler(schedule)
+            scheduler.start()
+            st.session_state.scheduler = scheduler
+            st.session_state.scheduler_setup = setup
+            st.rerun()
+
+# Performing Test phases rerun as fragments: submitting a phase's form or
+# changing its widgets redraws only that phase, not the whole page.
+@st.fragment
+def supine_phase():
+    st.info("📋 **Supine Phase Instructions:**")
+    st.markdown("""
+    - Patient horizontal for 5-10 minutes
+    - Record stable baseline HR and BP
+    - Ensure IV patency
+    - Confirm monitoring systems functional
+    - Patient should report any symptoms
+    """)
+
+    with st.form("supine_vitals"):
+        st.subheader("Record Baseline")
+        hr = st.number_input("HR (bpm)", 40, 150, 
+                           value=st.session_state.patient_data.get('baseline_hr', 70))
+        sbp = st.number_input("SBP (mmHg)", 80, 200,
+                            value=st.session_state.patient_data.get('baseline_sbp', 120))
+        dbp = st.number_input("DBP (mmHg)", 40, 120,
+                            value=st.session_state.patient_data.get('baseline_dbp', 80))
+
+        if st.form_submit_button("Confirm Baseline & Proceed to Tilt"):
+            handler_start = profile.mark()
+            st.session_state.test_results['baseline_hr'] = hr
+            st.session_state.test_results['baseline_sbp'] = sbp
+            st.session_state.test_results['baseline_dbp'] = dbp
+            # Reset in place: a running feed holds this detector
+            detector = st.session_state.test_results.get('detector')
+            if detector is not None:
+                detector.reset(hr, sbp, dbp)
+            save_results()
+            st.success("Baseline recorded. Ready to tilt.")
+            profile.record('handler', handler_start, handler='baseline')
+
+@st.fragment
+def passive_phase():
+    st.info("📋 **Passive Tilt Phase:**")
+    st.markdown(f"""
+    - Tilt to {st.session_state.patient_data.get('tilt_angle', 70)}°
+    - Duration: Up to {st.session_state.patient_data.get('max_duration', 45)} minutes
+    - Record vitals every 3-5 minutes
+    - Continuous ECG monitoring
+    - STOP immediately if syncope occurs
+    """)
+
+    render_live_feed()
+
+    # Manual data entry
+    st.subheader("Vital Signs Recording")
+
+    with st.form("tilt_vitals"):
+        col1, col2, col3, col4 = st.columns(4)
+
+        with col1:
+            time_point = st.number_input("Time at tilt (minutes)", 0.0, 60.0, 5.0, 0.5)
+            current_hr = st.number_input("Current HR (bpm)", 30, 200, 75)
+
+        with col2:
+            current_sbp = st.number_input("Current SBP (mmHg)", 50, 250, 115)
+            current_dbp = st.number_input("Current DBP (mmHg)", 30, 150, 75)
+
+        with col3:
+            symptoms = st.multiselect("Symptoms", [
+                "None", "Lightheadedness", "Nausea", "Sweating", 
+                "Blurred vision", "Palpitations", "Chest discomfort",
+                "Tremulousness", "Complete LOC"
+            ])
+
+        with col4:
+            hr_change = ((current_hr - st.session_state.test_results.get('baseline_hr', 70)) / 
+                       st.session_state.test_results.get('baseline_hr', 70) * 100)
+            bp_change = ((current_sbp - st.session_state.test_results.get('baseline_sbp', 120)) / 
+                       st.session_state.test_results.get('baseline_sbp', 120) * 100)
+
+            st.metric("HR Change", f"{hr_change:+.1f}%")
+            st.metric("SBP Change", f"{bp_change:+.1f}%")
+
+        test_status = st.radio("Test Status:", 
+            ["Continue", "Positive - Return to supine", "Negative - Proceed to drugs", "Abort"],
+            horizontal=True)
+
+        if st.form_submit_button("Record Data Point"):
+            handler_start = profile.mark()
+            if 'vitals' not in st.session_state.test_results:
+                st.session_state.test_results['vitals'] = VitalsStore()
+
+            vitals = st.session_state.test_results['vitals']
+            with vitals.lock:
+                vitals.append(time_point, current_hr, current_sbp, current_dbp, symptoms,
+                              phase=PASSIVE_PHASE)
+                seq = len(vitals) - 1
+            if st.session_state.get('test_id') is not None:
+                storage = get_storage()
+                get_journal().append_vitals(time_point, current_hr, current_sbp, current_dbp,
+                                            encode_symptoms(symptoms), PASSIVE_PHASE)
+                storage.append_vitals(st.session_state.test_id, seq, time_point, current_hr,
+                                      current_sbp, current_dbp, encode_symptoms(symptoms), PASSIVE_PHASE)
+                storage.flush()
+
+            log_symptom_onsets(time_point, symptoms)
+            st.session_state.test_results['test_status'] = test_status
+            if test_status != "Continue":
+                log_event(time_point, events.STATUS, status=test_status)
+
+            # Auto-analysis
+            for alert in get_detector().update(time_point, current_hr, current_sbp, current_dbp,
+                                               encode_symptoms(symptoms)):
+                if alert['kind'] == 'syncope':
+                    st.error(alert['label'])
+                    st.session_state.test_results['result'] = "Positive - Vasovagal Syncope"
+                    st.session_state.test_results['time_to_symptoms'] = time_point
+                else:
+                    st.warning(alert['label'])
+            save_results()
+
+            st.success(f"Data point at {time_point} min recorded")
+            profile.record('handler', handler_start, handler='data_point')
+
+@st.fragment
+def drug_phase():
+    st.info("💊 **Drug Provocation Phase**")
+
+    drug = st.session_state.patient_data.get('drug_choice') or 'Nitroglycerin'
+
+    if drug == "Isoproterenol":
+        st.markdown("""
+        **Isoproterenol Protocol:**
+        - Start 1 mcg/min, titrate to 3 mcg/min
+        - Target: HR +20-25% above baseline
+        - Tilt 60-70° for additional 15-20 min
+        """)
+        dose = st.number_input("Current dose (mcg/min)", 0.0, 5.0, 1.0, 0.5)
+    else:
+        st.markdown("""
+        **Nitroglycerin Protocol (Italian):**
+        - 300-400 mcg SL in 60-70° position
+        - Continue tilt for 15-20 minutes
+        """)
+        dose = st.number_input("Dose administered (mcg)", 0, 800, 400, 100)
+
+    # Each titration step or bolus is its own event, so earlier doses are kept
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        dose_time = st.number_input("Dose time (min)", 0.0, 120.0, min(current_test_time(), 120.0), 0.5,
+                                    key="dose_time")
+    with col2:
+        st.write("")
+        if st.button("💉 Log Dose", key="log_dose"):
+            handler_start = profile.mark()
+            log_event(dose_time, events.DRUG_DOSE, drug=drug, dose=dose, unit=events.DOSE_UNITS.get(drug))
+            st.session_state.test_results['drug_used'] = drug
+            st.session_state.test_results['drug_dose'] = dose
+            save_results()
+            profile.record('handler', handler_start, handler='dose')
+    steps = get_events().dose_steps()
+    if steps:
+        st.caption(" → ".join(f"{events.describe(e)} at {e['time']:.1f} min" for e in steps))
+
+    render_live_feed()
+
+    with st.form("drug_phase"):
+        st.subheader("Post-Drug Monitoring")
+        time_drug = st.number_input("Time post-drug (minutes)", 0, 30, 5)
+        hr_drug = st.number_input("HR (bpm)", 30, 200, 85)
+        sbp_drug = st.number_input("SBP (mmHg)", 50, 250, 100)
+        symptoms_drug = st.multiselect("Symptoms", 
+            ["None", "Lightheadedness", "Nausea", "Headache", "Palpitations", "LOC"])
+
+        if st.form_submit_button("Record Drug Phase Data"):
+            handler_start = profile.mark()
+            st.session_state.test_results['drug_used'] = drug
+            st.session_state.test_results['drug_dose'] = dose
+            if not get_events().of_kind(events.DRUG_DOSE):
+                log_event(current_test_time(), events.DRUG_DOSE, drug=drug, dose=dose,
+                          unit=events.DOSE_UNITS.get(drug))
+            dose_event = get_events().last(events.DRUG_DOSE)
+            log_symptom_onsets(dose_event['time'] + time_drug, symptoms_drug)
+            if "LOC" in symptoms_drug:
+                st.session_state.test_results['drug_response'] = "Positive"
+                st.success("Drug-induced positive response recorded")
+            else:
+                st.session_state.test_results['drug_response'] = "Negative"
+            save_results()
+            profile.record('handler', handler_start, handler='drug_data')
+
+def recovery_phase():
+    st.success("✅ Test Complete - Recovery Phase")
+    st.markdown("""
+    - Return to supine immediately
+    - Monitor until full recovery
+    - Document total test duration
+    - Record any delayed symptoms
+    """)
+
+# A reconnecting browser keeps ?test=<id>; rebuild the session it lost from the journal
+if st.session_state.get('test_id') is None and st.query_params.get('test', '').isdigit():
+    if recover_test(int(st.query_params['test'])):
+        st.session_state.current_step = 4
+        st.toast(f"Recovered test {st.session_state.test_id} "
+                 f"({len(st.session_state.test_results.get('vitals') or [])} samples)", icon="♻️")
+    else:
+        st.query_params.pop('test', None)
 
 # Sidebar navigation
 st.sidebar.title("📋 Navigation")
@@ -156,7 +887,9 @@ steps = [
     "⚠️ Safety & Contraindications",
     "🩺 Patient Setup",
     "📊 Performing Test",
-    "🔍 Analysis & Report"
+    "🔍 Analysis & Report",
+    "📈 Cohort Analytics",
+    "🛏️ Bed Monitor"
 ]
 
 for i, step in enumerate(steps):
@@ -169,6 +902,9 @@ st.sidebar.info("Tilt Table Test Assistant v1.0\n\nBased on ESC 2018 Guidelines
 # Main content based on current step
 current = st.session_state.current_step
 
+# Early exits through st.stop() are not recorded
+step_start = profile.mark()
+
 if current == 0:  # Home
     st.markdown('<div class="main-header">🏥 Tilt Table Test Assistant</div>', unsafe_allow_html=True)
     
@@ -217,33 +953,38 @@ if current == 0:  # Home
 elif current == 1:  # Pre-Test Preparation
     st.markdown('<div class="section-header">✅ Pre-Test Preparation Checklist</div>', unsafe_allow_html=True)
     
+    # Checklists are kept per room and shift, so every browser in the room shares them
+    col_room, col_shift = st.columns([2, 1])
+    with col_room:
+        room = st.text_input("Room", value=st.query_params.get('room', DEFAULT_ROOM)).strip() or DEFAULT_ROOM
+    if st.query_params.get('room') != room:
+        st.query_params['room'] = room
+    checklist_state = get_checklist_state(room)
+    with col_shift:
+        st.metric("Shift", checklist_state.shift)
+    
+    with st.expander("🏥 All Rooms This Shift"):
+        rooms = checklists.overview(get_storage(), checklist_state.shift)
+        if rooms:
+            categories = list(checklist_state.templates)
+            st.markdown("\n".join(
+                ["| Room | " + " | ".join(c.replace('_', ' ').title() for c in categories) + " |",
+                 "|---" * (len(categories) + 1) + "|"]
+                + [f"| {name} | " + " | ".join(f"{progress.get(c, 0)}%" for c in categories) + " |"
+                   for name, progress in rooms.items()]))
+        else:
+            st.caption("No checklists started this shift")
+    
     tabs = st.tabs(["🔧 Equipment", "💊 Medications", "🚨 Emergency", "📋 Patient Prep"])
     
     # Equipment Tab
     with tabs[0]:
         st.subheader("Equipment Readiness")
         
-        equipment_items = {
-            "Motorized tilt table (60-70° capability)": False,
-            "Foot board and safety restraints": False,
-            "ECG monitor (3 or 6 lead capability)": False,
-            "Beat-to-beat BP monitor (finger plethysmography)": False,
-            "IV access supplies": False,
-            "Emergency crash cart available": False,
-            "Defibrillator ready": False,
-            "Atropine 1mg IV available": False,
-            "Isoproterenol/nitroglycerin if needed": False,
-            "Timer/stopwatch": False,
-            "Emergency lowering capability (<10 sec)": False
-        }
-        
-        progress = get_progress_percentage('equipment', len(equipment_items))
+        progress = checklist_state.progress('equipment')
         st.progress(progress / 100, text=f"Equipment Readiness: {progress}%")
         
-        for item in equipment_items.keys():
-            checked = st.checkbox(item, key=f"eq_{item}", 
-                                value=st.session_state.checklist_progress.get('equipment', {}).get(item, False))
-            update_progress('equipment', item, checked)
+        render_checklist(checklist_state, 'equipment', 'eq')
         
         if progress == 100:
             st.success("✅ All equipment ready!")
@@ -267,24 +1008,10 @@ elif current == 1:  # Pre-Test Preparation
         </div>
         """, unsafe_allow_html=True)
         
-        med_items = {
-            "Isoproterenol available (if using)": False,
-            "Nitroglycerin available (if using)": False,
-            "Atropine 1mg IV (emergency)": False,
-            "Normal saline 500ml-1L (hydration)": False,
-            "IV fluids administration set": False,
-            "Emergency medications checked (not expired)": False,
-            "Sildenafil/Vardenafil washout confirmed (>24h)": False,
-            "Tadalafil washout confirmed (>48h)": False
-        }
-        
-        progress = get_progress_percentage('medications', len(med_items))
+        progress = checklist_state.progress('medications')
         st.progress(progress / 100, text=f"Medication Readiness: {progress}%")
         
-        for item in med_items.keys():
-            checked = st.checkbox(item, key=f"med_{item}",
-                                value=st.session_state.checklist_progress.get('medications', {}).get(item, False))
-            update_progress('medications', item, checked)
+        render_checklist(checklist_state, 'medications', 'med')
         
         st.markdown("""
         <div class="warning-box">
@@ -303,26 +1030,10 @@ elif current == 1:  # Pre-Test Preparation
     with tabs[2]:
         st.subheader("Emergency Readiness")
         
-        emergency_items = {
-            "Crash cart immediately available": False,
-            "Atropine drawn and labeled": False,
-            "Defibrillator pads attached": False,
-            "Oxygen supply ready": False,
-            "Airway management equipment": False,
-            "Emergency team contact confirmed": False,
-            "IV access patent and functional": False,
-            "Patient consented for procedure": False,
-            "Emergency lowering procedure reviewed": False,
-            "Continuous monitoring confirmed": False
-        }
-        
-        progress = get_progress_percentage('emergency', len(emergency_items))
+        progress = checklist_state.progress('emergency')
         st.progress(progress / 100, text=f"Emergency Readiness: {progress}%")
         
-        for item in emergency_items.keys():
-            checked = st.checkbox(item, key=f"em_{item}",
-                                value=st.session_state.checklist_progress.get('emergency', {}).get(item, False))
-            update_progress('emergency', item, checked)
+        render_checklist(checklist_state, 'emergency', 'em')
         
         st.markdown("""
         <div class="danger-box">
@@ -360,19 +1071,7 @@ elif current == 1:  # Pre-Test Preparation
         </div>
         """, unsafe_allow_html=True)
         
-        patient_prep = {
-            "Patient fasting confirmed": False,
-            "Medication status documented": False,
-            "IV placed >30 min ago": False,
-            "Room environment optimized": False,
-            "Patient pre-test vitals stable": False,
-            "Informed consent obtained": False
-        }
-        
-        for item in patient_prep.keys():
-            checked = st.checkbox(item, key=f"pp_{item}",
-                                value=st.session_state.checklist_progress.get('patient_prep', {}).get(item, False))
-            update_progress('patient_prep', item, checked)
+        render_checklist(checklist_state, 'patient_prep', 'pp')
 
 elif current == 2:  # Safety & Contraindications
     st.markdown('<div class="section-header">⚠️ Safety Screening & Contraindications</div>', unsafe_allow_html=True)
@@ -393,23 +1092,13 @@ elif current == 2:  # Safety & Contraindications
     with col1:
         st.subheader("Screening Checklist")
         
-        contraindications = {
-            "Severe coronary artery disease": False,
-            "Recent MI (<3 months)": False,
-            "Severe aortic stenosis": False,
-            "Severe cerebrovascular disease": False,
-            "Pregnancy": False,
-            "Uncontrolled hypertension": False,
-            "LV outflow tract obstruction": False,
-            "Severe anemia": False,
-            "Acute illness/dehydration": False
-        }
-        
-        risk_score = 0
-        for condition, default in contraindications.items():
-            checked = st.checkbox(f"⚠️ {condition}", key=f"contra_{condition}")
-            if checked:
-                risk_score += 1
+        # Saved with the patient setup, so they're kept with the test
+        selected = st.session_state.patient_data.get('contraindications', [])
+        for condition in content.CONTRAINDICATIONS:
+            key = f"contra_{condition}"
+            st.session_state[key] = condition in selected
+            st.checkbox(f"⚠️ {condition}", key=key, on_change=toggle_contraindication, args=(condition, key))
+        risk_score = len(selected)
         
         if risk_score > 0:
             st.error(f"🚨 {risk_score} contraindication(s) identified. Test should NOT proceed without cardiology clearance.")
@@ -454,6 +1143,45 @@ elif current == 2:  # Safety & Contraindications
 elif current == 3:  # Patient Setup
     st.markdown('<div class="section-header">🩺 Patient Setup & Baseline Parameters</div>', unsafe_allow_html=True)
     
+    with st.expander("📂 Reopen Saved Test"):
+        search_id = st.text_input("Filter by Patient ID", key="reopen_patient_id")
+        saved = get_storage().list_tests(patient_id=search_id or None, limit=50)
+        if saved:
+            choice = st.selectbox("Saved tests", saved,
+                                  format_func=lambda t: f"{t['test_date']} — {t['patient_id'] or 'Unknown'} ({t['protocol']})")
+            if st.button("Open Test"):
+                open_saved_test(choice['id'])
+                st.success(f"✅ Loaded test {choice['id']} with {len(st.session_state.test_results.get('vitals') or [])} samples")
+        else:
+            st.caption("No saved tests")
+    
+    with st.expander("♻️ Recover Unfinished Test"):
+        pending = journal.unfinished(JOURNAL_DIR)
+        if pending:
+            choice = st.selectbox("Unfinished tests", pending, key="recover_choice",
+                                  format_func=lambda j: f"Test {j['test_id']} — {j['patient_id'] or 'Unknown'} "
+                                                        f"(last write {datetime.fromtimestamp(j['modified']):%H:%M})")
+            col1, col2 = st.columns(2)
+            if col1.button("Recover Test"):
+                recover_test(choice['test_id'])
+                st.success(f"✅ Recovered test {choice['test_id']} with "
+                           f"{len(st.session_state.test_results.get('vitals') or [])} samples")
+            if col2.button("Mark Finished"):
+                journal.close_journal(choice['path'])
+                st.rerun()
+        else:
+            st.caption("No unfinished tests")
+    
+    with st.expander("📦 Import Test (Parquet)"):
+        uploaded = st.file_uploader("Test export", type=["parquet"], key="import_test_file")
+        if uploaded is not None and st.button("Import Test"):
+            try:
+                import_test_file(uploaded)
+            except (ValueError, KeyError, OSError) as e:
+                st.error(f"Could not import {uploaded.name}: {e}")
+            else:
+                st.success(f"✅ Imported test with {len(st.session_state.test_results.get('vitals') or [])} samples")
+    
     with st.form("patient_setup"):
         col1, col2, col3 = st.columns(3)
         
@@ -497,13 +1225,7 @@ elif current == 3:  # Patient Setup
         
         with col3:
             st.subheader("Test Protocol Selection")
-            protocol = st.selectbox("Protocol Type", [
-                "Standard Passive (20-45 min)",
-                "Short Passive (15 min)",
-                "Italian Protocol (Nitroglycerin)",
-                "Isoproterenol Protocol",
-                "Custom"
-            ])
+            protocol = st.selectbox("Protocol Type", list(get_protocols()))
             
             tilt_angle = st.slider("Tilt Angle (degrees)", 60, 80, 70)
             max_duration = st.number_input("Max Duration (minutes)", 15, 60, 45)
@@ -544,8 +1266,13 @@ elif current == 3:  # Patient Setup
                 'baseline_hr': baseline_hr,
                 'baseline_sbp': baseline_sbp,
                 'baseline_dbp': baseline_dbp,
-                'baseline_spo2': baseline_spo2
+                'baseline_spo2': baseline_spo2,
+                'contraindications': st.session_state.patient_data.get('contraindications', [])
             }
+            if st.session_state.get('test_id') is None:
+                set_current_test(get_storage().create_test(st.session_state.patient_data))
+            else:
+                save_setup()
             st.success("✅ Patient data saved successfully!")
 
 elif current == 4:  # Performing Test
@@ -555,157 +1282,35 @@ elif current == 4:  # Performing Test
         st.warning("⚠️ Please complete Patient Setup first!")
         st.stop()
     
+    # Phase changes from the protocol timer; the radio stays available as a manual override
+    if 'pending_phase' in st.session_state:
+        st.session_state.test_phase_selector = PHASE_OPTIONS[st.session_state.pop('pending_phase')]
+        record_phase_change()
+        st.toast(f"Phase: {st.session_state.test_phase_selector}", icon="⏱")
+        for icon, message in st.session_state.pop('scheduler_messages', ()):
+            st.toast(message, icon=icon)
+    
+    render_protocol_timer()
+    
     # Test timeline
     st.subheader("Test Timeline")
     
     phase = st.radio("Current Phase:", 
-        ["1. Supine Baseline (5-10 min)", 
-         "2. Passive Tilt (15-45 min)",
-         "3. Drug Provocation (if needed)",
-         "4. Recovery"],
+        PHASE_OPTIONS,
         horizontal=True,
-        key="test_phase_selector")
+        key="test_phase_selector",
+        on_change=record_phase_change)
     
     st.markdown("---")
     
     if "Supine" in phase:
-        st.info("📋 **Supine Phase Instructions:**")
-        st.markdown("""
-        - Patient horizontal for 5-10 minutes
-        - Record stable baseline HR and BP
-        - Ensure IV patency
-        - Confirm monitoring systems functional
-        - Patient should report any symptoms
-        """)
-        
-        with st.form("supine_vitals"):
-            st.subheader("Record Baseline")
-            hr = st.number_input("HR (bpm)", 40, 150, 
-                               value=st.session_state.patient_data.get('baseline_hr', 70))
-            sbp = st.number_input("SBP (mmHg)", 80, 200,
-                                value=st.session_state.patient_data.get('baseline_sbp', 120))
-            dbp = st.number_input("DBP (mmHg)", 40, 120,
-                                value=st.session_state.patient_data.get('baseline_dbp', 80))
-            
-            if st.form_submit_button("Confirm Baseline & Proceed to Tilt"):
-                st.session_state.test_results['baseline_hr'] = hr
-                st.session_state.test_results['baseline_sbp'] = sbp
-                st.session_state.test_results['baseline_dbp'] = dbp
-                st.success("Baseline recorded. Ready to tilt.")
-    
+        supine_phase()
     elif "Passive" in phase:
-        st.info("📋 **Passive Tilt Phase:**")
-        st.markdown(f"""
-        - Tilt to {st.session_state.patient_data.get('tilt_angle', 70)}°
-        - Duration: Up to {st.session_state.patient_data.get('max_duration', 45)} minutes
-        - Record vitals every 3-5 minutes
-        - Continuous ECG monitoring
-        - STOP immediately if syncope occurs
-        """)
-        
-        # Real-time data entry simulation
-        st.subheader("Vital Signs Recording")
-        
-        with st.form("tilt_vitals"):
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                time_point = st.number_input("Time at tilt (minutes)", 0.0, 60.0, 5.0, 0.5)
-                current_hr = st.number_input("Current HR (bpm)", 30, 200, 75)
-            
-            with col2:
-                current_sbp = st.number_input("Current SBP (mmHg)", 50, 250, 115)
-                current_dbp = st.number_input("Current DBP (mmHg)", 30, 150, 75)
-            
-            with col3:
-                symptoms = st.multiselect("Symptoms", [
-                    "None", "Lightheadedness", "Nausea", "Sweating", 
-                    "Blurred vision", "Palpitations", "Chest discomfort",
-                    "Tremulousness", "Complete LOC"
-                ])
-            
-            with col4:
-                hr_change = ((current_hr - st.session_state.test_results.get('baseline_hr', 70)) / 
-                           st.session_state.test_results.get('baseline_hr', 70) * 100)
-                bp_change = ((current_sbp - st.session_state.test_results.get('baseline_sbp', 120)) / 
-                           st.session_state.test_results.get('baseline_sbp', 120) * 100)
-                
-                st.metric("HR Change", f"{hr_change:+.1f}%")
-                st.metric("SBP Change", f"{bp_change:+.1f}%")
-            
-            test_status = st.radio("Test Status:", 
-                ["Continue", "Positive - Return to supine", "Negative - Proceed to drugs", "Abort"],
-                horizontal=True)
-            
-            if st.form_submit_button("Record Data Point"):
-                if 'data_points' not in st.session_state.test_results:
-                    st.session_state.test_results['data_points'] = []
-                
-                st.session_state.test_results['data_points'].append({
-                    'time': time_point,
-                    'hr': current_hr,
-                    'sbp': current_sbp,
-                    'dbp': current_dbp,
-                    'symptoms': symptoms
-                })
-                
-                # Auto-analysis
-                if "Complete LOC" in symptoms or current_sbp < 70 or current_hr < 40:
-                    st.error("🚨 CRITICAL: Syncope/ Severe hypotension detected!")
-                    st.session_state.test_results['result'] = "Positive - Vasovagal Syncope"
-                    st.session_state.test_results['time_to_symptoms'] = time_point
-                
-                elif hr_change > 30 and current_sbp < 10:
-                    st.warning("⚠️ POTS pattern detected")
-                
-                st.success(f"Data point at {time_point} min recorded")
-    
+        passive_phase()
     elif "Drug" in phase:
-        st.info("💊 **Drug Provocation Phase**")
-        
-        drug = st.session_state.patient_data.get('drug_choice', 'Nitroglycerin')
-        
-        if drug == "Isoproterenol":
-            st.markdown("""
-            **Isoproterenol Protocol:**
-            - Start 1 mcg/min, titrate to 3 mcg/min
-            - Target: HR +20-25% above baseline
-            - Tilt 60-70° for additional 15-20 min
-            """)
-            dose = st.number_input("Current dose (mcg/min)", 0.0, 5.0, 1.0, 0.5)
-        else:
-            st.markdown("""
-            **Nitroglycerin Protocol (Italian):**
-            - 300-400 mcg SL in 60-70° position
-            - Continue tilt for 15-20 minutes
-            """)
-            dose = st.number_input("Dose administered (mcg)", 0, 800, 400, 100)
-        
-        with st.form("drug_phase"):
-            st.subheader("Post-Drug Monitoring")
-            time_drug = st.number_input("Time post-drug (minutes)", 0, 30, 5)
-            hr_drug = st.number_input("HR (bpm)", 30, 200, 85)
-            sbp_drug = st.number_input("SBP (mmHg)", 50, 250, 100)
-            symptoms_drug = st.multiselect("Symptoms", 
-                ["None", "Lightheadedness", "Nausea", "Headache", "Palpitations", "LOC"])
-            
-            if st.form_submit_button("Record Drug Phase Data"):
-                st.session_state.test_results['drug_used'] = drug
-                st.session_state.test_results['drug_dose'] = dose
-                if "LOC" in symptoms_drug:
-                    st.session_state.test_results['drug_response'] = "Positive"
-                    st.success("Drug-induced positive response recorded")
-                else:
-                    st.session_state.test_results['drug_response'] = "Negative"
-    
+        drug_phase()
     else:  # Recovery
-        st.success("✅ Test Complete - Recovery Phase")
-        st.markdown("""
-        - Return to supine immediately
-        - Monitor until full recovery
-        - Document total test duration
-        - Record any delayed symptoms
-        """)
+        recovery_phase()
 
 elif current == 5:  # Analysis & Report
     st.markdown('<div class="section-header">🔍 Analysis & Report Generation</div>', unsafe_allow_html=True)
@@ -717,6 +1322,32 @@ elif current == 5:  # Analysis & Report
     # Analysis Section
     st.subheader("Test Analysis")
     
+    if st.session_state.test_results.get('vitals'):
+        st.markdown("### Vital Sign Trends")
+        render_trend_chart(st.session_state.test_results['vitals'])
+    
+    log = get_events()
+    if len(log):
+        st.markdown("### Event Log")
+        vitals = st.session_state.test_results.get('vitals')
+        end = max(log.times[-1], current_test_time())
+        t0, t1 = (st.slider("Events between (min)", 0.0, end, (0.0, end), key="event_range")
+                  if end > 0 else (0.0, 0.0))
+        shown = log.between(t0, t1)
+        rows = {'Time (min)': [e['time'] for e in shown],
+                'Event': [events.EVENT_LABELS[e['kind']] for e in shown],
+                'Detail': [events.describe(e) for e in shown]}
+        if vitals:
+            # Vitals at (or just before) each event
+            aligned = cached_event_vitals(vitals.uid, vitals.version, tuple(e['time'] for e in shown), vitals)
+            rows["HR (bpm)"], rows["SBP (mmHg)"] = aligned['hr'], aligned['sbp']
+        import pandas as pd
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+    
+    if st.session_state.get('test_id') is not None:
+        with st.expander("🫀 Raw Waveforms"):
+            render_waveforms(st.session_state.test_id)
+    
     col1, col2 = st.columns(2)
     
     with col1:
@@ -725,45 +1356,76 @@ elif current == 5:  # Analysis & Report
         baseline_hr = st.session_state.test_results.get('baseline_hr', 70)
         baseline_sbp = st.session_state.test_results.get('baseline_sbp', 120)
         
-        # Get min values from data points if available
-        if 'data_points' in st.session_state.test_results and st.session_state.test_results['data_points']:
-            df = pd.DataFrame(st.session_state.test_results['data_points'])
-            min_hr = df['hr'].min()
-            min_sbp = df['sbp'].min()
-            max_hr_drop = baseline_hr - min_hr
-            max_bp_drop = baseline_sbp - min_sbp
-            time_to_symptoms = df[df['symptoms'].apply(lambda x: 'Complete LOC' in x if isinstance(x, list) else False)]['time'].min() if any('Complete LOC' in str(s) for s in df['symptoms']) else None
+        # Analysis of recorded vitals is cached on the store's version, so
+        # reruns from editing the interpretation don't touch the samples
+        vitals = st.session_state.test_results.get('vitals')
+        if vitals:
+            with profile.span('analysis'):
+                analysis = cached_analysis(vitals.uid, vitals.version, baseline_hr, baseline_sbp, vitals)
+            min_hr, min_sbp = analysis['min_hr'], analysis['min_sbp']
+            time_to_symptoms = analysis['time_to_symptoms']
+            symptoms = ", ".join(analysis['symptoms']['recorded']) or "None"
         else:
             min_hr = st.number_input("Minimum HR recorded (bpm)", 30, 200, 50)
             min_sbp = st.number_input("Minimum SBP recorded (mmHg)", 40, 250, 80)
-            max_hr_drop = baseline_hr - min_hr
-            max_bp_drop = baseline_sbp - min_sbp
             time_to_symptoms = st.number_input("Time to symptoms (minutes)", 0.0, 60.0, 10.0)
+            analysis = analyze(baseline_hr, baseline_sbp, [min_hr], [min_sbp])
+            symptoms = st.session_state.test_results.get('symptoms', 'N/A')
+        code = analysis['pattern_code']
+        pattern = analysis['pattern']
         
-        st.session_state.test_results['min_hr'] = min_hr
-        st.session_state.test_results['min_sbp'] = min_sbp
-        st.session_state.test_results['time_to_symptoms'] = time_to_symptoms
+        if (st.session_state.test_results.get('min_hr'), st.session_state.test_results.get('min_sbp'),
+                st.session_state.test_results.get('time_to_symptoms'),
+                st.session_state.test_results.get('pattern'), st.session_state.test_results.get('symptoms')
+                ) != (min_hr, min_sbp, time_to_symptoms, pattern, symptoms):
+            st.session_state.test_results.update(
+                min_hr=min_hr, min_sbp=min_sbp, time_to_symptoms=time_to_symptoms, pattern=pattern,
+                symptoms=symptoms)
         
         # Pattern recognition
         st.markdown("### Pattern Analysis")
         
-        if max_bp_drop >= 40 and max_hr_drop >= 60:
-            pattern = "Mixed (Cardioinhibitory + Vasodepressor)"
+        if code == MIXED:
             st.error("🚨 Mixed Response: Significant HR and BP drop")
-        elif max_hr_drop >= 60 or min_hr < 40:
-            pattern = "Cardioinhibitory (Predominant)"
+        elif code == CARDIOINHIBITORY:
             st.warning("⚠️ Cardioinhibitory Response: Significant bradycardia")
-        elif max_bp_drop >= 40:
-            pattern = "Vasodepressor (Predominant)"
+        elif code == VASODEPRESSOR:
             st.info("ℹ️ Vasodepressor Response: BP drop without severe bradycardia")
-        elif (min_hr - baseline_hr) >= 30 and max_bp_drop < 10:
-            pattern = "POTS Pattern"
+        elif code == POTS:
             st.info("ℹ️ Postural Tachycardia Syndrome pattern")
         else:
-            pattern = "Nonspecific/Negative"
             st.info("ℹ️ No clear vasovagal pattern")
         
-        st.session_state.test_results['pattern'] = pattern
+        criteria_labels = content.CRITERIA_LABELS
+        met = [f"{label} at {analysis['criteria_times'][name]:.1f} min"
+               for name, label in criteria_labels.items() if analysis['criteria_times'].get(name) is not None]
+        if met:
+            st.caption("Criteria first met: " + ", ".join(met))
+        
+        # Autonomic indices, updated incrementally with the beats recorded since the last rerun
+        if vitals:
+            engine = st.session_state.test_results.setdefault('hrv_engine', HRVEngine())
+            engine.sync(vitals)
+            hrv = engine.summary(vitals)
+            st.session_state.test_results['hrv'] = hrv
+            if hrv:
+                st.markdown("### Autonomic Indices")
+                st.table({phase: {
+                    "SDNN (ms)": f"{idx['sdnn']:.1f}",
+                    "RMSSD (ms)": f"{idx['rmssd']:.1f}",
+                    "LF/HF": f"{idx['lf_hf']:.2f}" if idx['lf_hf'] is not None else "N/A",
+                    "BRS (ms/mmHg)": f"{idx['brs']:.1f}" if idx['brs'] is not None else "N/A",
+                    "Beats": f"{idx['beats']:,}",
+                } for phase, idx in hrv.items()})
+        
+        if vitals and analysis['symptoms']['onsets']:
+            st.markdown("### Symptom Timeline")
+            summary = analysis['symptoms']
+            st.markdown("\n".join(f"- **{name}:** first at {t:.1f} min"
+                                   for name, t in sorted(summary['onsets'].items(), key=lambda kv: kv[1])))
+            if summary['interval'] is not None:
+                st.info(f"ℹ️ Prodrome to LOC: {summary['interval']:.1f} min "
+                        f"(prodrome {summary['prodrome']:.1f} min, LOC {summary['loc']:.1f} min)")
         
         # Age consideration
         age = st.session_state.patient_data.get('age', 50)
@@ -778,44 +1440,12 @@ elif current == 5:  # Analysis & Report
     with col2:
         st.markdown("### Final Interpretation")
         
-        result_type = st.selectbox("Test Result:", [
-            "Positive - Vasovagal Syncope",
-            "Positive - Orthostatic Hypotension", 
-            "Positive - POTS",
-            "Positive - Pseudosyncope",
-            "Negative - No abnormality detected",
-            "Indeterminate"
-        ])
+        result_type = st.selectbox("Test Result:", content.RESULT_TYPES)
         
         st.session_state.test_results['result'] = result_type
         
         # Interpretation logic
-        interpretations = {
-            "Positive - Vasovagal Syncope": """
-            Delayed accelerating fall in BP with HR changes consistent with 
-            vasovagal mechanism. Patient reported symptoms similar to 
-            spontaneous episodes.
-            """,
-            "Positive - Orthostatic Hypotension": """
-            Immediate or early (within 3-5 min) sustained drop in SBP ≥20 mmHg 
-            or DBP ≥10 mmHg without compensatory tachycardia.
-            """,
-            "Positive - POTS": """
-            Sustained HR increase ≥30 bpm (≥40 bpm if <20 years) within 10 min 
-            of tilt without significant BP drop.
-            """,
-            "Positive - Pseudosyncope": """
-            Apparent LOC without significant hemodynamic changes. 
-            Consider psychiatric evaluation.
-            """,
-            "Negative - No abnormality detected": """
-            No significant hemodynamic changes during passive or drug phase.
-            Consider alternative diagnoses or repeat testing.
-            """,
-            "Indeterminate": """
-            Inconclusive results. Consider prolonged monitoring or alternative testing.
-            """
-        }
+        interpretations = content.INTERPRETATIONS
         
         interpretation = st.text_area("Detailed Interpretation", 
                                     value=interpretations.get(result_type, ""),
@@ -825,39 +1455,7 @@ elif current == 5:  # Analysis & Report
         # Recommendations
         st.markdown("### Recommendations")
         
-        if "Vasovagal" in result_type:
-            if "Cardioinhibitory" in pattern:
-                rec = """
-                - Consider permanent pacemaker if recurrent severe bradycardia/asystole
-                - Fluid and salt supplementation
-                - Physical counterpressure maneuvers
-                - Consider midodrine or fludrocortisone
-                """
-            else:
-                rec = """
-                - Fluid and salt supplementation
-                - Physical counterpressure maneuvers
-                - Consider midodrine, fludrocortisone, or beta-blockers
-                - Pacemaker NOT indicated for pure vasodepressor response
-                """
-        elif "Orthostatic" in result_type:
-            rec = """
-            - Volume expansion (fluids, salt)
-            - Compression stockings/abdominal binder
-            - Head-up sleeping position
-            - Consider midodrine, droxidopa, or fludrocortisone
-            - Review medications (stop offending agents)
-            """
-        elif "POTS" in result_type:
-            rec = """
-            - Hydration (2-3L/day) and increased salt intake
-            - Compression garments
-            - Exercise training (recumbent initially)
-            - Consider beta-blockers, ivabradine, or fludrocortisone
-            - Evaluate for underlying causes
-            """
-        else:
-            rec = "Further evaluation based on clinical suspicion."
+        rec = content.recommendation(result_type, pattern)
         
         recommendations = st.text_area("Treatment Recommendations", value=rec, height=120)
         st.session_state.test_results['recommendations'] = recommendations
@@ -866,14 +1464,26 @@ elif current == 5:  # Analysis & Report
     st.markdown("---")
     st.subheader("📄 Final Report")
     
+    st.download_button("Download Report",
+                       data=report_download(st.session_state.patient_data, st.session_state.test_results),
+                       file_name=report_filename(st.session_state.patient_data),
+                       mime="text/plain", on_click="ignore")
+    st.download_button("Export Test (Parquet)",
+                       data=test_export_download(st.session_state.patient_data, st.session_state.test_results),
+                       file_name=f"Tilt_Test_{st.session_state.patient_data.get('patient_id') or 'Unknown'}.parquet",
+                       mime="application/vnd.apache.parquet", on_click="ignore")
+    
+    if st.session_state.get('test_id') is not None and st.button(
+            "🏁 Finish Test", help="Saves the test and closes its autosave journal"):
+        finish_test()
+        st.success("✅ Test finished")
+    
     if st.button("Generate Final Report", type="primary"):
-        report = generate_report()
+        save_results()
+        with profile.span('report'):
+            report = generate_report(st.session_state.patient_data, st.session_state.test_results)
         st.text_area("Report Preview", report, height=400)
         
-        # Download link
-        st.markdown(get_download_link(report, f"Tilt_Test_Report_{st.session_state.patient_data.get('patient_id', 'Unknown')}.txt"), 
-                   unsafe_allow_html=True)
-        
         # Summary metrics
         st.markdown("### Test Summary")
         cols = st.columns(4)
@@ -887,6 +1497,130 @@ elif current == 5:  # Analysis & Report
             with col:
                 st.metric(label, value)
 
+elif current == 6:  # Cohort Analytics
+    import cohort
+    from columnar import export_archive
+    
+    st.markdown('<div class="section-header">📈 Cohort Analytics</div>', unsafe_allow_html=True)
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        archive_dir = st.text_input("Archive export directory", value=os.environ.get('TILT_ARCHIVE_DIR', 'archive'))
+    with col2:
+        st.write("")
+        if st.button("🔄 Export from database", use_container_width=True):
+            with st.spinner("Exporting archive to Parquet..."):
+                counts = export_archive(get_storage(), archive_dir)
+            st.success(f"✅ Exported {counts['tests']:,} tests and {counts['samples']:,} samples")
+    
+    mtime = archive_mtime(archive_dir)
+    if mtime is None:
+        st.info("ℹ️ No archive export found. Export the database to start.")
+        st.stop()
+    
+    options = cached_filter_options(archive_dir, mtime)
+    fcols = st.columns(4)
+    labels = {'indication': "Indication", 'protocol': "Protocol", 'age_band': "Age band", 'pattern': "Pattern"}
+    selections = tuple(
+        (column, tuple(fcol.multiselect(labels[column], options[column], key=f"cohort_{column}")))
+        for fcol, column in zip(fcols, cohort.FILTER_COLUMNS))
+    date_range = st.date_input("Test date range", value=(), key="cohort_dates")
+    date_range = tuple(str(d) + suffix for d, suffix in zip(date_range, (" 00:00:00", " 23:59:59"))) \
+        if len(date_range) == 2 else None
+    
+    stats = cached_cohort_stats(archive_dir, mtime, selections, date_range)
+    
+    mcols = st.columns(3)
+    mcols[0].metric("Tests", f"{stats['tests']:,}")
+    mcols[1].metric("Positive", f"{stats['positive_pct']:.1f}%" if stats['positive_pct'] is not None else "N/A")
+    mcols[2].metric("Median Time to Symptoms",
+                    f"{stats['median_time']:.1f} min" if stats['median_time'] is not None else "N/A")
+    
+    tabs = st.tabs(["Positivity", "Time to Symptoms", "Drug Phase Yield", "Vitals"])
+    with tabs[0]:
+        for title, key in (("By pattern", 'by_pattern'), ("By indication", 'by_indication'),
+                           ("By age band", 'by_age_band')):
+            st.markdown(f"**{title}**")
+            st.table(stats[key])
+    with tabs[1]:
+        st.bar_chart(stats['histogram'])
+        st.caption("Tests per 5-minute bin of time to symptoms")
+    with tabs[2]:
+        if stats['drug_yield']:
+            st.table(stats['drug_yield'])
+        else:
+            st.info("ℹ️ No tests in this cohort reached the drug phase")
+    with tabs[3]:
+        # Scanning samples is the expensive part, so it only runs on request
+        if st.button("Summarize vitals for this cohort"):
+            with st.spinner("Scanning vitals..."):
+                summary = cohort.vitals_summary(archive_dir, stats['test_ids'])
+            st.metric("Samples", f"{sum(summary.column('hr_count').to_pylist()):,}")
+            st.dataframe(summary.to_pandas())
+
+elif current == 7:  # Bed Monitor
+    st.markdown('<div class="section-header">🛏️ Multi-Bed Monitor</div>', unsafe_allow_html=True)
+    
+    service = get_acquisition()
+    beds = service.list_beds()
+    
+    with st.expander("➕ Add Bed", expanded=not beds):
+        with st.form("add_bed"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                label = st.text_input("Bed / patient", placeholder="Bed 1")
+                kind = st.selectbox("Source", ["file", "udp", "tcp", "sim"])
+                target = st.text_input("File path or host:port", placeholder="bed1.csv, 127.0.0.1:5005 or pots@1 (sim)")
+            with col2:
+                bed_hr = st.number_input("Baseline HR (bpm)", 40, 150, 70)
+                bed_sbp = st.number_input("Baseline SBP (mmHg)", 80, 200, 120)
+                bed_dbp = st.number_input("Baseline DBP (mmHg)", 40, 120, 80)
+            with col3:
+                bed_age = st.number_input("Age (years)", 10, 100, 50)
+                link_test = st.checkbox("Save samples to the current test",
+                                        disabled=st.session_state.get('test_id') is None)
+            if st.form_submit_button("Start Monitoring") and target:
+                service.add_bed(label or f"Bed {len(beds) + 1}", kind, target, bed_hr, bed_sbp, bed_dbp,
+                                age=bed_age, storage=get_storage() if link_test else None,
+                                test_id=st.session_state.get('test_id') if link_test else None)
+                st.rerun()
+    
+    if not beds:
+        st.info("ℹ️ No beds are being monitored")
+    else:
+        followed = st.multiselect("Follow beds", [b.bed_id for b in beds],
+                                  default=[b.bed_id for b in beds],
+                                  format_func=lambda i: service.beds[i].label if i in service.beds else str(i))
+        subscription = st.session_state.get('bed_subscription')
+        if subscription is None or not subscription.active or subscription.bed_ids != frozenset(followed):
+            if subscription is not None:
+                subscription.close()
+            st.session_state.bed_subscription = service.subscribe(followed)
+        
+        st.fragment(bed_monitor_panel, run_every=FRAME_INTERVAL)()
+        
+        st.markdown("---")
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            bed_id = st.selectbox("Bed", [b.bed_id for b in beds],
+                                  format_func=lambda i: service.beds[i].label if i in service.beds else str(i))
+        bed = service.beds.get(bed_id)
+        with col2:
+            st.write("")
+            # Hand the bed's live store and detector to this session's test
+            if st.button("Open in Performing Test", use_container_width=True) and bed is not None:
+                st.session_state.test_results['vitals'] = bed.store
+                st.session_state.test_results['detector'] = bed.detector
+                st.session_state.current_step = 4
+                st.rerun()
+        with col3:
+            st.write("")
+            if st.button("Remove Bed", use_container_width=True):
+                service.remove_bed(bed_id)
+                st.rerun()
+
+profile.record('step', step_start, step=steps[current].split(' ', 1)[1])
+
 # Footer
 st.markdown("---")
 st.markdown("""
@@ -897,3 +1631,9 @@ st.markdown("""
     Not a substitute for professional medical judgment.</p>
 </div>
 """, unsafe_allow_html=True)
+
+# Memory budget, then instrumentation: the debug panel is shown with TILT_DEBUG=1 or ?debug=1
+account = compact_session()
+if os.environ.get('TILT_DEBUG') or st.query_params.get('debug'):
+    render_debug_panel()
+publish_metrics(account)
@@ -0,0 +1,322 @@
+"""Benchmarks for the data entry, analysis and reporting hot paths.
+
+Runs every case over simulated vasovagal, POTS and orthostatic sessions
+(``simulator.simulate``, the same data as the ``sim`` feed) at several
+sample rates and protocol lengths, and writes timings and memory peaks as
+JSON so runs can be compared across versions:
+
+    python benchmarks.py --out bench_results/
+    python benchmarks.py --quick --compare bench_results/<earlier>.json
+
+The ``app_analysis`` case drives the Analysis & Report page headlessly with
+Streamlit's AppTest. Every run also measures the app's cold start and the
+rerun time of each step in a fresh interpreter; ``--budget`` fails the run
+when they exceed ``COLD_START_BUDGET_S`` / ``RERUN_BUDGET_S`` or when Home
+pulls in one of ``HOME_EXCLUDED_MODULES``.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from analysis import analyze_vitals
+from journal import Journal
+import protocols
+from reports import generate_report, iter_report_chunks
+from simulator import session, simulate
+from vitals_store import VitalsStore
+
+PATTERNS = ('vasovagal', 'pots', 'orthostatic')
+# simulator.simulate response for each pattern
+RESPONSES = {'vasovagal': 'mixed', 'pots': 'pots', 'orthostatic': 'orthostatic'}
+RATES_HZ = (1, 10, 250)
+DURATIONS_MIN = (10, 30, 60)
+QUICK = {'patterns': ('vasovagal',), 'rates': (1, 10), 'durations': (10,)}
+# Appending one sample at a time is slow at high rates; cap it and scale
+MAX_APPEND_SAMPLES = 20000
+# Startup budgets, including AppTest's own overhead (~0.15 s per run)
+COLD_START_BUDGET_S = 1.5
+RERUN_BUDGET_S = 0.5
+APP_STEPS = 8
+# Libraries that only some steps need; Home must start without them
+HOME_EXCLUDED_MODULES = ('pandas', 'pyarrow', 'altair')
+
+
+def synthetic_session(pattern, rate_hz, minutes, seed=0):
+    """Columns and baselines of one simulated session ending in the given response."""
+    # Run to the end rather than stopped after LOC, so every pattern has rate x duration samples
+    sim = simulate(RESPONSES[pattern], rate_hz=rate_hz, minutes=minutes, stop_on_loc=False, seed=seed)
+    cols = session(sim)
+    cols.update({key: float(sim[key][0]) for key in ('baseline_hr', 'baseline_sbp', 'baseline_dbp')})
+    return cols
+
+
+def session_store(cols):
+    store = VitalsStore(capacity=len(cols['time']))
+    store.extend(cols['time'], cols['hr'], cols['sbp'], cols['dbp'], cols['symptoms'], cols['phase'])
+    return store
+
+
+def session_results(store, cols):
+    results = {'baseline_hr': cols['baseline_hr'], 'baseline_sbp': cols['baseline_sbp'],
+               'baseline_dbp': cols['baseline_dbp'], 'vitals': store}
+    analysis = analyze_vitals(store, cols['baseline_hr'], cols['baseline_sbp'])
+    results.update(pattern=analysis['pattern'], min_hr=analysis['min_hr'], min_sbp=analysis['min_sbp'],
+                   time_to_symptoms=analysis['time_to_symptoms'])
+    return results
+
+
+PATIENT = {'patient_id': 'BENCH', 'age': 45, 'gender': 'Female', 'weight': 65.0,
+           'indication': 'Recurrent unexplained syncope', 'protocol': 'Italian Protocol (Nitroglycerin)',
+           'tilt_angle': 70}
+# The protocol must be a built-in one, or the schedule and timer paths are never exercised
+assert PATIENT['protocol'] in protocols.load_protocols(), PATIENT['protocol']
+
+
+def case_append(cols):
+    # One data point at a time, as the vitals form and slow feeds do
+    k = min(len(cols['time']), MAX_APPEND_SAMPLES)
+    rows = list(zip(*(cols[c][:k].tolist() for c in ('time', 'hr', 'sbp', 'dbp'))))
+
+    def run():
+        store = VitalsStore()
+        for t, hr, sbp, dbp in rows:
+            store.append(t, hr, sbp, dbp)
+    return run, len(cols['time']) / k
+
+
+def case_journal(cols):
+    # One journal record per sample, committed in groups, then a final sync
+    k = min(len(cols['time']), MAX_APPEND_SAMPLES)
+    rows = list(zip(*(cols[c][:k].tolist() for c in ('time', 'hr', 'sbp', 'dbp', 'symptoms', 'phase'))))
+    path = os.path.join(tempfile.mkdtemp(), 'bench.wal')
+
+    def run():
+        wal = Journal(path)
+        for row in rows:
+            wal.append_vitals(*row)
+        wal.close()
+        os.remove(path)
+    return run, len(cols['time']) / k
+
+
+def case_extend(cols):
+    return (lambda: session_store(cols)), 1
+
+
+def case_analysis(cols):
+    store = session_store(cols)
+    return (lambda: analyze_vitals(store, cols['baseline_hr'], cols['baseline_sbp'])), 1
+
+
+def case_report(cols):
+    results = session_results(session_store(cols), cols)
+    return (lambda: generate_report(PATIENT, results)), 1
+
+
+def case_download(cols):
+    # The full report file as the download button builds it
+    store = session_store(cols)
+    results = session_results(store, cols)
+
+    def run():
+        return len(b"".join(iter_report_chunks(PATIENT, results, store)))
+    return run, 1
+
+
+def case_app_analysis(cols):
+    from streamlit.testing.v1 import AppTest
+
+    store = session_store(cols)
+    results = session_results(store, cols)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+    def run():
+        at = AppTest.from_file(script, default_timeout=300)
+        at.session_state['current_step'] = 5
+        at.session_state['patient_data'] = dict(PATIENT)
+        at.session_state['test_results'] = dict(results)
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+    return run, 1
+
+
+CASES = {
+    'append': case_append,
+    'journal': case_journal,
+    'extend': case_extend,
+    'analysis': case_analysis,
+    'report': case_report,
+    'download': case_download,
+    'app_analysis': case_app_analysis,
+}
+# Cases that are too slow to repeat at every size
+SLOW_CASES = {'app_analysis'}
+
+
+# Run in a fresh interpreter so nothing is imported or cached beforehand
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.run()
+if at.exception:
+    raise SystemExit(at.exception[0].message)
+result = {'cold_start_s': time.perf_counter() - start,
+          'modules': [m for m in sys.argv[3:] if m in sys.modules], 'first_s': [], 'rerun_s': []}
+for step in range(int(sys.argv[2])):
+    at.session_state['current_step'] = step
+    for key in ('first_s', 'rerun_s'):
+        start = time.perf_counter()
+        at.run()
+        result[key].append(time.perf_counter() - start)
+print(json.dumps(result))
+"""
+
+
+def measure_startup(steps=APP_STEPS):
+    """Cold start of Home, then the first and a repeated run of every step."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    proc = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, script, str(steps), *HOME_EXCLUDED_MODULES],
+                          capture_output=True, text=True, check=True)
+    startup = json.loads(proc.stdout.strip().splitlines()[-1])
+    print(f"   cold_start  {startup['cold_start_s'] * 1000:10.2f} ms  "
+          f"heavy modules on Home: {', '.join(startup['modules']) or 'none'}", flush=True)
+    results = [{'case': 'cold_start', 'pattern': None, 'rate_hz': None, 'minutes': None,
+                'median_s': startup['cold_start_s'], 'modules': startup['modules']}]
+    for step, (first, rerun) in enumerate(zip(startup['first_s'], startup['rerun_s'])):
+        print(f"        rerun {f'step {step}':>11}  {rerun * 1000:10.2f} ms  (first visit {first * 1000:.2f} ms)",
+              flush=True)
+        results.append({'case': 'rerun', 'pattern': f"step {step}", 'rate_hz': None, 'minutes': None,
+                        'median_s': rerun, 'first_s': first})
+    return results
+
+
+def check_budget(results):
+    # Print startup results over budget; returns their count
+    failures = 0
+    for result in results:
+        if result['case'] == 'cold_start':
+            if result['median_s'] > COLD_START_BUDGET_S:
+                failures += 1
+                print(f"OVER BUDGET cold start {result['median_s']:.2f} s > {COLD_START_BUDGET_S} s")
+            if result['modules']:
+                failures += 1
+                print(f"OVER BUDGET Home imported {', '.join(result['modules'])}")
+        elif result['case'] == 'rerun' and result['median_s'] > RERUN_BUDGET_S:
+            failures += 1
+            print(f"OVER BUDGET {result['pattern']} rerun {result['median_s']:.2f} s > {RERUN_BUDGET_S} s")
+    return failures
+
+
+def measure(run, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    # One more pass under tracemalloc for the allocation peak
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'min_s': min(times), 'median_s': statistics.median(times), 'peak_bytes': peak}
+
+
+def run_suite(patterns=PATTERNS, rates=RATES_HZ, durations=DURATIONS_MIN, cases=tuple(CASES), repeat=3):
+    results = []
+    for pattern in patterns:
+        for rate in rates:
+            for minutes in durations:
+                cols = synthetic_session(pattern, rate, minutes)
+                for name in cases:
+                    run, scale = CASES[name](cols)
+                    stats = measure(run, 1 if name in SLOW_CASES else repeat)
+                    # Capped cases report the time for the whole session
+                    stats['min_s'] *= scale
+                    stats['median_s'] *= scale
+                    results.append({'case': name, 'pattern': pattern, 'rate_hz': rate, 'minutes': minutes,
+                                    'samples': len(cols['time']), **stats})
+                    print(f"{name:>13} {pattern:>11} {rate:>4} Hz {minutes:>3} min  "
+                          f"{stats['median_s'] * 1000:10.2f} ms  {stats['peak_bytes'] / 2**20:8.1f} MiB",
+                          flush=True)
+    return results
+
+
+def environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {'revision': revision, 'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'date': datetime.now().isoformat(timespec='seconds')}
+
+
+def key(result):
+    return (result['case'], result['pattern'], result['rate_hz'], result['minutes'])
+
+
+def compare(current, baseline, threshold=1.2):
+    # Print cases that got slower than threshold x the baseline; returns their count
+    before = {key(r): r for r in baseline['results']}
+    regressions = 0
+    for result in current:
+        old = before.get(key(result))
+        if old is None or not old['median_s']:
+            continue
+        ratio = result['median_s'] / old['median_s']
+        if ratio > threshold:
+            regressions += 1
+            print(f"SLOWER {ratio:5.2f}x  {' '.join(map(str, key(result)))}")
+    print(f"{regressions} regression(s) against {baseline['environment'].get('revision')}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis and reporting hot paths")
+    parser.add_argument('--out', default='bench_results', help="Directory for the JSON results")
+    parser.add_argument('--quick', action='store_true', help="Small subset for a fast check")
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    parser.add_argument('--budget', action='store_true', help="Fail if startup or reruns exceed their budget")
+    args = parser.parse_args(argv)
+
+    grid = QUICK if args.quick else {'patterns': PATTERNS, 'rates': RATES_HZ, 'durations': DURATIONS_MIN}
+    # Keep the headless app runs away from the real database
+    os.environ.setdefault('TILT_DB_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    results = measure_startup()
+    results += run_suite(grid['patterns'], grid['rates'], grid['durations'], args.cases, args.repeat)
+    env = environment()
+    os.makedirs(args.out, exist_ok=True)
+    stem = os.path.join(args.out, f"bench_{env['date'].replace(':', '')}_{env['revision'] or 'local'}")
+    path, n = stem + ".json", 1
+    while os.path.exists(path):
+        path, n = f"{stem}_{n}.json", n + 1
+    with open(path, 'w') as f:
+        json.dump({'environment': env, 'results': results}, f, indent=1)
+    print(f"Results written to {path}")
+    failed = bool(args.budget and check_budget(results))
+    if args.compare:
+        with open(args.compare) as f:
+            failed = bool(compare(results, json.load(f))) or failed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Trend and waveform charts with bounded, downsampled payloads.
+
+Each series is reduced to at most ``2 * buckets`` points by keeping the
+minimum and maximum of every bucket, so brief bradycardia or hypotension
+dips survive downsampling no matter how long or dense the session is.
+"""
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from vitals_store import PHASES
+
+SERIES = (('hr', "HR (bpm)"), ('sbp', "SBP (mmHg)"), ('dbp', "DBP (mmHg)"))
+MAX_BUCKETS = 500
+
+
+def minmax_indices(values, buckets=MAX_BUCKETS):
+    """Sorted indices of the min and max sample in each of ``buckets`` bins."""
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n <= 2 * buckets:
+        return np.arange(n)
+    size = -(-n // buckets)
+    pad = size * buckets - n
+    lo = np.concatenate((values, np.full(pad, np.inf))).reshape(buckets, size)
+    hi = np.concatenate((values, np.full(pad, -np.inf))).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    idx = np.concatenate((offsets + lo.argmin(axis=1), offsets + hi.argmax(axis=1)))
+    return np.unique(idx[idx < n])
+
+
+def phase_markers(time, phase):
+    # (time, phase name) at the first sample and at every phase change
+    phase = np.asarray(phase)
+    if not len(phase):
+        return []
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(phase)) + 1))
+    return [(float(time[i]), PHASES[phase[i]]) for i in starts]
+
+
+def trend_data(vitals, buckets=MAX_BUCKETS):
+    with vitals.lock:
+        cols = vitals.slice()
+    frames = []
+    for key, label in SERIES:
+        idx = minmax_indices(cols[key], buckets)
+        frames.append(pd.DataFrame({'time': cols['time'][idx], 'value': cols[key][idx], 'series': label}))
+    points = pd.concat(frames, ignore_index=True)
+    markers = pd.DataFrame(phase_markers(cols['time'], cols['phase']), columns=['time', 'phase'])
+    return points, markers
+
+
+def trend_chart(points, markers, height=300):
+    lines = alt.Chart(points).mark_line(point=len(points) < 200).encode(
+        x=alt.X('time:Q', title="Time at tilt (min)"),
+        y=alt.Y('value:Q', title=None, scale=alt.Scale(zero=False)),
+        color=alt.Color('series:N', title=None, legend=alt.Legend(orient='top')),
+    )
+    rules = alt.Chart(markers).mark_rule(strokeDash=[4, 4], color='#6c757d').encode(x='time:Q')
+    labels = alt.Chart(markers).mark_text(align='left', dx=4, dy=-6, color='#6c757d').encode(
+        x='time:Q', y=alt.value(10), text='phase:N')
+    return (lines + rules + labels).properties(height=height)
+
+
+def waveform_data(times, samples, channels, buckets=MAX_BUCKETS):
+    # Long-format frame of a waveform window, min/max downsampled per channel
+    frames = []
+    for i, name in enumerate(channels):
+        values = np.asarray(samples[:, i])
+        idx = minmax_indices(values, buckets)
+        frames.append(pd.DataFrame({'time': times[idx], 'value': values[idx], 'channel': name}))
+    if not frames:
+        return pd.DataFrame(columns=['time', 'value', 'channel'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def waveform_chart(points, height=120):
+    return alt.Chart(points).mark_line(strokeWidth=1).encode(
+        x=alt.X('time:Q', title="Time (s)", scale=alt.Scale(zero=False)),
+        y=alt.Y('value:Q', title=None, scale=alt.Scale(zero=False)),
+        row=alt.Row('channel:N', title=None),
+    ).properties(height=height).resolve_scale(y='independent')
@@ -0,0 +1,118 @@
+"""Preparation checklists shared by every session in a room for a shift.
+
+Templates are built once from ``content.CHECKLISTS``; a template's version
+is a checksum of its items, so editing a checklist starts a new version.
+Completion is one bitset per room, shift and checklist (bit ``i`` is item
+``i``), kept in storage with a count of completed items that is updated with
+each tick, so progress never iterates over items. Every session in the
+room reads the same state, and ``overview`` lists every room in one query.
+
+State saved under an older template version is carried over item by item
+when it is next loaded; items that were removed are dropped.
+"""
+import zlib
+from datetime import datetime, timedelta
+
+import content
+
+MAX_ITEMS = 63  # bits in a signed 64-bit SQLite integer
+DAY_SHIFT_START = 7  # h
+NIGHT_SHIFT_START = 19  # h
+
+
+class Template:
+
+    def __init__(self, category, items):
+        if len(items) > MAX_ITEMS:
+            raise ValueError(f"Checklist '{category}' has {len(items)} items (at most {MAX_ITEMS})")
+        self.category = category
+        self.items = tuple(items)
+        self.total = len(self.items)
+        self.index = {item: i for i, item in enumerate(self.items)}
+        self.version = zlib.crc32("\n".join(self.items).encode())
+
+    def remap(self, old_items, mask):
+        # Bits of an older version's items moved to where those items are now
+        out = 0
+        for i, item in enumerate(old_items):
+            j = self.index.get(item)
+            if j is not None and mask >> i & 1:
+                out |= 1 << j
+        return out
+
+
+TEMPLATES = {category: Template(category, items) for category, items in content.CHECKLISTS.items()}
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+def current_shift(now=None):
+    """'<date> Day' or '<date> Night'; a night shift keeps the date it started on."""
+    now = now or datetime.now()
+    if now.hour < DAY_SHIFT_START:
+        return f"{(now - timedelta(days=1)).date().isoformat()} Night"
+    return f"{now.date().isoformat()} {'Day' if now.hour < NIGHT_SHIFT_START else 'Night'}"
+
+
+def register_templates(storage, templates=TEMPLATES):
+    # Items of every version seen, so state saved under an old version can be remapped
+    for template in templates.values():
+        storage.save_checklist_template(template.category, template.version, template.items)
+    return templates
+
+
+class ChecklistState:
+    """Completion bitsets of one room's checklists for one shift."""
+
+    def __init__(self, storage, room, shift, templates=TEMPLATES):
+        self.storage = storage
+        self.room = room
+        self.shift = shift
+        self.templates = templates
+        self.masks = {category: 0 for category in templates}
+        self.completed = {category: 0 for category in templates}
+        self.refresh()
+
+    def refresh(self):
+        for category, row in self.storage.load_checklists(self.room, self.shift).items():
+            template = self.templates.get(category)
+            if template is None:
+                continue
+            mask, completed = row['mask'], row['completed']
+            if row['version'] != template.version:
+                old_items = self.storage.checklist_template(category, row['version'])
+                mask = template.remap(old_items, mask) if old_items else 0
+                completed = popcount(mask)
+                self.storage.replace_checklist(self.room, self.shift, category, template.version, mask,
+                                               completed, template.total)
+            self.masks[category], self.completed[category] = mask, completed
+
+    def checked(self, category, item):
+        return bool(self.masks[category] >> self.templates[category].index[item] & 1)
+
+    def progress(self, category):
+        return int(self.completed[category] * 100 / self.templates[category].total)
+
+    def set(self, category, item, value):
+        # Written even when this copy already agrees: another session may have changed the item
+        template = self.templates[category]
+        bit = 1 << template.index[item]
+        self.storage.set_checklist_item(self.room, self.shift, category, template.version, template.total,
+                                        bit, bool(value))
+        if bool(self.masks[category] & bit) != bool(value):
+            self.masks[category] ^= bit
+            self.completed[category] += 1 if value else -1
+
+
+def overview(storage, shift, templates=TEMPLATES):
+    """{room: {category: percent}} for every room with a checklist this shift."""
+    rooms = {}
+    for row in storage.checklist_overview(shift):
+        template = templates.get(row['category'])
+        if template is None:
+            continue
+        # A row still on an older version is shown as saved until its room loads it
+        rooms.setdefault(row['room'], {})[row['category']] = int(row['completed'] * 100 / max(row['total'], 1))
+    return rooms
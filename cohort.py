@@ -0,0 +1,109 @@
+"""Cohort analytics over a Parquet export of the archive (see columnar.py).
+
+Filters are pushed down into the Parquet scan, so only the row groups and
+columns a query needs are read; aggregations are Arrow group-bys.
+"""
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from columnar import TESTS_FILE, VITALS_FILE
+
+FILTER_COLUMNS = ('indication', 'protocol', 'age_band', 'pattern')
+SUMMARY_COLUMNS = ('test_id', 'indication', 'protocol', 'age_band', 'pattern', 'drug_used',
+                   'drug_response', 'result', 'positive', 'time_to_symptoms')
+
+
+def tests_dataset(archive_dir):
+    return ds.dataset(os.path.join(archive_dir, TESTS_FILE), format='parquet')
+
+
+def vitals_dataset(archive_dir):
+    return ds.dataset(os.path.join(archive_dir, VITALS_FILE), format='parquet')
+
+
+def filter_options(archive_dir):
+    # Distinct values of each filter column, read column by column
+    dataset = tests_dataset(archive_dir)
+    options = {}
+    for column in FILTER_COLUMNS:
+        values = pc.unique(dataset.to_table(columns=[column]).column(column).combine_chunks())
+        options[column] = sorted(v for v in values.cast(pa.string()).to_pylist() if v is not None)
+    return options
+
+
+def build_filter(selections, date_range=None):
+    """Dataset expression for {column: [allowed values]} and an optional (start, end) date."""
+    expr = None
+    for column, values in selections.items():
+        if values:
+            term = ds.field(column).isin(list(values))
+            expr = term if expr is None else expr & term
+    if date_range is not None:
+        start, end = (pa.scalar(np.datetime64(d, 's'), pa.timestamp('s')) for d in date_range)
+        term = (ds.field('test_date') >= start) & (ds.field('test_date') <= end)
+        expr = term if expr is None else expr & term
+    return expr
+
+
+def load_cohort(archive_dir, selections, date_range=None, columns=SUMMARY_COLUMNS):
+    return tests_dataset(archive_dir).to_table(columns=list(columns), filter=build_filter(selections, date_range))
+
+
+def positive_rate(table):
+    # Percent positive among tests with a recorded result
+    mean = pc.mean(pc.cast(table.column('positive'), pa.int8())).as_py()
+    return 100 * mean if mean is not None else None
+
+
+def positivity(table, by):
+    """Tests and positivity rate (%) per value of ``by``."""
+    if table.num_rows == 0:
+        return {}
+    grouped = table.select([by, 'positive']).cast(
+        pa.schema([(by, pa.string()), ('positive', pa.int8())])
+    ).group_by(by).aggregate([('positive', 'count', pc.CountOptions(mode='all')), ('positive', 'mean')])
+    return {
+        key: {'tests': count, 'positive_pct': round(100 * mean, 1) if mean is not None else None}
+        for key, count, mean in zip(grouped.column(by).to_pylist(),
+                                    grouped.column('positive_count').to_pylist(),
+                                    grouped.column('positive_mean').to_pylist())
+    }
+
+
+def time_to_symptoms_histogram(table, bin_minutes=5, max_minutes=60):
+    values = table.column('time_to_symptoms').to_numpy(zero_copy_only=False)
+    values = values[~np.isnan(values)]
+    edges = np.arange(0, max_minutes + bin_minutes, bin_minutes)
+    counts, _ = np.histogram(np.clip(values, 0, max_minutes), bins=edges)
+    return edges[:-1], counts, values
+
+
+def drug_phase_yield(table):
+    """Positive drug responses per drug, among tests that reached the drug phase."""
+    drug = table.filter(pc.is_valid(table.column('drug_used')))
+    if drug.num_rows == 0:
+        return {}
+    drug = drug.select(['drug_used', 'drug_response']).cast(
+        pa.schema([('drug_used', pa.string()), ('drug_response', pa.string())]))
+    drug = drug.append_column('responded', pc.cast(pc.equal(drug.column('drug_response'), "Positive"), pa.int8()))
+    grouped = drug.group_by('drug_used').aggregate(
+        [('responded', 'count', pc.CountOptions(mode='all')), ('responded', 'mean')])
+    return {
+        key: {'tests': count, 'yield_pct': round(100 * mean, 1) if mean is not None else None}
+        for key, count, mean in zip(grouped.column('drug_used').to_pylist(),
+                                    grouped.column('responded_count').to_pylist(),
+                                    grouped.column('responded_mean').to_pylist())
+    }
+
+
+def vitals_summary(archive_dir, test_ids, time_range=None):
+    """Sample counts and minimum HR/SBP per test, scanning only matching row groups."""
+    expr = ds.field('test_id').isin(list(test_ids))
+    if time_range is not None:
+        expr = expr & (ds.field('time') >= time_range[0]) & (ds.field('time') <= time_range[1])
+    table = vitals_dataset(archive_dir).to_table(columns=['test_id', 'hr', 'sbp'], filter=expr)
+    return table.group_by('test_id').aggregate([('hr', 'count'), ('hr', 'min'), ('sbp', 'min')])
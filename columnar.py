@@ -0,0 +1,212 @@
+"""Columnar (Parquet) export and import of tests.
+
+``export_test``/``import_test`` move a single test between sites: the file
+holds the vitals as typed columns, and the patient setup, test results and
+phase parameters as JSON in the Parquet key-value metadata. Importing
+rebuilds the session state the test was exported from.
+
+``export_archive`` writes two datasets under one directory:
+
+- ``tests.parquet``: one row per test with its setup, outcome and summary
+  values, sorted by test date.
+- ``vitals.parquet``: every recorded sample, sorted by ``test_id`` and
+  ``seq`` and written in large row groups, so readers filtering on
+  ``test_id`` or ``time`` skip row groups using the Parquet statistics.
+"""
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from events import DRUG_DOSE
+from storage import jsonable
+from vitals_store import COLUMNS, PHASES, VitalsStore
+
+TESTS_FILE = 'tests.parquet'
+VITALS_FILE = 'vitals.parquet'
+ROW_GROUP_ROWS = 1_000_000
+TEST_ROW_GROUP_ROWS = 65536
+FORMAT_VERSION = '1'
+
+AGE_BANDS = ((0, "<20"), (20, "20-39"), (40, "40-59"), (60, "60+"))
+
+# Categorical columns; int32 indices, as an archive can hold thousands of distinct values
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+TESTS_SCHEMA = pa.schema([
+    ('test_id', pa.int64()),
+    ('patient_id', pa.string()),
+    ('test_date', pa.timestamp('s')),
+    ('age', pa.int16()),
+    ('age_band', CATEGORY),
+    ('gender', CATEGORY),
+    ('indication', CATEGORY),
+    ('protocol', CATEGORY),
+    ('drug_used', CATEGORY),
+    ('drug_response', CATEGORY),
+    ('dose_steps', pa.int16()),
+    ('max_dose', pa.float32()),
+    ('result', CATEGORY),
+    ('pattern', CATEGORY),
+    ('positive', pa.bool_()),
+    ('time_to_symptoms', pa.float32()),
+    ('min_hr', pa.float32()),
+    ('min_sbp', pa.float32()),
+])
+
+VITALS_SCHEMA = pa.schema([
+    ('test_id', pa.int64()),
+    ('seq', pa.int64()),
+    ('time', pa.float64()),
+    ('hr', pa.float32()),
+    ('sbp', pa.float32()),
+    ('dbp', pa.float32()),
+    ('symptoms', pa.uint32()),
+    ('phase', pa.uint8()),
+])
+
+
+def age_band(age):
+    if age is None:
+        return None
+    label = None
+    for lower, name in AGE_BANDS:
+        if age >= lower:
+            label = name
+    return label
+
+
+def test_row(record):
+    patient, results = record['patient_data'], record['test_results']
+    result = results.get('result')
+    doses = [e.get('dose') for e in results.get('events') or () if e['kind'] == DRUG_DOSE]
+    return {
+        'test_id': record['id'],
+        'patient_id': patient.get('patient_id'),
+        'test_date': np.datetime64(record['test_date'], 's'),
+        'age': patient.get('age'),
+        'age_band': age_band(patient.get('age')),
+        'gender': patient.get('gender'),
+        'indication': patient.get('indication'),
+        'protocol': patient.get('protocol'),
+        'drug_used': results.get('drug_used'),
+        'drug_response': results.get('drug_response'),
+        'dose_steps': len(doses),
+        'max_dose': max(doses) if doses else None,
+        'result': result,
+        'pattern': results.get('pattern'),
+        'positive': result.startswith("Positive") if result else None,
+        'time_to_symptoms': results.get('time_to_symptoms'),
+        'min_hr': results.get('min_hr'),
+        'min_sbp': results.get('min_sbp'),
+    }
+
+
+def export_archive(storage, out_dir, row_group_rows=ROW_GROUP_ROWS):
+    """Export every test and its vitals from ``storage``; returns row counts."""
+    os.makedirs(out_dir, exist_ok=True)
+    rows = [test_row(record) for record in storage.iter_test_records()]
+    tests = pa.Table.from_pylist(rows, schema=TESTS_SCHEMA).sort_by('test_date')
+    pq.write_table(tests, os.path.join(out_dir, TESTS_FILE), compression='zstd', row_group_size=65536)
+
+    samples = 0
+    with pq.ParquetWriter(os.path.join(out_dir, VITALS_FILE), VITALS_SCHEMA, compression='zstd') as writer:
+        pending, pending_rows = [], 0
+        for test_id in np.sort(tests.column('test_id').to_numpy()):
+            for page in storage.iter_vitals(int(test_id)):
+                n = len(page['seq'])
+                pending.append(pa.table({'test_id': np.full(n, test_id, dtype=np.int64), **page},
+                                        schema=VITALS_SCHEMA))
+                pending_rows += n
+                if pending_rows >= row_group_rows:
+                    writer.write_table(pa.concat_tables(pending), row_group_size=row_group_rows)
+                    samples += pending_rows
+                    pending, pending_rows = [], 0
+        if pending:
+            writer.write_table(pa.concat_tables(pending), row_group_size=row_group_rows)
+            samples += pending_rows
+    return {'tests': tests.num_rows, 'samples': samples}
+
+
+# Per-test files. The vitals columns are the store's, without test_id.
+TEST_VITALS_SCHEMA = pa.schema([f for f in VITALS_SCHEMA if f.name != 'test_id'])
+PHASE_PARAMS = {'Tilt': (('patient_data', 'tilt_angle'),),
+                'Drug': (('test_results', 'drug_used'), ('test_results', 'drug_dose'))}
+
+
+def test_phases(patient_data, test_results, time, phase):
+    # One entry per phase segment in the vitals, with that phase's parameters
+    sources = {'patient_data': patient_data, 'test_results': test_results}
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(phase)) + 1)) if len(phase) else []
+    phases = []
+    for i in starts:
+        name = PHASES[phase[i]]
+        params = {key: sources[src].get(key) for src, key in PHASE_PARAMS.get(name, ())}
+        phases.append({'name': name, 'start_time': float(time[i]), 'params': params})
+    return phases
+
+
+def export_test(dest, patient_data, test_results, phases=None):
+    """Write one test to ``dest`` (a path or writable binary file).
+
+    ``phases`` defaults to the phase segments found in the vitals.
+    """
+    vitals = test_results.get('vitals')
+    if vitals:
+        with vitals.lock:
+            cols = vitals.slice()
+            current_phase = vitals.current_phase
+        columns = {'seq': np.arange(len(cols['time']), dtype=np.int64), **cols}
+    else:
+        columns = {f.name: np.empty(0, dtype=f.type.to_pandas_dtype()) for f in TEST_VITALS_SCHEMA}
+        current_phase = 0
+    if phases is None:
+        phases = test_phases(patient_data, test_results, columns['time'], columns['phase'])
+    metadata = {
+        'tilt.format_version': FORMAT_VERSION,
+        'tilt.patient_data': json.dumps(jsonable(patient_data)),
+        'tilt.test_results': json.dumps(jsonable(test_results)),
+        'tilt.phases': json.dumps(phases),
+        'tilt.current_phase': str(current_phase),
+    }
+    table = pa.table(columns, schema=TEST_VITALS_SCHEMA.with_metadata(metadata))
+    pq.write_table(table, dest, compression='zstd', row_group_size=TEST_ROW_GROUP_ROWS,
+                   write_statistics=True)
+
+
+def read_test_metadata(source):
+    meta = pq.read_schema(source).metadata or {}
+    if meta.get(b'tilt.format_version') != FORMAT_VERSION.encode():
+        raise ValueError("Not a tilt test export")
+    return {
+        'patient_data': json.loads(meta[b'tilt.patient_data']),
+        'test_results': json.loads(meta[b'tilt.test_results']),
+        'phases': json.loads(meta[b'tilt.phases']),
+        'current_phase': int(meta[b'tilt.current_phase']),
+    }
+
+
+def read_test_vitals(source, time_range=None, columns=None):
+    """Vitals from an export, memory-mapped; row groups outside time_range are skipped."""
+    filters = None
+    if time_range is not None:
+        filters = [('time', '>=', time_range[0]), ('time', '<=', time_range[1])]
+    return pq.read_table(source, columns=columns, filters=filters, memory_map=True)
+
+
+def import_test(source):
+    """Rebuild (patient_data, test_results, phases) from an export."""
+    meta = read_test_metadata(source)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    table = read_test_vitals(source)
+    test_results = meta['test_results']
+    if table.num_rows:
+        store = VitalsStore(capacity=table.num_rows)
+        cols = {c: table.column(c).to_numpy() for c in COLUMNS}
+        store.extend(cols['time'], cols['hr'], cols['sbp'], cols['dbp'], cols['symptoms'], cols['phase'])
+        store.current_phase = meta['current_phase']
+        test_results['vitals'] = store
+    return meta['patient_data'], test_results, meta['phases']
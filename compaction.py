@@ -0,0 +1,111 @@
+"""Per-session memory accounting and spilling of recorded vitals to disk.
+
+``compact`` measures what a session's test holds in memory and, once it is
+over the per-session budget (or every session together is over the server
+budget), spills its vitals store to memory-mapped files. Reads of the store
+are unchanged; its running min/max, symptom onsets and the HRV summaries of
+closed phases stay in memory, so a rerun only pages in the samples it
+plots. ``ACCOUNTANT`` keeps the latest account of every session in the
+server process, and of every monitored bed's store (``compact_store``).
+
+The whole store is spilled, open phase included, rather than only the
+closed phases: its columns stay single contiguous arrays, so every reader
+keeps its zero-copy views. The pages of the open phase are the ones being
+written and read, so the OS keeps them in memory; only the older samples are
+dropped once memory is needed, which is what a prefix spill would achieve.
+"""
+import os
+import shutil
+import threading
+import time
+
+from instrumentation import GAUGE_TTL, deep_sizeof
+
+MB = 1 << 20
+SESSION_BUDGET = int(float(os.environ.get('TILT_SESSION_BUDGET_MB', 32)) * MB)
+SERVER_BUDGET = int(float(os.environ.get('TILT_SERVER_BUDGET_MB', 1024)) * MB)
+# Smaller stores are cheaper to keep than to page in
+MIN_SPILL_BYTES = 1 * MB
+
+
+class Accountant:
+    """Latest resident and spilled bytes of every active session and bed."""
+
+    def __init__(self, ttl=GAUGE_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def update(self, session, resident, spilled, bed=False):
+        with self._lock:
+            self._sessions[session] = (resident, spilled, time.monotonic(), bed)
+
+    def remove(self, session):
+        with self._lock:
+            self._sessions.pop(session, None)
+
+    def _expire(self):
+        # Sessions that went quiet are assumed closed; beds are removed with the bed
+        now = time.monotonic()
+        for session in [s for s, (_, _, at, bed) in self._sessions.items() if not bed and now - at > self.ttl]:
+            del self._sessions[session]
+
+    def totals(self):
+        # (sessions, resident bytes, spilled bytes); the bytes include beds
+        with self._lock:
+            self._expire()
+            values = list(self._sessions.values())
+        return sum(not v[3] for v in values), sum(v[0] for v in values), sum(v[1] for v in values)
+
+
+ACCOUNTANT = Accountant()
+
+
+def resident_bytes(results):
+    # Memory-mapped columns count only as their array objects (see deep_sizeof)
+    return deep_sizeof(results)
+
+
+def compact(results, directory, budget=SESSION_BUDGET, server_budget=SERVER_BUDGET, accountant=ACCOUNTANT):
+    """Spill the vitals of an over-budget session; returns {resident, spilled, over}."""
+    resident = resident_bytes(results)
+    vitals = results.get('vitals')
+    _, server, _ = accountant.totals()
+    over = resident > budget or server > server_budget
+    if over and vitals is not None and not vitals.spilled and vitals.nbytes >= MIN_SPILL_BYTES:
+        vitals.spill(directory)
+        resident = resident_bytes(results)
+    spilled = vitals.nbytes if vitals is not None and vitals.spilled else 0
+    return {'resident': resident, 'spilled': spilled, 'over': over}
+
+
+def compact_store(key, store, directory=None, server_budget=SERVER_BUDGET, accountant=ACCOUNTANT):
+    """Account a store no session owns (a bed's); spilled while the server is over budget."""
+    _, server, _ = accountant.totals()
+    if (directory is not None and server > server_budget and not store.spilled
+            and store.nbytes >= MIN_SPILL_BYTES):
+        store.spill(directory)
+    spilled = store.nbytes if store.spilled else 0
+    accountant.update(key, store.nbytes - spilled, spilled, bed=True)
+    return spilled
+
+
+def spill_directory(base):
+    """This process's spill directory under base; directories of stopped servers are removed."""
+    os.makedirs(base, exist_ok=True)
+    for name in os.listdir(base):
+        if name.isdigit() and int(name) != os.getpid() and not _running(int(name)):
+            shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+    path = os.path.join(base, str(os.getpid()))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,142 @@
+"""Static clinical content: checklists, result interpretations and recommendations.
+
+Built once when the module is first imported and shared by every session, so
+a rerun only looks entries up instead of rebuilding them.
+"""
+
+# Preparation checklists, keyed by their checklist_progress category
+CHECKLISTS = {
+    'equipment': (
+        "Motorized tilt table (60-70° capability)",
+        "Foot board and safety restraints",
+        "ECG monitor (3 or 6 lead capability)",
+        "Beat-to-beat BP monitor (finger plethysmography)",
+        "IV access supplies",
+        "Emergency crash cart available",
+        "Defibrillator ready",
+        "Atropine 1mg IV available",
+        "Isoproterenol/nitroglycerin if needed",
+        "Timer/stopwatch",
+        "Emergency lowering capability (<10 sec)",
+    ),
+    'medications': (
+        "Isoproterenol available (if using)",
+        "Nitroglycerin available (if using)",
+        "Atropine 1mg IV (emergency)",
+        "Normal saline 500ml-1L (hydration)",
+        "IV fluids administration set",
+        "Emergency medications checked (not expired)",
+        "Sildenafil/Vardenafil washout confirmed (>24h)",
+        "Tadalafil washout confirmed (>48h)",
+    ),
+    'emergency': (
+        "Crash cart immediately available",
+        "Atropine drawn and labeled",
+        "Defibrillator pads attached",
+        "Oxygen supply ready",
+        "Airway management equipment",
+        "Emergency team contact confirmed",
+        "IV access patent and functional",
+        "Patient consented for procedure",
+        "Emergency lowering procedure reviewed",
+        "Continuous monitoring confirmed",
+    ),
+    'patient_prep': (
+        "Patient fasting confirmed",
+        "Medication status documented",
+        "IV placed >30 min ago",
+        "Room environment optimized",
+        "Patient pre-test vitals stable",
+        "Informed consent obtained",
+    ),
+}
+
+CONTRAINDICATIONS = (
+    "Severe coronary artery disease",
+    "Recent MI (<3 months)",
+    "Severe aortic stenosis",
+    "Severe cerebrovascular disease",
+    "Pregnancy",
+    "Uncontrolled hypertension",
+    "LV outflow tract obstruction",
+    "Severe anemia",
+    "Acute illness/dehydration",
+)
+
+CRITERIA_LABELS = {
+    'bp_drop': "SBP drop ≥40 mmHg",
+    'hr_drop': "HR drop ≥60 bpm",
+    'bradycardia': "HR <40 bpm",
+    'hr_rise': "HR rise ≥30 bpm",
+}
+
+RESULT_TYPES = (
+    "Positive - Vasovagal Syncope",
+    "Positive - Orthostatic Hypotension",
+    "Positive - POTS",
+    "Positive - Pseudosyncope",
+    "Negative - No abnormality detected",
+    "Indeterminate",
+)
+
+INTERPRETATIONS = {
+    "Positive - Vasovagal Syncope":
+        "Delayed accelerating fall in BP with HR changes consistent with vasovagal mechanism. "
+        "Patient reported symptoms similar to spontaneous episodes.",
+    "Positive - Orthostatic Hypotension":
+        "Immediate or early (within 3-5 min) sustained drop in SBP ≥20 mmHg or DBP ≥10 mmHg "
+        "without compensatory tachycardia.",
+    "Positive - POTS":
+        "Sustained HR increase ≥30 bpm (≥40 bpm if <20 years) within 10 min of tilt "
+        "without significant BP drop.",
+    "Positive - Pseudosyncope":
+        "Apparent LOC without significant hemodynamic changes. Consider psychiatric evaluation.",
+    "Negative - No abnormality detected":
+        "No significant hemodynamic changes during passive or drug phase. "
+        "Consider alternative diagnoses or repeat testing.",
+    "Indeterminate":
+        "Inconclusive results. Consider prolonged monitoring or alternative testing.",
+}
+
+RECOMMENDATIONS = {
+    'cardioinhibitory': (
+        "Consider permanent pacemaker if recurrent severe bradycardia/asystole",
+        "Fluid and salt supplementation",
+        "Physical counterpressure maneuvers",
+        "Consider midodrine or fludrocortisone",
+    ),
+    'vasovagal': (
+        "Fluid and salt supplementation",
+        "Physical counterpressure maneuvers",
+        "Consider midodrine, fludrocortisone, or beta-blockers",
+        "Pacemaker NOT indicated for pure vasodepressor response",
+    ),
+    'orthostatic': (
+        "Volume expansion (fluids, salt)",
+        "Compression stockings/abdominal binder",
+        "Head-up sleeping position",
+        "Consider midodrine, droxidopa, or fludrocortisone",
+        "Review medications (stop offending agents)",
+    ),
+    'pots': (
+        "Hydration (2-3L/day) and increased salt intake",
+        "Compression garments",
+        "Exercise training (recumbent initially)",
+        "Consider beta-blockers, ivabradine, or fludrocortisone",
+        "Evaluate for underlying causes",
+    ),
+}
+# Markdown lists, built once rather than on every rerun of the report page
+RECOMMENDATION_TEXT = {key: "\n".join(f"- {item}" for item in items) for key, items in RECOMMENDATIONS.items()}
+DEFAULT_RECOMMENDATION = "Further evaluation based on clinical suspicion."
+
+
+def recommendation(result_type, pattern):
+    """Default treatment recommendations for a result and response pattern."""
+    if "Vasovagal" in result_type:
+        return RECOMMENDATION_TEXT['cardioinhibitory' if "Cardioinhibitory" in pattern else 'vasovagal']
+    if "Orthostatic" in result_type:
+        return RECOMMENDATION_TEXT['orthostatic']
+    if "POTS" in result_type:
+        return RECOMMENDATION_TEXT['pots']
+    return DEFAULT_RECOMMENDATION
@@ -0,0 +1,101 @@
+"""Online detection of syncope, orthostatic hypotension and POTS criteria.
+
+The detector keeps a handful of scalars per criterion and updates them in
+O(1) per sample, so it can sit directly on a streaming feed. Times are in
+minutes since tilt-up, like the vitals store.
+"""
+import threading
+
+from symptoms import Symptom
+
+SYNCOPE_SBP = 70
+SYNCOPE_HR = 40
+OH_SBP_DROP = 20
+OH_DBP_DROP = 10
+POTS_HR_RISE = 30
+POTS_HR_RISE_YOUNG = 40  # patients under 20
+POTS_WINDOW_MIN = 10
+
+ALERT_LABELS = {
+    'syncope': "🚨 CRITICAL: Syncope/ Severe hypotension detected!",
+    'orthostatic_hypotension': "⚠️ Sustained orthostatic BP drop (SBP ≥20 / DBP ≥10 mmHg)",
+    'pots': "⚠️ POTS pattern detected (sustained HR rise without BP drop)",
+}
+
+
+class OnlineDetector:
+    """Tracks tilt-test criteria sample by sample.
+
+    Sustained criteria must hold continuously for ``sustain_s`` seconds; an
+    interruption resets the onset. Each criterion raises one alert, recorded
+    in ``alerts`` with its onset and the time it was met.
+    """
+
+    def __init__(self, baseline_hr, baseline_sbp, baseline_dbp=None, age=None,
+                 sustain_s=30, pots_window_min=POTS_WINDOW_MIN):
+        self.baseline_hr = baseline_hr
+        self.baseline_sbp = baseline_sbp
+        self.baseline_dbp = baseline_dbp
+        self.pots_rise = POTS_HR_RISE_YOUNG if age is not None and age < 20 else POTS_HR_RISE
+        self.sustain = sustain_s / 60.0
+        self.pots_window = pots_window_min
+        self.alerts = []
+        self.met = {}
+        self._onset = {'orthostatic_hypotension': None, 'pots': None}
+        self._lock = threading.Lock()
+
+    def reset(self, baseline_hr, baseline_sbp, baseline_dbp=None):
+        """Start over from new baselines; feeds holding this detector keep feeding it."""
+        with self._lock:
+            self.baseline_hr = baseline_hr
+            self.baseline_sbp = baseline_sbp
+            self.baseline_dbp = baseline_dbp
+            self.alerts = []
+            self.met = {}
+            self._onset = {'orthostatic_hypotension': None, 'pots': None}
+
+    def _raise(self, kind, t, onset):
+        self.met[kind] = t
+        alert = {'kind': kind, 'label': ALERT_LABELS[kind], 'time': t, 'onset': onset}
+        self.alerts.append(alert)
+        return alert
+
+    def _sustained(self, kind, active, t):
+        if not active:
+            self._onset[kind] = None
+            return None
+        if self._onset[kind] is None:
+            self._onset[kind] = t
+        onset = self._onset[kind]
+        if t - onset >= self.sustain:
+            return onset
+        return None
+
+    def update(self, t, hr, sbp, dbp, symptoms=0):
+        new = []
+        with self._lock:
+            if 'syncope' not in self.met and (
+                    symptoms & Symptom.LOC or sbp < SYNCOPE_SBP or hr < SYNCOPE_HR):
+                new.append(self._raise('syncope', t, t))
+
+            sbp_drop = self.baseline_sbp - sbp
+            dbp_drop = self.baseline_dbp - dbp if self.baseline_dbp is not None else 0
+            hypotensive = sbp_drop >= OH_SBP_DROP or dbp_drop >= OH_DBP_DROP
+            if 'orthostatic_hypotension' not in self.met:
+                onset = self._sustained('orthostatic_hypotension', hypotensive, t)
+                if onset is not None:
+                    new.append(self._raise('orthostatic_hypotension', t, onset))
+
+            if 'pots' not in self.met:
+                tachy = hr - self.baseline_hr >= self.pots_rise and sbp_drop < OH_SBP_DROP
+                onset = self._sustained('pots', tachy, t)
+                if onset is not None and onset <= self.pots_window:
+                    new.append(self._raise('pots', t, onset))
+        return new
+
+    def update_many(self, t, hr, sbp, dbp, symptoms=None):
+        new = []
+        for i in range(len(t)):
+            new.extend(self.update(float(t[i]), float(hr[i]), float(sbp[i]), float(dbp[i]),
+                                   int(symptoms[i]) if symptoms is not None else 0))
+        return new
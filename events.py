@@ -0,0 +1,112 @@
+"""Timestamped test events: tilt up/down, drug doses, symptom onsets, status.
+
+``EventLog`` keeps events sorted by time (ties in insertion order) with the
+times in a separate list, so a time range is found with two binary searches
+and queries cost O(log n + k). Times are minutes from the start of the test,
+like the vitals. The log serializes to a list of dicts for the results JSON.
+"""
+import bisect
+
+
+PHASE = 'phase'
+TILT_UP = 'tilt_up'
+TILT_DOWN = 'tilt_down'
+DRUG_DOSE = 'drug_dose'
+SYMPTOM = 'symptom'
+STATUS = 'status'
+
+EVENT_LABELS = {
+    PHASE: "Phase",
+    TILT_UP: "Tilt up",
+    TILT_DOWN: "Tilt down",
+    DRUG_DOSE: "Drug dose",
+    SYMPTOM: "Symptom onset",
+    STATUS: "Test status",
+}
+
+DOSE_UNITS = {'Isoproterenol': "mcg/min", 'Nitroglycerin': "mcg"}
+
+
+class EventLog:
+
+    def __init__(self, events=()):
+        self.times = []
+        self.events = []
+        for event in events:
+            self.add(event['time'], event['kind'], **{k: v for k, v in event.items() if k not in ('time', 'kind')})
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def add(self, time, kind, **detail):
+        if kind not in EVENT_LABELS:
+            raise ValueError(f"Unknown event kind '{kind}'")
+        event = {'time': float(time), 'kind': kind, **detail}
+        # bisect_right keeps events at the same time in the order they were logged
+        i = bisect.bisect_right(self.times, event['time'])
+        self.times.insert(i, event['time'])
+        self.events.insert(i, event)
+        return event
+
+    def between(self, t0, t1, kinds=None):
+        """Events with t0 <= time <= t1, optionally only the given kinds."""
+        lo = bisect.bisect_left(self.times, t0)
+        hi = bisect.bisect_right(self.times, t1)
+        events = self.events[lo:hi]
+        if kinds is not None:
+            events = [e for e in events if e['kind'] in kinds]
+        return events
+
+    def of_kind(self, *kinds):
+        return [e for e in self.events if e['kind'] in kinds]
+
+    def last(self, kind, before=None):
+        # Most recent event of a kind at or before a time
+        hi = len(self.times) if before is None else bisect.bisect_right(self.times, before)
+        for event in reversed(self.events[:hi]):
+            if event['kind'] == kind:
+                return event
+        return None
+
+    def dose_steps(self):
+        """Drug doses with the duration each dose was held (None for the last)."""
+        doses = self.of_kind(DRUG_DOSE)
+        steps = []
+        for i, event in enumerate(doses):
+            end = doses[i + 1]['time'] if i + 1 < len(doses) and doses[i + 1].get('drug') == event.get('drug') else None
+            steps.append({**event, 'duration': end - event['time'] if end is not None else None})
+        return steps
+
+    def align(self, vitals):
+        """Vitals index of the last sample at or before each event (-1 if none)."""
+        with vitals.lock:
+            return vitals.index_at(self.times)
+
+    def to_json(self):
+        return [dict(e) for e in self.events]
+
+
+def as_event_log(value):
+    # Session state holds an EventLog; saved results hold its JSON list
+    if isinstance(value, EventLog):
+        return value
+    return EventLog(value or ())
+
+
+def describe(event):
+    kind = event['kind']
+    if kind == DRUG_DOSE:
+        unit = event.get('unit') or DOSE_UNITS.get(event.get('drug'), "")
+        return f"{event.get('drug', 'Drug')} {event.get('dose')} {unit}".rstrip()
+    if kind == SYMPTOM:
+        return event.get('symptom', "")
+    if kind == STATUS:
+        return event.get('status', "")
+    if kind == PHASE:
+        return event.get('phase', "")
+    if kind == TILT_UP and event.get('angle') is not None:
+        return f"{event['angle']}°"
+    return ""
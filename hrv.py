@@ -0,0 +1,283 @@
+"""Heart rate variability and baroreflex sensitivity from beat-to-beat vitals.
+
+Each sample in the vitals store is treated as one beat with RR = 60000 / HR
+(ms), so the indices only mean something for beat-to-beat feeds. A phase
+whose recent samples are not spaced like its beats (a monitor sampling
+faster than the heart rate, or manual readings minutes apart) gets no
+indices. ``HRVEngine.sync`` consumes only the samples added since the last
+call, as NumPy batches per phase, and keeps running per-phase statistics
+(Welford SDNN, RMSSD, sequence-method BRS) plus the index ranges of each
+phase's samples, so it can be called on every rerun of a long recording.
+Only a BRS sequence still open at the end of a batch is carried to the next.
+
+``summary`` reads only the last ``SPECTRAL_WINDOW_S`` of each phase, found
+through its index ranges: the windowed SDNN/RMSSD and a Lomb-Scargle
+periodogram of the RR series interpolated onto an even ``RESAMPLE_HZ`` grid,
+so its cost is set by the window rather than the recording. The summary of a
+phase that has ended is kept until beats of that phase arrive again.
+"""
+import numpy as np
+
+from vitals_store import PHASES
+
+# Phases with autonomic indices (recovery is excluded)
+HRV_PHASES = (0, 1, 2)
+MIN_BEATS = 30
+SPECTRAL_WINDOW_S = 300
+MIN_SPECTRAL_BEATS = 120
+RESAMPLE_HZ = 4.0
+# Median sample spacing over median RR for a phase to count as beat-to-beat
+BEAT_SPACING = (0.5, 2.0)
+LF_BAND = (0.04, 0.15)
+HF_BAND = (0.15, 0.40)
+FREQS = np.linspace(0.01, 0.5, 246)
+
+# Sequence method thresholds
+BRS_MIN_DSBP = 1.0  # mmHg
+BRS_MIN_DRR = 5.0  # ms
+BRS_MIN_BEATS = 3
+BRS_MIN_R = 0.85
+
+
+def lomb_scargle(t, y, freqs=FREQS):
+    t = np.asarray(t, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64) - np.mean(y)
+    w = 2 * np.pi * np.asarray(freqs)[:, None]
+    tau = np.arctan2(np.sin(2 * w * t).sum(axis=1), np.cos(2 * w * t).sum(axis=1))[:, None] / (2 * w)
+    arg = w * (t - tau)
+    c, s = np.cos(arg), np.sin(arg)
+    return 0.5 * ((c @ y) ** 2 / (c * c).sum(axis=1) + (s @ y) ** 2 / (s * s).sum(axis=1))
+
+
+def band_powers(t_s, rr, freqs=FREQS):
+    if np.any(np.diff(t_s) < 0):
+        order = np.argsort(t_s, kind='stable')
+        t_s, rr = t_s[order], rr[order]
+    grid = np.arange(t_s[0], t_s[-1], 1 / RESAMPLE_HZ)
+    power = lomb_scargle(grid, np.interp(grid, t_s, rr), freqs)
+
+    def band(lo, hi):
+        sel = (freqs >= lo) & (freqs < hi)
+        p, f = power[sel], freqs[sel]
+        return float(np.sum((p[1:] + p[:-1]) * np.diff(f)) / 2)
+
+    lf, hf = band(*LF_BAND), band(*HF_BAND)
+    return {
+        'lf_hf': lf / hf if hf > 0 else None,
+        'lf_nu': 100 * lf / (lf + hf) if lf + hf > 0 else None,
+    }
+
+
+def window_hrv(rr):
+    # SDNN and RMSSD (ms) of consecutive beats
+    n = len(rr)
+    if n < MIN_BEATS:
+        return None, None
+    return float(np.std(rr, ddof=1)), float(np.sqrt(np.sum(np.diff(rr) ** 2) / (n - 1)))
+
+
+def trailing_beats(vitals, segments, window_s=SPECTRAL_WINDOW_S):
+    """Store indices of a phase's samples in its last window_s seconds.
+
+    ``segments`` are the phase's [start, stop) index ranges in the store, in
+    order; only the ranges the window reaches are searched.
+    """
+    time = vitals.column('time')
+    cutoff = time[segments[-1][1] - 1] - window_s / 60.0
+    parts = []
+    for start, stop in reversed(segments):
+        k = int(np.searchsorted(time[start:stop], cutoff, 'right'))
+        parts.append(np.arange(start + k, stop))
+        if k:
+            break
+    return np.concatenate(parts[::-1])
+
+
+def sequence_slopes(sbp, rr, starts, stops):
+    """RR-on-SBP slopes (ms/mmHg) of the sequences sbp/rr[start:stop + 1] that qualify.
+
+    Sums over each sequence come from prefix sums, so every sequence in a
+    batch is fitted at once.
+    """
+    starts, stops = np.asarray(starts, dtype=np.int64), np.asarray(stops, dtype=np.int64)
+    keep = stops - starts + 1 >= BRS_MIN_BEATS
+    starts, stops = starts[keep], stops[keep]
+    if not len(starts):
+        return []
+    # Centred first, so the prefix sums stay small; missing SBP is never inside a sequence
+    finite = np.isfinite(sbp)
+    x = np.where(finite, sbp - sbp[finite].mean(), 0.0)
+    y = rr - rr.mean()
+    sums = [np.concatenate(([0.0], np.cumsum(v))) for v in (x, y, x * x, y * y, x * y)]
+    sx, sy, sxx, syy, sxy = (p[stops + 1] - p[starts] for p in sums)
+    n = stops - starts + 1
+    cxx, cyy, cxy = sxx - sx * sx / n, syy - sy * sy / n, sxy - sx * sy / n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = cxy / np.sqrt(cxx * cyy)
+        slope = cxy / cxx
+    return slope[(cxx > 0) & (r >= BRS_MIN_R)].tolist()
+
+
+class _PhaseStats:
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ssd = 0.0
+        self.last_rr = None
+        self.last_sbp = None
+        self.run = []
+        self.run_dir = 0
+        self.brs_slopes = []
+
+    def update(self, rr, sbp):
+        # rr, sbp: float64 arrays of this phase's new beats, in order
+        k = len(rr)
+        if not k:
+            return
+        # Welford, merged a batch at a time (Chan et al.)
+        mean = float(rr.mean())
+        n = self.n + k
+        delta = mean - self.mean
+        self.m2 += float(((rr - mean) ** 2).sum()) + delta * delta * self.n * k / n
+        self.mean += delta * k / n
+        self.n = n
+        # Successive differences, including the one from the previous batch's last beat
+        if self.last_rr is not None:
+            rr, sbp = np.concatenate(([self.last_rr], rr)), np.concatenate(([self.last_sbp], sbp))
+        drr, dsbp = np.diff(rr), np.diff(sbp)
+        self.ssd += float(drr @ drr)
+        direction = np.where((drr >= BRS_MIN_DRR) & (dsbp >= BRS_MIN_DSBP), 1,
+                             np.where((drr <= -BRS_MIN_DRR) & (dsbp <= -BRS_MIN_DSBP), -1, 0))
+        self._runs(direction, sbp, rr)
+        self.last_rr, self.last_sbp = float(rr[-1]), float(sbp[-1])
+
+    def _runs(self, direction, sbp, rr):
+        # Difference i joins beats i and i + 1; a run of equal nonzero directions is a sequence.
+        # Only the run still open at the end of the batch is kept as beats.
+        if not len(direction):
+            return
+        edges = np.flatnonzero(np.diff(direction)) + 1
+        starts = np.concatenate(([0], edges))
+        stops = np.concatenate((edges, [len(direction)]))  # last beat of each run
+        dirs = direction[starts]
+        carried = self.run if dirs[0] and dirs[0] == self.run_dir else []
+        if not carried:
+            self._close_run()
+        nonzero = dirs != 0
+        starts, stops, dirs = starts[nonzero], stops[nonzero], dirs[nonzero]
+        open_run = len(dirs) and direction[-1] != 0
+        closed = slice(0, len(dirs) - 1 if open_run else len(dirs))
+        if carried and closed.stop:
+            # The run from the previous batch ends in this one
+            x = np.concatenate((np.array(carried)[:, 0], sbp[1:stops[0] + 1]))
+            y = np.concatenate((np.array(carried)[:, 1], rr[1:stops[0] + 1]))
+            self.brs_slopes.extend(sequence_slopes(x, y, [0], [len(x) - 1]))
+            closed = slice(1, closed.stop)
+        self.brs_slopes.extend(sequence_slopes(sbp, rr, starts[closed], stops[closed]))
+        if open_run:
+            # Still the run from the previous batch if it never closed
+            head, a = (carried, 1) if carried and len(dirs) == 1 else ([], starts[-1])
+            b = stops[-1]
+            self.run = head + list(zip(sbp[a:b + 1].tolist(), rr[a:b + 1].tolist()))
+            self.run_dir = int(dirs[-1])
+        else:
+            self.run = []
+            self.run_dir = 0
+
+    def _close_run(self):
+        if self.run:
+            sbp, rr = np.array(self.run).T
+            self.brs_slopes.extend(sequence_slopes(sbp, rr, [0], [len(sbp) - 1]))
+        self.run = []
+        self.run_dir = 0
+
+    def summary(self):
+        if self.n < MIN_BEATS:
+            return None
+        slopes = self.brs_slopes
+        return {
+            'beats': self.n,
+            'mean_rr': self.mean,
+            'sdnn': float(np.sqrt(self.m2 / (self.n - 1))),
+            'rmssd': float(np.sqrt(self.ssd / (self.n - 1))),
+            'brs': float(np.mean(slopes)) if slopes else None,
+            'brs_sequences': len(slopes),
+        }
+
+
+class HRVEngine:
+    """Incremental per-phase HRV/BRS over a VitalsStore."""
+
+    def __init__(self):
+        self.processed = 0
+        self.stats = {p: _PhaseStats() for p in HRV_PHASES}
+        self._summary = None
+        self._summary_at = -1
+        self._closed = {}
+        self.segments = {}
+
+    def sync(self, vitals):
+        with vitals.lock:
+            n = len(vitals)
+            if n <= self.processed:
+                return
+            cols = vitals.slice(self.processed, n)
+        hr = cols['hr'].astype(np.float64)
+        valid = hr > 0
+        rr = 60000.0 / np.where(valid, hr, 1)
+        sbp = cols['sbp'].astype(np.float64)
+        for phase, stats in self.stats.items():
+            sel = valid & (cols['phase'] == phase)
+            if sel.any():
+                stats.update(rr[sel], sbp[sel])
+        # Index ranges of each phase's samples, so a summary reads only the samples it needs
+        phase = cols['phase']
+        edges = np.flatnonzero(np.diff(phase)) + 1
+        for a, b in zip(np.concatenate(([0], edges)).tolist(), np.concatenate((edges, [len(phase)])).tolist()):
+            p = int(phase[a])
+            self._closed.pop(p, None)
+            segments = self.segments.setdefault(p, [])
+            if segments and segments[-1][1] == self.processed + a:
+                segments[-1][1] = self.processed + b
+            else:
+                segments.append([self.processed + a, self.processed + b])
+        self.processed = n
+
+    def summary(self, vitals):
+        # Per-phase indices keyed by phase name; recomputed only after new beats
+        if self._summary_at == self.processed:
+            return self._summary
+        out, windows = {}, {}
+        with vitals.lock:
+            current = vitals.current_phase
+            for phase, stats in self.stats.items():
+                if phase in self._closed or stats.n < MIN_BEATS:
+                    continue
+                # Whole-phase indices are running statistics; only the trailing window is read
+                segments = self.segments[phase]
+                sel = trailing_beats(vitals, segments)
+                windows[phase] = (vitals.time[sel] * 60.0, vitals.hr[sel].astype(np.float64),
+                                  float(vitals.time[segments[0][0]]) * 60.0)
+        for phase, stats in self.stats.items():
+            if phase in self._closed:
+                out[PHASES[phase]] = self._closed[phase]
+                continue
+            if phase not in windows:
+                continue
+            t_s, hr, start_s = windows[phase]
+            t_s, rr = t_s[hr > 0], 60000.0 / hr[hr > 0]
+            if len(rr) < 2 or not BEAT_SPACING[0] <= np.median(np.abs(np.diff(t_s))) * 1000 / np.median(rr) <= BEAT_SPACING[1]:
+                continue
+            result = stats.summary()
+            # Windowed indices once the phase spans a full window
+            sdnn, rmssd = window_hrv(rr) if t_s[-1] - start_s >= SPECTRAL_WINDOW_S else (None, None)
+            result.update(window_sdnn=sdnn, window_rmssd=rmssd, lf_hf=None, lf_nu=None)
+            if len(rr) >= MIN_SPECTRAL_BEATS:
+                result.update(band_powers(t_s, rr))
+            out[PHASES[phase]] = result
+            if phase != current:
+                self._closed[phase] = result
+        self._summary, self._summary_at = out, self.processed
+        return out
@@ -0,0 +1,202 @@
+"""Background ingestion of beat-to-beat vitals from monitor feeds.
+
+A feed is a stream of text records, one per beat, either CSV
+(``time,hr,sbp,dbp[,symptom|symptom...]``) or NDJSON
+(``{"time": ..., "hr": ..., "sbp": ..., "dbp": ..., "symptoms": [...]}``).
+``time`` is seconds since tilt-up; it is stored in minutes like the manually
+entered data points. Header, malformed and non-finite (``nan``, ``inf``)
+records are skipped and counted in ``rejected``. The ``sim`` source
+generates a feed from ``simulator`` for demos and load tests.
+"""
+import json
+import math
+import os
+import socket
+import threading
+import time as _time
+
+import numpy as np
+
+from symptoms import encode_symptoms
+
+# How often the Performing Test page redraws the live panel (seconds)
+FRAME_INTERVAL = 0.5
+
+
+def parse_record(line):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        if line[0] == '{':
+            rec = json.loads(line)
+            values = tuple(float(rec[k]) for k in ('time', 'hr', 'sbp', 'dbp'))
+            symptoms = rec.get('symptoms')
+        else:
+            fields = line.split(',')
+            values = tuple(float(f) for f in fields[:4])
+            if len(values) < 4:
+                return None
+            symptoms = fields[4].split('|') if len(fields) > 4 and fields[4] else ()
+        # "nan" and "inf" parse as floats but are not readings
+        if not all(math.isfinite(v) for v in values):
+            return None
+        t, hr, sbp, dbp = values
+        return (t / 60.0, hr, sbp, dbp, encode_symptoms(symptoms))
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def tail_file(path, stop, poll=0.05):
+    # Follow a file as the monitor appends to it, like `tail -f`
+    while not os.path.exists(path):
+        if stop.wait(poll):
+            return
+    with open(path, 'r') as f:
+        partial = ''
+        while not stop.is_set():
+            chunk = f.read(65536)
+            if not chunk:
+                yield None
+                stop.wait(poll)
+                continue
+            chunk = partial + chunk
+            lines = chunk.split('\n')
+            partial = lines.pop()
+            yield from lines
+
+
+def udp_lines(host, port, stop, timeout=0.2):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    sock.bind((host, port))
+    sock.settimeout(timeout)
+    try:
+        while not stop.is_set():
+            try:
+                data, _ = sock.recvfrom(65536)
+            except socket.timeout:
+                yield None
+                continue
+            yield from data.decode('utf-8', 'replace').splitlines()
+    finally:
+        sock.close()
+
+
+def tcp_lines(host, port, stop, timeout=0.2):
+    sock = socket.create_connection((host, port), timeout=5)
+    sock.settimeout(timeout)
+    try:
+        partial = ''
+        while not stop.is_set():
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                yield None
+                continue
+            if not data:
+                break
+            lines = (partial + data.decode('utf-8', 'replace')).split('\n')
+            partial = lines.pop()
+            yield from lines
+    finally:
+        sock.close()
+
+
+def open_source(kind, target, stop):
+    if kind == 'file':
+        return tail_file(target, stop)
+    if kind == 'sim':
+        # Simulated patient: target is "pattern[@rate_hz[x speed]]"
+        from simulator import paced_lines
+        return paced_lines(target, stop)
+    host, _, port = target.rpartition(':')
+    host = host or '127.0.0.1'
+    if kind == 'udp':
+        return udp_lines(host, int(port), stop)
+    if kind == 'tcp':
+        return tcp_lines(host, int(port), stop)
+    raise ValueError(f"Unknown feed type: {kind}")
+
+
+class Ingestor(threading.Thread):
+    """Reads a feed on a daemon thread and writes it into a VitalsStore.
+
+    Parsed records are buffered and flushed to the store in batches, either
+    when ``batch_size`` records have accumulated or every ``flush_interval``
+    seconds, so the store lock is taken a few times per second rather than
+    once per beat. An optional OnlineDetector sees every flushed batch on the
+    same thread, so alarms don't wait for the page to rerun. ``on_flush`` is
+    called after each batch with (first sample index, samples, new alerts).
+    An optional ``journal.Journal`` receives every batch before storage does.
+    """
+
+    def __init__(self, kind, target, store, detector=None, storage=None, test_id=None,
+                 batch_size=256, flush_interval=0.1, on_flush=None, journal=None):
+        super().__init__(daemon=True, name=f"ingest-{kind}-{target}")
+        self.kind = kind
+        self.target = target
+        self.store = store
+        self.detector = detector
+        self.storage = storage
+        self.test_id = test_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.journal = journal
+        self.stop_event = threading.Event()
+        self.received = 0
+        self.rejected = 0
+        self.error = None
+
+    def stop(self):
+        self.stop_event.set()
+
+    @property
+    def running(self):
+        return self.is_alive() and not self.stop_event.is_set()
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        cols = np.array(batch, dtype=np.float64).T
+        with self.store.lock:
+            first = len(self.store)
+            phase = self.store.current_phase
+            self.store.extend(cols[0], cols[1], cols[2], cols[3], cols[4].astype(np.uint32), phase)
+        if self.journal is not None:
+            self.journal.append_vitals(cols[0], cols[1], cols[2], cols[3], cols[4].astype(np.uint32), phase)
+        if self.storage is not None and self.test_id is not None:
+            self.storage.append_vitals(self.test_id, np.arange(first, first + len(batch)),
+                                       cols[0], cols[1], cols[2], cols[3], cols[4], phase)
+        alerts = []
+        if self.detector is not None:
+            alerts = self.detector.update_many(cols[0], cols[1], cols[2], cols[3], cols[4].astype(np.uint32))
+        self.received += len(batch)
+        if self.on_flush is not None:
+            self.on_flush(first, len(batch), alerts)
+        batch.clear()
+
+    def run(self):
+        batch = []
+        last_flush = _time.monotonic()
+        try:
+            for line in open_source(self.kind, self.target, self.stop_event):
+                if line is not None:
+                    rec = parse_record(line)
+                    if rec is None:
+                        if line.strip():
+                            self.rejected += 1
+                    else:
+                        batch.append(rec)
+                now = _time.monotonic()
+                if len(batch) >= self.batch_size or now - last_flush >= self.flush_interval:
+                    self._flush(batch)
+                    last_flush = now
+        except (OSError, ValueError) as e:
+            self.error = str(e)
+        finally:
+            self._flush(batch)
+            if self.storage is not None:
+                self.storage.flush()
+            self.stop_event.set()
@@ -0,0 +1,197 @@
+"""Rerun timing and session memory metrics with Prometheus text exposition.
+
+``REGISTRY`` is shared by every session in the server process. Code paths
+are timed with ``REGISTRY.timer(name, **labels)`` (or a per-rerun
+``Profile``, which also keeps the spans of the current rerun for the debug
+panel) and recorded as histograms named ``tilt_<name>_seconds``. Session
+memory is a gauge per session that expires when the session goes quiet.
+
+``exposition()`` renders the Prometheus text format; ``write_exposition``
+writes it atomically to a file for a node exporter textfile collector, and
+``serve`` exposes it over HTTP on ``/metrics``.
+"""
+import contextlib
+import http.server
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+GAUGE_TTL = 900.0  # s
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Registry:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = {'counts': [0] * len(self.buckets), 'count': 0, 'sum': 0.0, 'max': 0.0}
+            # Buckets are cumulative in the exposition; store per-bucket counts here
+            i = next((i for i, b in enumerate(self.buckets) if seconds <= b), None)
+            if i is not None:
+                h['counts'][i] += 1
+            h['count'] += 1
+            h['sum'] += seconds
+            h['max'] = max(h['max'], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = (value, time.monotonic())
+
+    def snapshot(self):
+        # {(name, labels): {count, sum, max, mean}}
+        with self._lock:
+            return {key: {'count': h['count'], 'sum': h['sum'], 'max': h['max'],
+                          'mean': h['sum'] / h['count'] if h['count'] else 0.0}
+                    for key, h in self._histograms.items()}
+
+    def exposition(self):
+        now = time.monotonic()
+        lines = []
+        with self._lock:
+            stale = [k for k, (_, at) in self._gauges.items() if now - at > GAUGE_TTL]
+            for key in stale:
+                del self._gauges[key]
+            histograms = sorted(self._histograms.items())
+            gauges = sorted(self._gauges.items())
+            histograms = [(k, dict(h, counts=list(h['counts']))) for k, h in histograms]
+        seen = set()
+        for (name, labels), h in histograms:
+            metric = f"tilt_{name}_seconds"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets, h['counts']):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_label_text(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{metric}_bucket{_label_text(labels + (('le', '+Inf'),))} {h['count']}")
+            lines.append(f"{metric}_sum{_label_text(labels)} {h['sum']:.6f}")
+            lines.append(f"{metric}_count{_label_text(labels)} {h['count']}")
+        for (name, labels), (value, _) in gauges:
+            metric = f"tilt_{name}"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric}{_label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_exposition(self, path):
+        # Write then rename, so collectors never read a partial file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.exposition())
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+
+class Profile:
+    """Spans of one script run, also recorded in the registry."""
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        self.spans = []
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.registry.observe(name, elapsed, **labels)
+            self.spans.append((name, labels, elapsed))
+
+    def mark(self):
+        return time.perf_counter()
+
+    def record(self, name, start, **labels):
+        # For sections that can't be wrapped in a with block; start is from mark()
+        elapsed = time.perf_counter() - start
+        self.registry.observe(name, elapsed, **labels)
+        self.spans.append((name, labels, elapsed))
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+def deep_sizeof(obj, seen=None):
+    """Approximate bytes held by obj: NumPy buffers plus Python containers."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        # Views share their base's buffer
+        return sys.getsizeof(obj) if obj.base is not None else obj.nbytes + sys.getsizeof(obj)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def memory_breakdown(data):
+    # Bytes per top-level key, largest first; locks and threads count as their shell
+    sizes = {key: deep_sizeof(value) for key, value in data.items()}
+    return dict(sorted(sizes.items(), key=lambda kv: -kv[1]))
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve /metrics on a daemon thread; returns the server."""
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name=f"metrics-{port}").start()
+    return server
@@ -0,0 +1,307 @@
+"""Append-only write-ahead journal for tests in progress.
+
+Every sample batch, event and form submission of a test is appended to its
+journal (``test_<id>.wal``) as it is recorded. ``append`` only encodes the
+record and queues it; a writer thread commits everything queued within
+``COMMIT_INTERVAL`` with one write and one fsync (group commit), so appends
+cost the same at any feed rate and at most one commit interval of data is
+at risk. ``sync`` waits until everything appended so far is on disk.
+
+Each line is ``<crc32 hex> <json record>``. Reading stops at the first torn
+or corrupt line, which a crash mid-write leaves at the tail, and reopening a
+journal truncates it there. The first record is a snapshot of the test when
+journaling started; ``recover`` replays the records after it into the
+session's patient data, results, vitals and events. A ``close`` record marks
+the test finished, so it is no longer offered for recovery.
+
+    python journal.py journals/test_12.wal
+"""
+import argparse
+import glob
+import json
+import os
+import threading
+import time as _time
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+from events import PHASE, EventLog
+from storage import jsonable
+from vitals_store import PHASES, VitalsStore
+
+COMMIT_INTERVAL = 0.05  # s
+MAX_PENDING_BYTES = 1 << 20
+RECOVERY_WINDOW = 24 * 3600.0  # s; older unfinished journals are not offered
+VITALS_COLUMNS = ('time', 'hr', 'sbp', 'dbp', 'symptoms', 'phase')
+# Session objects rebuilt on recovery instead of journaled with the results
+NOT_JOURNALED = ('vitals', 'events', 'detector', 'hrv_engine')
+
+
+def journal_path(directory, test_id):
+    return os.path.join(directory, f"test_{test_id}.wal")
+
+
+def encode(record):
+    payload = json.dumps(record, separators=(',', ':')).encode()
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def read_records(path):
+    """(records, valid bytes): every record up to the first torn or corrupt line."""
+    records, valid = [], 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            crc, _, payload = line[:-1].partition(b" ")
+            try:
+                if int(crc, 16) != zlib.crc32(payload):
+                    break
+                records.append(json.loads(payload))
+            except ValueError:
+                break
+            valid += len(line)
+    return records, valid
+
+
+def vitals_columns(time, hr, sbp, dbp, symptoms, phase):
+    # Scalars or arrays as JSON lists
+    return {name: np.atleast_1d(np.asarray(value)).tolist()
+            for name, value in zip(VITALS_COLUMNS, (time, hr, sbp, dbp, symptoms, phase))}
+
+
+class Journal:
+    """One test's journal, written by a group-commit thread."""
+
+    def __init__(self, path, commit_interval=COMMIT_INTERVAL):
+        self.path = path
+        self.commit_interval = commit_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path):
+            # Drop a torn tail so new records follow the last good one
+            _, valid = read_records(path)
+            if os.path.getsize(path) > valid:
+                os.truncate(path, valid)
+        self._file = open(path, 'ab')
+        self._cond = threading.Condition()
+        self._pending = []
+        self._pending_bytes = 0
+        self._appended = 0
+        self._durable = 0
+        self._urgent = False
+        self._stopping = False
+        self.closed = False
+        self.error = None
+        self.commits = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"journal-{os.path.basename(path)}")
+        self._thread.start()
+
+    def __len__(self):
+        return self._appended
+
+    def append(self, kind, **data):
+        line = encode({'type': kind, **data})
+        with self._cond:
+            # Late appends from a feed still attached to a finished test are dropped
+            if self._stopping:
+                return None
+            self._pending.append(line)
+            self._pending_bytes += len(line)
+            self._appended += 1
+            if len(self._pending) == 1 or self._pending_bytes >= MAX_PENDING_BYTES:
+                self._cond.notify_all()
+            return self._appended
+
+    def append_vitals(self, time, hr, sbp, dbp, symptoms, phase):
+        return self.append('vitals', **vitals_columns(time, hr, sbp, dbp, symptoms, phase))
+
+    def append_results(self, results):
+        return self.append('results', results=jsonable({k: v for k, v in results.items() if k not in NOT_JOURNALED}))
+
+    def sync(self, timeout=5.0):
+        """Commit now and wait until every record appended so far is on disk."""
+        with self._cond:
+            target = self._appended
+            self._urgent = True
+            self._cond.notify_all()
+            done = self._cond.wait_for(lambda: self._durable >= target or self.error is not None, timeout)
+        if self.error is not None:
+            raise OSError(self.error)
+        return done
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                if not self._pending:
+                    break
+                # Let more records join this commit unless someone is waiting on it
+                deadline = _time.monotonic() + self.commit_interval
+                while not (self._urgent or self._stopping or self._pending_bytes >= MAX_PENDING_BYTES):
+                    remaining = deadline - _time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, target = self._pending, self._appended
+                self._pending, self._pending_bytes, self._urgent = [], 0, False
+            try:
+                self._file.write(b"".join(batch))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                with self._cond:
+                    self.error = str(e)
+                    self._cond.notify_all()
+                break
+            with self._cond:
+                self._durable = target
+                self.commits += 1
+                self._cond.notify_all()
+        self._file.close()
+
+    def close(self, finished=True):
+        """Commit and stop; a finished test's journal is not offered for recovery."""
+        if self.closed:
+            return
+        if finished:
+            self.append('close', at=datetime.now().isoformat(timespec='seconds'))
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.closed = True
+        with _registry_lock:
+            if _registry.get(os.path.abspath(self.path)) is self:
+                del _registry[os.path.abspath(self.path)]
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def open_journal(path, snapshot=None):
+    """The live Journal for path, shared by every session and feed thread.
+
+    A new journal file starts with the record ``snapshot()`` returns (see
+    ``snapshot_record``).
+    """
+    key = os.path.abspath(path)
+    with _registry_lock:
+        journal = _registry.get(key)
+        if journal is None:
+            fresh = not os.path.exists(path) or os.path.getsize(path) == 0
+            journal = _registry[key] = Journal(path)
+            if fresh and snapshot is not None:
+                journal.append('open', **snapshot())
+        return journal
+
+
+def close_journal(path):
+    """Mark a test finished, whether or not its journal is open in this process."""
+    if os.path.exists(path):
+        open_journal(path).close()
+
+
+def snapshot_record(test_id, patient_data, test_results):
+    # The test as it stands when journaling starts (a new test, or a reopened one)
+    vitals = test_results.get('vitals')
+    cols = vitals.slice() if vitals else None
+    return {
+        'test_id': test_id,
+        'patient_data': jsonable(patient_data),
+        'results': jsonable({k: v for k, v in test_results.items() if k not in NOT_JOURNALED}),
+        'events': [dict(e) for e in test_results.get('events') or ()],
+        'vitals': vitals_columns(*(cols[c] for c in VITALS_COLUMNS)) if cols else None,
+        'phase': vitals.current_phase if vitals is not None else 0,
+    }
+
+
+def recover(path):
+    """Replay a journal: {test_id, patient_data, test_results, finished, records}."""
+    records, _ = read_records(path)
+    test_id, patient_data, results, finished = None, {}, {}, False
+    log, store, phase = EventLog(), VitalsStore(), 0
+
+    def extend(cols):
+        if cols and cols['time']:
+            phases = cols['phase'] if len(cols['phase']) == len(cols['time']) else cols['phase'][0]
+            store.extend(cols['time'], cols['hr'], cols['sbp'], cols['dbp'],
+                         np.asarray(cols['symptoms'], dtype=np.uint32), phases)
+
+    for record in records:
+        kind = record['type']
+        # Records after a close are a finished test that was reopened
+        finished = kind == 'close'
+        if kind == 'open':
+            test_id, patient_data = record['test_id'], record['patient_data']
+            results = dict(record['results'])
+            log = EventLog(record['events'])
+            extend(record['vitals'])
+            phase = record.get('phase', 0)
+        elif kind == 'setup':
+            patient_data = record['patient_data']
+        elif kind == 'results':
+            results = dict(record['results'])
+        elif kind == 'event':
+            event = record['event']
+            log.add(event['time'], event['kind'], **{k: v for k, v in event.items() if k not in ('time', 'kind')})
+            if event['kind'] == PHASE and event.get('phase') in PHASES:
+                phase = PHASES.index(event['phase'])
+        elif kind == 'vitals':
+            extend(record)
+    store.current_phase = phase
+    if len(store):
+        results['vitals'] = store
+    if len(log):
+        results['events'] = log
+    return {'test_id': test_id, 'patient_data': patient_data, 'test_results': results,
+            'finished': finished, 'records': len(records)}
+
+
+def is_finished(path):
+    # Only the last line is read: a finished journal ends with its close record
+    with open(path, 'rb') as f:
+        f.seek(max(os.path.getsize(path) - 512, 0))
+        tail = f.read().rstrip(b"\n").rsplit(b"\n", 1)[-1]
+    return b'{"type":"close"' in tail
+
+
+def unfinished(directory, max_age=RECOVERY_WINDOW):
+    """Journals of tests that were never closed, most recent first."""
+    found = []
+    now = _time.time()
+    for path in glob.glob(os.path.join(directory, 'test_*.wal')):
+        modified = os.path.getmtime(path)
+        if now - modified > max_age or is_finished(path):
+            continue
+        with open(path, 'rb') as f:
+            first = f.readline()
+        try:
+            record = json.loads(first.partition(b" ")[2])
+        except ValueError:
+            continue
+        found.append({'path': path, 'test_id': record.get('test_id'), 'modified': modified,
+                      'patient_id': (record.get('patient_data') or {}).get('patient_id')})
+    return sorted(found, key=lambda j: -j['modified'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check a test journal and summarize what it would recover")
+    parser.add_argument('path')
+    args = parser.parse_args(argv)
+
+    records, valid = read_records(args.path)
+    size = os.path.getsize(args.path)
+    state = recover(args.path)
+    vitals = state['test_results'].get('vitals')
+    print(f"{args.path}: {len(records):,} records, {valid:,} of {size:,} bytes valid"
+          + (f" ({size - valid:,} bytes torn)" if size > valid else ""))
+    print(f"test {state['test_id']} ({state['patient_data'].get('patient_id') or 'Unknown'}): "
+          f"{len(vitals) if vitals else 0:,} samples, {len(state['test_results'].get('events') or ()):,} events, "
+          f"{'finished' if state['finished'] else 'unfinished'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Hemodynamic pattern classification for one test or a whole archive.
+
+Works on NumPy arrays shaped ``(tests, samples)``; shorter tests are padded
+with NaN (see ``pad_ragged``). A single test may be passed as 1-D arrays.
+"""
+import numpy as np
+
+MIXED, CARDIOINHIBITORY, VASODEPRESSOR, POTS, NONSPECIFIC = range(5)
+PATTERNS = (
+    "Mixed (Cardioinhibitory + Vasodepressor)",
+    "Cardioinhibitory (Predominant)",
+    "Vasodepressor (Predominant)",
+    "POTS Pattern",
+    "Nonspecific/Negative",
+)
+
+# Thresholds (bpm / mmHg)
+BP_DROP = 40
+HR_DROP = 60
+BRADYCARDIA = 40
+POTS_HR_RISE = 30
+POTS_MAX_BP_DROP = 10
+
+CRITERIA = ('bp_drop', 'hr_drop', 'bradycardia', 'hr_rise')
+
+
+def pad_ragged(series, fill=np.nan):
+    # Stack variable-length 1-D arrays into a NaN-padded 2-D array
+    lengths = np.fromiter((len(s) for s in series), dtype=np.int64, count=len(series))
+    out = np.full((len(series), lengths.max(initial=0)), fill, dtype=np.float64)
+    mask = np.arange(out.shape[1]) < lengths[:, None]
+    if len(series):
+        out[mask] = np.concatenate([np.asarray(s, dtype=np.float64) for s in series])
+    return out
+
+
+def _first_true(hit):
+    idx = hit.argmax(axis=1)
+    return np.where(hit.any(axis=1), idx, -1)
+
+
+def classify_patterns(baseline_hr, baseline_sbp, hr, sbp, time=None):
+    """Classify each test into one of PATTERNS.
+
+    Returns a dict with the pattern ``code`` per test, its ``label``, the
+    ``min_hr``/``min_sbp`` used, and ``first_index``/``first_time`` mapping
+    each criterion in CRITERIA to the sample where it was first met (-1 and
+    NaN when never met). The POTS rule compares the minimum HR against
+    baseline, so its first index is the first sample at or above the rise.
+    """
+    hr = np.atleast_2d(np.asarray(hr, dtype=np.float64))
+    sbp = np.atleast_2d(np.asarray(sbp, dtype=np.float64))
+    base_hr = np.broadcast_to(np.asarray(baseline_hr, dtype=np.float64), hr.shape[:1])[:, None]
+    base_sbp = np.broadcast_to(np.asarray(baseline_sbp, dtype=np.float64), sbp.shape[:1])[:, None]
+
+    # fmin ignores NaN padding without warnings; all-NaN rows stay NaN
+    min_hr = np.fmin.reduce(hr, axis=1)
+    min_sbp = np.fmin.reduce(sbp, axis=1)
+    max_hr_drop = base_hr[:, 0] - min_hr
+    max_bp_drop = base_sbp[:, 0] - min_sbp
+
+    mixed = (max_bp_drop >= BP_DROP) & (max_hr_drop >= HR_DROP)
+    cardio = (max_hr_drop >= HR_DROP) | (min_hr < BRADYCARDIA)
+    vaso = max_bp_drop >= BP_DROP
+    pots = (-max_hr_drop >= POTS_HR_RISE) & (max_bp_drop < POTS_MAX_BP_DROP)
+    code = np.select([mixed, cardio, vaso, pots],
+                     [MIXED, CARDIOINHIBITORY, VASODEPRESSOR, POTS], default=NONSPECIFIC)
+
+    first_index = {
+        'bp_drop': _first_true(base_sbp - sbp >= BP_DROP),
+        'hr_drop': _first_true(base_hr - hr >= HR_DROP),
+        'bradycardia': _first_true(hr < BRADYCARDIA),
+        'hr_rise': _first_true(hr - base_hr >= POTS_HR_RISE),
+    }
+    first_time = {}
+    if time is not None and hr.shape[1]:
+        time = np.atleast_2d(np.asarray(time, dtype=np.float64))
+        rows = np.arange(time.shape[0])
+        for name, idx in first_index.items():
+            first_time[name] = np.where(idx >= 0, time[rows, np.maximum(idx, 0)], np.nan)
+
+    return {
+        'code': code,
+        'label': np.asarray(PATTERNS, dtype=object)[code],
+        'min_hr': min_hr,
+        'min_sbp': min_sbp,
+        'first_index': first_index,
+        'first_time': first_time,
+    }
@@ -0,0 +1,314 @@
+"""Declarative tilt protocols compiled into indexed phase schedules.
+
+A protocol is a JSON object listing its phases in order::
+
+    {"name": "Isoproterenol Protocol",
+     "phases": [
+        {"phase": "Supine", "minutes": 5, "vitals_every": 5},
+        {"phase": "Tilt", "minutes": 20, "angle": 70, "vitals_every": 3},
+        {"phase": "Drug", "minutes": 15, "angle": 70, "vitals_every": 2, "drug": "Isoproterenol",
+         "doses": [{"at": 0, "dose": 1}, {"at": 5, "dose": 2}, {"at": 10, "dose": 3}]},
+        {"phase": "Recovery", "minutes": 5, "vitals_every": 2}],
+     "stop_on": ["syncope"]}
+
+``phase`` is one of ``vitals_store.PHASES``. Dose times are minutes from the
+start of their phase, in ``events.DOSE_UNITS`` of the drug. ``stop_on`` lists
+detector alert kinds that end the tilt and move the test to Recovery.
+
+``compile_protocol`` turns a definition into a ``Schedule`` of arrays indexed
+by schedule time in ``SLOTS_PER_MIN`` steps, so the expected phase, angle,
+dose and next vitals prompt at any time are a single lookup.
+``PhaseScheduler`` runs a schedule against a clock and reports phase
+changes, vitals prompts and doses as they fall due.
+
+The built-in protocols are below. Sites add their own as ``*.json`` files
+(one protocol or a list) in a protocol directory; a file protocol replaces a
+built-in of the same name.
+"""
+import glob
+import json
+import os
+import time as _time
+
+import numpy as np
+
+from detectors import ALERT_LABELS
+from events import DOSE_UNITS
+from vitals_store import PHASES
+
+SLOTS_PER_MIN = 60  # 1 s resolution
+TILTED = ('Tilt', 'Drug')
+
+BUILTIN = [
+    {'name': "Standard Passive (20-45 min)",
+     'phases': [{'phase': 'Supine', 'minutes': 5, 'vitals_every': 5},
+                {'phase': 'Tilt', 'minutes': 45, 'angle': 70, 'vitals_every': 3},
+                {'phase': 'Recovery', 'minutes': 5, 'vitals_every': 2}],
+     'stop_on': ['syncope']},
+    {'name': "Short Passive (15 min)",
+     'phases': [{'phase': 'Supine', 'minutes': 5, 'vitals_every': 5},
+                {'phase': 'Tilt', 'minutes': 15, 'angle': 70, 'vitals_every': 3},
+                {'phase': 'Recovery', 'minutes': 5, 'vitals_every': 2}],
+     'stop_on': ['syncope']},
+    {'name': "Italian Protocol (Nitroglycerin)",
+     'phases': [{'phase': 'Supine', 'minutes': 5, 'vitals_every': 5},
+                {'phase': 'Tilt', 'minutes': 20, 'angle': 70, 'vitals_every': 3},
+                {'phase': 'Drug', 'minutes': 15, 'angle': 70, 'vitals_every': 2, 'drug': 'Nitroglycerin',
+                 'doses': [{'at': 0, 'dose': 400}]},
+                {'phase': 'Recovery', 'minutes': 5, 'vitals_every': 2}],
+     'stop_on': ['syncope']},
+    {'name': "Isoproterenol Protocol",
+     'phases': [{'phase': 'Supine', 'minutes': 5, 'vitals_every': 5},
+                {'phase': 'Tilt', 'minutes': 20, 'angle': 70, 'vitals_every': 3},
+                {'phase': 'Drug', 'minutes': 15, 'angle': 70, 'vitals_every': 2, 'drug': 'Isoproterenol',
+                 'doses': [{'at': 0, 'dose': 1}, {'at': 5, 'dose': 2}, {'at': 10, 'dose': 3}]},
+                {'phase': 'Recovery', 'minutes': 5, 'vitals_every': 2}],
+     'stop_on': ['syncope']},
+    # Tilt length comes from the setup's max duration
+    {'name': "Custom",
+     'phases': [{'phase': 'Supine', 'minutes': 5, 'vitals_every': 5},
+                {'phase': 'Tilt', 'minutes': 60, 'angle': 70, 'vitals_every': 3},
+                {'phase': 'Recovery', 'minutes': 5, 'vitals_every': 2}],
+     'stop_on': ['syncope']},
+]
+
+
+def validate(definition):
+    """Raise ValueError if a protocol definition is malformed."""
+    name = definition.get('name')
+    if not name:
+        raise ValueError("Protocol has no name")
+    phases = definition.get('phases')
+    if not phases:
+        raise ValueError(f"Protocol '{name}' has no phases")
+    for step in phases:
+        if step.get('phase') not in PHASES:
+            raise ValueError(f"Protocol '{name}': unknown phase '{step.get('phase')}'")
+        if not step.get('minutes', 0) > 0:
+            raise ValueError(f"Protocol '{name}': {step['phase']} needs a positive 'minutes'")
+        if step.get('vitals_every') is not None and not step['vitals_every'] > 0:
+            raise ValueError(f"Protocol '{name}': {step['phase']} 'vitals_every' must be positive")
+        for dose in step.get('doses', ()):
+            if not 0 <= dose.get('at', -1) < step['minutes'] or dose.get('dose') is None:
+                raise ValueError(f"Protocol '{name}': dose {dose} outside its {step['phase']} phase")
+        if step.get('doses') and not step.get('drug'):
+            raise ValueError(f"Protocol '{name}': {step['phase']} has doses but no drug")
+    for kind in definition.get('stop_on', ()):
+        if kind not in ALERT_LABELS:
+            raise ValueError(f"Protocol '{name}': unknown stop criterion '{kind}'")
+    return definition
+
+
+def load_protocols(directory=None):
+    """{name: definition} of the built-in protocols plus any in directory."""
+    protocols = {p['name']: p for p in BUILTIN}
+    if directory and os.path.isdir(directory):
+        for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+            with open(path) as f:
+                loaded = json.load(f)
+            for definition in loaded if isinstance(loaded, list) else [loaded]:
+                try:
+                    validate(definition)
+                except ValueError as e:
+                    raise ValueError(f"{os.path.basename(path)}: {e}") from None
+                protocols[definition['name']] = definition
+    return protocols
+
+
+class Schedule:
+    """A compiled protocol: its steps plus lookup arrays per time slot."""
+
+    def __init__(self, name, steps, doses, stop_on):
+        self.name = name
+        self.steps = steps
+        self.doses = doses
+        self.stop_on = frozenset(stop_on)
+        self.duration = steps[-1]['end']
+        # Schedule time of tilt-up, the zero of test time (the vitals store's clock)
+        tilted = next((s for s in steps if s['phase'] in TILTED), None)
+        self.origin = tilted['start'] if tilted is not None else 0.0
+        n = int(round(self.duration * SLOTS_PER_MIN)) + 1
+        times = np.arange(n) / SLOTS_PER_MIN
+        ends = np.array([s['end'] for s in steps])
+        # Slot k covers [k, k + 1) / SLOTS_PER_MIN; the last slot is the end of the protocol
+        self.step_index = np.minimum(np.searchsorted(ends, times, 'right'), len(steps) - 1).astype(np.int16)
+        self.phase = np.array([PHASES.index(s['phase']) for s in steps], dtype=np.uint8)[self.step_index]
+        self.angle = np.array([s['angle'] for s in steps], dtype=np.float32)[self.step_index]
+        prompts = np.array(sorted(t for s in steps for t in s['prompts']), dtype=np.float64)
+        self.prompts = prompts
+        self.prompts_due = np.searchsorted(prompts, times + 1e-9, 'right').astype(np.int32)
+        self.next_prompt = np.append(prompts, np.inf)[np.searchsorted(prompts, times - 1e-9, 'left')]
+        self.dose_times = np.array([d['time'] for d in doses], dtype=np.float64)
+        self.doses_due = np.searchsorted(self.dose_times, times + 1e-9, 'right').astype(np.int32)
+        # Dose in effect: the last dose given in the current step, else NaN.
+        # Index -1 (no dose yet) hits the sentinel, whose step never matches.
+        dose_values = np.array([d['dose'] for d in doses] + [np.nan], dtype=np.float32)
+        dose_steps = np.array([d['step'] for d in doses] + [-1])
+        last = self.doses_due - 1
+        self.dose = np.where(dose_steps[last] == self.step_index, dose_values[last], np.nan).astype(np.float32)
+
+    def __len__(self):
+        return len(self.step_index)
+
+    def slot(self, t):
+        return min(max(int(t * SLOTS_PER_MIN + 1e-9), 0), len(self.step_index) - 1)
+
+    def at(self, t):
+        """Expected state at schedule time t."""
+        k = self.slot(t)
+        step = self.steps[self.step_index[k]]
+        dose = self.dose[k]
+        return {'step': int(self.step_index[k]), 'phase': int(self.phase[k]), 'angle': float(self.angle[k]),
+                'drug': step.get('drug'), 'dose': None if np.isnan(dose) else float(dose),
+                'next_vitals': float(self.next_prompt[k]), 'remaining': max(step['end'] - t, 0.0)}
+
+    def phases_at(self, times):
+        # Expected phase code of every sample time (test time, minutes since tilt-up)
+        t = np.asarray(times, dtype=np.float64) + self.origin
+        slots = np.clip((t * SLOTS_PER_MIN + 1e-9).astype(np.int64),
+                        0, len(self.step_index) - 1)
+        return self.phase[slots]
+
+    def first_step(self, phase, after=0):
+        # Index of the first step of a phase at or after a step, or None
+        return next((i for i in range(after, len(self.steps)) if self.steps[i]['phase'] == phase), None)
+
+
+def compile_protocol(definition, angle=None, max_tilt=None):
+    """Schedule for a protocol, with the setup's tilt angle and maximum tilt time."""
+    validate(definition)
+    steps, doses, start = [], [], 0.0
+    for i, step in enumerate(definition['phases']):
+        minutes = float(step['minutes'])
+        if step['phase'] == 'Tilt' and max_tilt is not None:
+            minutes = min(minutes, float(max_tilt))
+        tilted = step['phase'] in TILTED
+        every = step.get('vitals_every')
+        end = start + minutes
+        steps.append({
+            'phase': step['phase'], 'start': start, 'end': end, 'minutes': minutes,
+            'angle': float(angle if angle is not None and tilted else step.get('angle', 0 if not tilted else 70)),
+            'drug': step.get('drug'), 'vitals_every': every,
+            # A prompt at the start of the step, then every vitals_every minutes
+            'prompts': list(np.arange(start, end - 1e-9, every)) if every else [],
+        })
+        for dose in sorted(step.get('doses', ()), key=lambda d: d['at']):
+            doses.append({'time': start + dose['at'], 'step': i, 'drug': step['drug'], 'dose': dose['dose'],
+                          'unit': dose.get('unit') or DOSE_UNITS.get(step['drug'])})
+        start = end
+    return Schedule(definition['name'], steps, doses, definition.get('stop_on', ()))
+
+
+class PhaseScheduler:
+    """Runs a schedule against a clock.
+
+    ``elapsed`` is minutes since ``start``. Schedule time runs with it until
+    ``stop`` or ``advance`` jump ahead to a later step; ``tick`` then reports
+    what fell due since the last tick, skipping prompts and doses of skipped
+    steps. Times it reports are test time (``time``): minutes since tilt-up,
+    like the vitals store and detectors, and negative before it.
+    """
+
+    def __init__(self, schedule, clock=_time.monotonic):
+        self.schedule = schedule
+        self.clock = clock
+        self.started = None
+        self.offset = 0.0  # schedule time - test time
+        self.stopped = None
+        self._tilted = None  # elapsed time of tilt-up, once reached
+        self._step = None
+        self._prompts = 0
+        self._doses = 0
+
+    def start(self):
+        self.started = self.clock()
+
+    def elapsed(self):
+        return 0.0 if self.started is None else (self.clock() - self.started) / 60.0
+
+    def position(self):
+        return self.elapsed() + self.offset
+
+    def time(self):
+        """Test time: minutes since tilt-up, or until the scheduled tilt-up while negative."""
+        now = self.elapsed()
+        if self._tilted is None and now + self.offset >= self.schedule.origin:
+            # Reached on schedule; the offset has not changed since
+            self._tilted = self.schedule.origin - self.offset
+        return now - self._tilted if self._tilted is not None else now + self.offset - self.schedule.origin
+
+    @property
+    def finished(self):
+        return self.started is not None and self.position() >= self.schedule.duration
+
+    def state(self):
+        return self.schedule.at(self.position())
+
+    def _jump(self, step):
+        # Move schedule time to the start of a step (or the end of the protocol)
+        target = self.schedule.steps[step]['start'] if step is not None else self.schedule.duration
+        position = self.position()
+        if target <= position:
+            return
+        if self.time() < 0 and target >= self.schedule.origin:
+            # Skipping to or past tilt-up tilts now
+            self._tilted = self.elapsed()
+        self.offset += target - position
+        # Prompts and doses before the target are skipped; those at it are still due
+        self._prompts = int(np.searchsorted(self.schedule.prompts, target - 1e-9, 'left'))
+        self._doses = max(self._doses, int(np.searchsorted(self.schedule.dose_times, target - 1e-9, 'left')))
+
+    def advance(self):
+        """Skip to the next step now."""
+        step = self.schedule.step_index[self.schedule.slot(self.position())] + 1
+        self._jump(step if step < len(self.schedule.steps) else None)
+
+    def stop(self, reason):
+        """End the tilt: jump to the next Recovery step (or the end)."""
+        if self.stopped is None:
+            self.stopped = {'reason': reason, 'time': self.time()}
+        current = int(self.schedule.step_index[self.schedule.slot(self.position())])
+        if self.schedule.steps[current]['phase'] == 'Recovery':
+            return
+        self._jump(self.schedule.first_step('Recovery', current))
+
+    def check(self, alert_kinds):
+        """Stop if a stop criterion was met while tilted; returns the criterion."""
+        if self.stopped is not None or PHASES[self.state()['phase']] not in TILTED:
+            return None
+        kind = next((k for k in alert_kinds if k in self.schedule.stop_on), None)
+        if kind is not None:
+            self.stop(kind)
+        return kind
+
+    def tick(self):
+        """Actions due since the last tick, in order.
+
+        ``{'action': 'phase', ...}`` when a new step starts,
+        ``{'action': 'dose', ...}`` per dose due and ``{'action': 'vitals'}``
+        once however many prompts were missed.
+        """
+        if self.started is None:
+            return []
+        schedule, now = self.schedule, self.time()
+        position = self.position()
+        k = schedule.slot(position)
+        actions = []
+        step = int(schedule.step_index[k])
+        if step != self._step:
+            self._step = step
+            s = schedule.steps[step]
+            actions.append({'action': 'phase', 'time': now, 'step': step, 'phase': PHASES.index(s['phase']),
+                            'angle': s['angle'], 'minutes': s['minutes']})
+        due = int(schedule.doses_due[k])
+        for dose in schedule.doses[self._doses:due]:
+            # Reported at test time, not the dose's schedule time
+            actions.append({'action': 'dose', **dose, 'time': now})
+        self._doses = max(self._doses, due)
+        due = int(schedule.prompts_due[k])
+        if due > self._prompts:
+            self._prompts = due
+            # Prompts missed before the protocol ended are dropped
+            if position < schedule.duration:
+                actions.append({'action': 'vitals', 'time': now, 'phase': int(schedule.phase[k])})
+        return actions
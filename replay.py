@@ -0,0 +1,76 @@
+"""Replay a recorded vitals feed in real time, standing in for a bedside monitor.
+
+    python replay.py recording.csv --file live_feed.csv
+    python replay.py recording.ndjson --udp 127.0.0.1:5005
+    python replay.py recording.csv --tcp 5006 --speed 2
+
+Records use the feed format read by ``ingest.py``; the ``time`` column (seconds)
+paces the replay.
+"""
+import argparse
+import socket
+import sys
+import time
+
+from ingest import parse_record
+
+
+def load(path):
+    records = []
+    with open(path) as f:
+        for line in f:
+            rec = parse_record(line)
+            if rec is not None:
+                records.append((rec[0] * 60.0, line.rstrip('\n')))
+    return records
+
+
+def paced(records, speed, chunk):
+    # Yield groups of lines at the pace given by their timestamps
+    start = time.monotonic()
+    t0 = records[0][0] if records else 0.0
+    for i in range(0, len(records), chunk):
+        group = records[i:i + chunk]
+        delay = (group[0][0] - t0) / speed - (time.monotonic() - start)
+        if delay > 0:
+            time.sleep(delay)
+        yield '\n'.join(line for _, line in group) + '\n'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a vitals recording as a live feed")
+    parser.add_argument('recording')
+    out = parser.add_mutually_exclusive_group(required=True)
+    out.add_argument('--file', help="append records to this file")
+    out.add_argument('--udp', help="send datagrams to host:port")
+    out.add_argument('--tcp', type=int, help="serve records to one client on this port")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument('--chunk', type=int, default=10, help="records sent per write")
+    args = parser.parse_args(argv)
+
+    records = load(args.recording)
+    if not records:
+        sys.exit(f"No records in {args.recording}")
+
+    if args.file:
+        with open(args.file, 'a') as f:
+            for data in paced(records, args.speed, args.chunk):
+                f.write(data)
+                f.flush()
+    elif args.udp:
+        host, _, port = args.udp.rpartition(':')
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for data in paced(records, args.speed, args.chunk):
+            sock.sendto(data.encode(), (host or '127.0.0.1', int(port)))
+    else:
+        server = socket.create_server(('127.0.0.1', args.tcp))
+        print(f"Waiting for a client on port {args.tcp}...")
+        conn, _ = server.accept()
+        with conn:
+            for data in paced(records, args.speed, args.chunk):
+                conn.sendall(data.encode())
+    print(f"Replayed {len(records)} records")
+
+
+if __name__ == '__main__':
+    main()
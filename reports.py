@@ -0,0 +1,191 @@
+"""Tilt table test report rendering, usable with or without Streamlit.
+
+Batch mode renders archived tests in parallel and writes each report to disk
+as soon as it is ready:
+
+    python reports.py tilt_lab.db --out reports/
+    python reports.py exported_tests/ --out reports/ --workers 8
+
+A directory source holds one JSON file per test with ``patient_data`` and
+``test_results`` keys.
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from events import DRUG_DOSE, EVENT_LABELS, as_event_log, describe
+
+
+def generate_report(patient_data, test_results, generated=None):
+    generated = generated or datetime.now()
+    report = f"""
+    TILT TABLE TEST REPORT
+    Generated: {generated.strftime('%Y-%m-%d %H:%M:%S')}
+
+    PATIENT INFORMATION:
+    - Patient ID: {patient_data.get('patient_id', 'N/A')}
+    - Age: {patient_data.get('age', 'N/A')}
+    - Gender: {patient_data.get('gender', 'N/A')}
+    - Weight: {patient_data.get('weight', 'N/A')} kg
+    - Indication: {patient_data.get('indication', 'N/A')}
+
+    TEST PARAMETERS:
+    - Tilt Angle: {test_results.get('tilt_angle', 'N/A')} degrees
+    - Test Duration: {test_results.get('duration', 'N/A')} minutes
+    - Drug Provocation: {test_results.get('drug_used', 'None')}
+
+    BASELINE VITALS:
+    - Baseline HR: {test_results.get('baseline_hr', 'N/A')} bpm
+    - Baseline SBP: {test_results.get('baseline_sbp', 'N/A')} mmHg
+    - Baseline DBP: {test_results.get('baseline_dbp', 'N/A')} mmHg
+
+    RESULTS:
+    - Test Result: {test_results.get('result', 'N/A')}
+    - Minimum HR: {test_results.get('min_hr', 'N/A')} bpm
+    - Minimum SBP: {test_results.get('min_sbp', 'N/A')} mmHg
+    - Symptoms: {test_results.get('symptoms', 'N/A')}
+    - Time to Symptoms: {test_results.get('time_to_symptoms', 'N/A')} min
+
+    INTERPRETATION:
+    {test_results.get('interpretation', 'N/A')}
+
+    RECOMMENDATIONS:
+    {test_results.get('recommendations', 'N/A')}
+    """
+    if test_results.get('events'):
+        report += format_events(as_event_log(test_results['events']))
+    if test_results.get('hrv'):
+        report += format_hrv(test_results['hrv'])
+    return report
+
+
+def _fmt(value, spec):
+    return "N/A" if value is None else format(value, spec)
+
+
+def format_events(log):
+    lines = []
+    steps = log.dose_steps()
+    if steps:
+        lines += ["", "    DRUG ADMINISTRATION:"]
+        for step in steps:
+            held = f", held {step['duration']:.1f} min" if step['duration'] is not None else ""
+            lines.append(f"    - {step['time']:.1f} min: {describe(step)}{held}")
+    other = [e for e in log if e['kind'] != DRUG_DOSE]
+    if other:
+        lines += ["", "    EVENTS:"]
+        for event in other:
+            detail = describe(event)
+            lines.append(f"    - {event['time']:.1f} min: {EVENT_LABELS[event['kind']]}" + (f" ({detail})" if detail else ""))
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def format_hrv(hrv):
+    lines = ["", "    AUTONOMIC INDICES (beat-to-beat):"]
+    for phase, idx in hrv.items():
+        lines.append(
+            f"    - {phase}: SDNN {_fmt(idx['sdnn'], '.1f')} ms, RMSSD {_fmt(idx['rmssd'], '.1f')} ms, "
+            f"LF/HF {_fmt(idx['lf_hf'], '.2f')}, BRS {_fmt(idx['brs'], '.1f')} ms/mmHg "
+            f"({idx['brs_sequences']} sequences, {idx['beats']} beats)")
+    return "\n".join(lines) + "\n"
+
+
+def iter_report_chunks(patient_data, test_results, vitals=None, chunk_rows=5000):
+    # Encoded report followed by the vitals table, formatted a block of rows at a time
+    yield generate_report(patient_data, test_results).encode()
+    if not vitals:
+        return
+    yield b"\n    VITAL SIGNS (time min, HR bpm, SBP mmHg, DBP mmHg):\n"
+    with vitals.lock:
+        n = len(vitals)
+    for start in range(0, n, chunk_rows):
+        block = vitals.slice(start, min(start + chunk_rows, n))
+        lines = [f"    {t:8.2f} {hr:6.0f} {sbp:6.0f} {dbp:6.0f}\n"
+                 for t, hr, sbp, dbp in zip(block['time'].tolist(), block['hr'].tolist(),
+                                            block['sbp'].tolist(), block['dbp'].tolist())]
+        yield "".join(lines).encode()
+
+
+def report_filename(patient_data, test_id=None):
+    name = f"Tilt_Test_Report_{patient_data.get('patient_id') or 'Unknown'}"
+    if test_id is not None:
+        name += f"_{test_id}"
+    return name + ".txt"
+
+
+# Batch mode. Each worker process opens its own database connection once.
+_storage = None
+
+
+def _init_worker(db_url):
+    global _storage
+    if db_url:
+        from storage import open_storage
+        _storage = open_storage(db_url)
+
+
+def _load(item):
+    if _storage is not None:
+        test = _storage.get_test(item)
+        return test['patient_data'], test['test_results'], item
+    with open(item) as f:
+        record = json.load(f)
+    test_id = record.get('id', os.path.splitext(os.path.basename(item))[0])
+    return record.get('patient_data', {}), record.get('test_results', {}), test_id
+
+
+def _render(args):
+    item, out_dir = args
+    try:
+        patient_data, test_results, test_id = _load(item)
+        path = os.path.join(out_dir, report_filename(patient_data, test_id))
+        with open(path, 'w') as f:
+            f.write(generate_report(patient_data, test_results))
+        return path, None
+    except Exception as e:  # keep going; failures are listed at the end
+        return item, str(e)
+
+
+def _list_tests(db_url, limit):
+    from storage import open_storage
+    storage = open_storage(db_url)
+    try:
+        return [t['id'] for t in storage.list_tests(limit=limit)]
+    finally:
+        storage.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render tilt test reports in bulk")
+    parser.add_argument('source', help="SQLite database (file or sqlite:// URL) or directory of JSON tests")
+    parser.add_argument('--out', default='reports', help="output directory")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--limit', type=int, default=1_000_000, help="max tests from a database")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out, exist_ok=True)
+    if os.path.isdir(args.source):
+        db_url = None
+        items = sorted(os.path.join(args.source, f) for f in os.listdir(args.source) if f.endswith('.json'))
+    else:
+        db_url = args.source
+        items = _list_tests(db_url, args.limit)
+
+    done = failed = 0
+    chunksize = max(1, len(items) // (4 * max(args.workers, 1)))
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(db_url,)) as pool:
+        for path, error in pool.map(_render, [(item, args.out) for item in items], chunksize=chunksize):
+            if error:
+                failed += 1
+                print(f"FAILED {path}: {error}", file=sys.stderr)
+            else:
+                done += 1
+    print(f"Wrote {done} reports to {args.out}" + (f", {failed} failed" if failed else ""))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
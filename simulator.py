@@ -0,0 +1,276 @@
+"""Synthetic tilt test physiology for load and classifier testing.
+
+``simulate`` generates a batch of sessions of one response type as 2-D
+``(sessions, samples)`` arrays of HR, SBP, DBP, SpO2 and symptom bitmasks,
+starting at tilt-up (time 0, in minutes like the vitals store). Every
+session draws its own baseline, onset time and response size, and the whole
+batch is computed with array operations, so thousands of short sessions are
+generated per second. Samples after the test would have been stopped
+(a minute after LOC) are NaN, as in ``patterns.pad_ragged``.
+
+Sessions can be replayed through the monitor feed path (``write_feed`` and
+``paced_lines``, the ``sim`` feed kind) or scored against the pattern
+classifier in bulk (``evaluate``):
+
+    python simulator.py evaluate --sessions 2000
+    python simulator.py feed vasovagal.csv --pattern mixed --rate 250
+"""
+import argparse
+import json
+import time as _time
+
+import numpy as np
+
+from patterns import CARDIOINHIBITORY, MIXED, NONSPECIFIC, PATTERNS, POTS, VASODEPRESSOR, classify_patterns
+from symptoms import Symptom, decode_symptoms
+
+RESPONSES = ('mixed', 'cardioinhibitory', 'vasodepressor', 'pots', 'orthostatic', 'pseudosyncope')
+# Pattern code the classifier should give each response; it has no class for
+# orthostatic hypotension (see detectors) or pseudosyncope
+EXPECTED = {
+    'mixed': MIXED,
+    'cardioinhibitory': CARDIOINHIBITORY,
+    'vasodepressor': VASODEPRESSOR,
+    'pots': POTS,
+    'orthostatic': NONSPECIFIC,
+    'pseudosyncope': NONSPECIFIC,
+}
+DRUG_EFFECTS = {
+    # Relative HR change, absolute SBP/DBP change (mmHg), onset time constant (min)
+    'Isoproterenol': (0.25, 5.0, -8.0, 2.0),
+    'Nitroglycerin': (0.15, -12.0, -6.0, 1.5),
+}
+PRODROME = Symptom.LIGHTHEADEDNESS | Symptom.NAUSEA | Symptom.SWEATING
+STOP_AFTER_LOC = 1.0  # min
+
+
+def _ramp(t, start, duration):
+    return np.clip((t - start) / duration, 0.0, 1.0)
+
+
+def simulate(response, sessions=1, rate_hz=1.0, minutes=45.0, noise=1.0, drug=None, drug_time=20.0,
+             stop_on_loc=True, seed=None):
+    """Simulate ``sessions`` tilt tests ending in ``response``.
+
+    With a ``drug``, the passive tilt is negative and the response starts
+    after ``drug_time`` (minutes), on top of the drug's own effect.
+    """
+    if response not in RESPONSES:
+        raise ValueError(f"Unknown response '{response}' (expected one of {', '.join(RESPONSES)})")
+    rng = np.random.default_rng(seed)
+    n = max(int(minutes * 60 * rate_hz), 1)
+    t = (np.arange(n) / (rate_hz * 60.0))[None, :]
+    col = lambda values: np.asarray(values, dtype=np.float64)[:, None]
+
+    base_hr = col(rng.normal(70, 8, sessions).clip(50, 100))
+    base_sbp = col(rng.normal(120, 10, sessions).clip(95, 160))
+    base_dbp = col(rng.normal(75, 7, sessions).clip(55, 95))
+    base_spo2 = col(rng.normal(98, 0.8, sessions).clip(94, 100))
+
+    # Orthostatic adjustment to tilt: HR +5-15 bpm, DBP +3-8 mmHg within a minute
+    settle = 1 - np.exp(-t / 0.5)
+    hr = base_hr + col(rng.uniform(5, 15, sessions)) * settle
+    sbp = base_sbp + 0 * t
+    dbp = base_dbp + col(rng.uniform(3, 8, sessions)) * settle
+    spo2 = base_spo2 + 0 * t
+
+    phase = np.ones((sessions, n), dtype=np.uint8)
+    window_start = 0.0
+    if drug is not None:
+        rel_hr, d_sbp, d_dbp, tau = DRUG_EFFECTS[drug]
+        on = np.where(t >= drug_time, 1 - np.exp(-np.maximum(t - drug_time, 0) / tau), 0.0)
+        hr = hr * (1 + rel_hr * on)
+        sbp = sbp + d_sbp * on
+        dbp = dbp + d_dbp * on
+        phase[:, t[0] >= drug_time] = 2
+        window_start = drug_time
+
+    symptoms = np.zeros((sessions, n), dtype=np.uint32)
+    onset = col(rng.uniform(window_start + 0.3 * (minutes - window_start),
+                            window_start + 0.85 * (minutes - window_start),
+                            sessions))
+    loc_time = np.full((sessions, 1), np.inf)
+
+    if response in ('mixed', 'cardioinhibitory', 'vasodepressor'):
+        fall = col(rng.uniform(1.0, 3.0, sessions))
+        r = _ramp(t, onset, fall)
+        if response == 'mixed':
+            hr = hr - r * (hr - col(rng.uniform(45, 60, sessions)))
+            sbp = sbp - r * col(rng.uniform(45, 70, sessions))
+        elif response == 'cardioinhibitory':
+            # Bradycardia (or pauses) below 40 bpm, BP falls after the HR
+            hr = hr - r ** 0.5 * (hr - col(rng.uniform(20, 38, sessions)))
+            sbp = sbp - _ramp(t, onset + 0.3 * fall, fall) * col(rng.uniform(30, 60, sessions))
+        else:
+            hr = hr - r * hr * col(rng.uniform(0.0, 0.08, sessions))
+            sbp = sbp - r * col(rng.uniform(45, 70, sessions))
+        dbp = dbp - r * col(rng.uniform(20, 35, sessions))
+        spo2 = spo2 - r * col(rng.uniform(0, 3, sessions))
+        loc_time = onset + 0.9 * fall
+        symptoms |= np.where(t >= onset - 1.0, int(PRODROME), 0).astype(np.uint32)
+    elif response == 'pots':
+        # Sustained HR rise of 30-50 bpm within 10 minutes, BP preserved
+        rise = _ramp(t, window_start, col(rng.uniform(2, 8, sessions)))
+        hr = base_hr + col(rng.uniform(32, 50, sessions)) * rise
+        sbp = sbp + col(rng.uniform(-5, 5, sessions)) * rise
+        symptoms |= np.where(rise > 0.5, int(Symptom.PALPITATIONS | Symptom.LIGHTHEADEDNESS), 0).astype(np.uint32)
+    elif response == 'orthostatic':
+        # SBP drop of 20-35 mmHg within 3 minutes of tilt, little HR response
+        r = _ramp(t, window_start, col(rng.uniform(0.5, 3.0, sessions)))
+        sbp = sbp - r * col(rng.uniform(20, 35, sessions))
+        dbp = dbp - r * col(rng.uniform(10, 15, sessions))
+        symptoms |= np.where(r > 0.5, int(Symptom.LIGHTHEADEDNESS | Symptom.BLURRED_VISION), 0).astype(np.uint32)
+    elif response == 'pseudosyncope':
+        # Apparent LOC with normal or raised HR and BP
+        r = _ramp(t, onset - 0.5, 0.5)
+        hr = hr + r * col(rng.uniform(5, 20, sessions))
+        sbp = sbp + r * col(rng.uniform(0, 15, sessions))
+        loc_time = onset
+        symptoms |= np.where(t >= onset - 0.5, int(Symptom.LIGHTHEADEDNESS), 0).astype(np.uint32)
+
+    symptoms |= np.where(t >= loc_time, int(Symptom.LOC), 0).astype(np.uint32)
+
+    if noise:
+        # Beat-to-beat noise plus respiratory (0.25 Hz) and Mayer wave (0.1 Hz) oscillations
+        t_s = t * 60.0
+        phase_shift = rng.uniform(0, 2 * np.pi, (sessions, 2))
+        resp = np.sin(2 * np.pi * 0.25 * t_s + phase_shift[:, :1])
+        mayer = np.sin(2 * np.pi * 0.1 * t_s + phase_shift[:, 1:])
+        hr = hr + noise * (2.0 * resp + rng.normal(0, 1.5, (sessions, n)))
+        sbp = sbp + noise * (3.0 * mayer + rng.normal(0, 2.0, (sessions, n)))
+        dbp = dbp + noise * (1.5 * mayer + rng.normal(0, 1.5, (sessions, n)))
+        spo2 = spo2 + noise * rng.normal(0, 0.3, (sessions, n))
+
+    out = {
+        'time': t[0],
+        'hr': np.maximum(hr, 15).astype(np.float32),
+        'sbp': np.maximum(sbp, 30).astype(np.float32),
+        'dbp': np.minimum(np.maximum(dbp, 15), np.maximum(sbp, 30) - 10).astype(np.float32),
+        'spo2': np.clip(spo2, 80, 100).astype(np.float32),
+        'symptoms': symptoms,
+        'phase': phase,
+        'baseline_hr': base_hr[:, 0],
+        'baseline_sbp': base_sbp[:, 0],
+        'baseline_dbp': base_dbp[:, 0],
+        'response': response,
+    }
+    if stop_on_loc:
+        # The tilt is stopped shortly after LOC
+        stopped = t > loc_time + STOP_AFTER_LOC
+        for key in ('hr', 'sbp', 'dbp', 'spo2'):
+            out[key][stopped] = np.nan
+    return out
+
+
+def session(sim, i=0):
+    # Columns of one simulated session without the samples after the test stopped
+    keep = ~np.isnan(sim['hr'][i])
+    return {key: (sim['time'] if key == 'time' else sim[key][i])[keep]
+            for key in ('time', 'hr', 'sbp', 'dbp', 'spo2', 'symptoms', 'phase')}
+
+
+def to_lines(cols, fmt='csv'):
+    """Monitor feed records (time in seconds) for ``ingest.parse_record``."""
+    # Runs of identical masks share one decoded label list
+    decoded = {}
+    labels = [decoded.setdefault(m, decode_symptoms(m)) for m in cols['symptoms'].tolist()]
+    rows = zip((cols['time'] * 60).tolist(), cols['hr'].tolist(), cols['sbp'].tolist(), cols['dbp'].tolist(),
+               cols['spo2'].tolist(), labels)
+    if fmt == 'ndjson':
+        return [json.dumps({'time': round(t, 3), 'hr': round(hr, 1), 'sbp': round(sbp, 1), 'dbp': round(dbp, 1),
+                            'spo2': round(spo2, 1), 'symptoms': s}) for t, hr, sbp, dbp, spo2, s in rows]
+    return [f"{t:.3f},{hr:.1f},{sbp:.1f},{dbp:.1f},{'|'.join(s)}" for t, hr, sbp, dbp, spo2, s in rows]
+
+
+def write_feed(path, cols, fmt='csv'):
+    with open(path, 'w') as f:
+        if fmt == 'csv':
+            f.write("time,hr,sbp,dbp,symptoms\n")
+        f.write("\n".join(to_lines(cols, fmt)) + "\n")
+
+
+def paced_lines(target, stop, minutes=45.0):
+    """Feed lines for ``pattern[@rate_hz[x speed]]``, released in (scaled) real time."""
+    response, _, rest = target.partition('@')
+    rate, _, speed = rest.partition('x')
+    rate_hz, speed = float(rate or 1), float(speed or 1)
+    cols = session(simulate(response.strip() or 'mixed', rate_hz=rate_hz, minutes=minutes))
+    lines = to_lines(cols)
+    times = cols['time'] * 60 / speed
+    start = _time.monotonic()
+    i = 0
+    while i < len(lines) and not stop.is_set():
+        due = np.searchsorted(times, _time.monotonic() - start, 'right')
+        if due > i:
+            yield from lines[i:due]
+            i = due
+        else:
+            yield None
+            stop.wait(min(0.05, times[i] - (_time.monotonic() - start)))
+
+
+def evaluate(sessions=1000, rate_hz=1.0, minutes=30.0, noise=1.0, drug=None, seed=0):
+    """Confusion counts and per-pattern sensitivity/specificity of classify_patterns."""
+    rng = np.random.default_rng(seed)
+    truth, predicted = [], []
+    for response in RESPONSES:
+        sim = simulate(response, sessions, rate_hz, minutes, noise, drug,
+                       seed=int(rng.integers(2 ** 32)))
+        classified = classify_patterns(sim['baseline_hr'], sim['baseline_sbp'], sim['hr'], sim['sbp'])
+        truth.append(np.full(sessions, EXPECTED[response]))
+        predicted.append(classified['code'])
+    truth, predicted = np.concatenate(truth), np.concatenate(predicted)
+    confusion = np.zeros((len(PATTERNS), len(PATTERNS)), dtype=np.int64)
+    np.add.at(confusion, (truth, predicted), 1)
+    scores = {}
+    for code, label in enumerate(PATTERNS):
+        tp = confusion[code, code]
+        fn = confusion[code].sum() - tp
+        fp = confusion[:, code].sum() - tp
+        tn = confusion.sum() - tp - fn - fp
+        scores[label] = {
+            'sensitivity': tp / (tp + fn) if tp + fn else None,
+            'specificity': tn / (tn + fp) if tn + fp else None,
+        }
+    return {'confusion': confusion, 'scores': scores}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate tilt test sessions")
+    sub = parser.add_subparsers(dest='command', required=True)
+    ev = sub.add_parser('evaluate', help="Score the pattern classifier on simulated sessions")
+    ev.add_argument('--sessions', type=int, default=1000, help="Sessions per response type")
+    ev.add_argument('--rate', type=float, default=1.0)
+    ev.add_argument('--minutes', type=float, default=30.0)
+    ev.add_argument('--noise', type=float, default=1.0)
+    ev.add_argument('--drug', choices=list(DRUG_EFFECTS))
+    feed = sub.add_parser('feed', help="Write one session as a monitor feed recording for replay.py")
+    feed.add_argument('out')
+    feed.add_argument('--pattern', choices=RESPONSES, default='mixed')
+    feed.add_argument('--rate', type=float, default=1.0)
+    feed.add_argument('--minutes', type=float, default=45.0)
+    feed.add_argument('--noise', type=float, default=1.0)
+    feed.add_argument('--drug', choices=list(DRUG_EFFECTS))
+    feed.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+    feed.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == 'evaluate':
+        start = _time.perf_counter()
+        result = evaluate(args.sessions, args.rate, args.minutes, args.noise, args.drug)
+        elapsed = _time.perf_counter() - start
+        total = args.sessions * len(RESPONSES)
+        print(f"{total:,} sessions in {elapsed:.2f} s ({total / elapsed:,.0f}/s)")
+        for label, s in result['scores'].items():
+            fmt = lambda v: "  n/a" if v is None else f"{100 * v:5.1f}%"
+            print(f"{label:<42} sensitivity {fmt(s['sensitivity'])}  specificity {fmt(s['specificity'])}")
+    else:
+        sim = simulate(args.pattern, 1, args.rate, args.minutes, args.noise, args.drug, seed=args.seed)
+        cols = session(sim)
+        write_feed(args.out, cols, args.format)
+        print(f"{args.out}: {len(cols['time']):,} samples, baseline HR {sim['baseline_hr'][0]:.0f} bpm, "
+              f"SBP {sim['baseline_sbp'][0]:.0f} mmHg")
+
+
+if __name__ == '__main__':
+    main()
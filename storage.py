@@ -0,0 +1,376 @@
+"""Persistent storage for patients, tests, phases and vitals samples.
+
+``open_storage`` picks a backend from a URL (``sqlite:///tilt_lab.db``);
+other backends can be registered in ``BACKENDS`` by implementing
+``StorageBackend``. The SQLite backend runs in WAL mode so several labs can
+read while one session writes, and buffers vitals for batched inserts.
+"""
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from vitals_store import VitalsStore
+
+PAGE_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    patient_id TEXT PRIMARY KEY,
+    age INTEGER,
+    gender TEXT,
+    weight REAL,
+    indication TEXT,
+    history TEXT,
+    medications TEXT,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL REFERENCES patients(patient_id),
+    test_date TEXT NOT NULL,
+    protocol TEXT,
+    setup_json TEXT NOT NULL DEFAULT '{}',
+    results_json TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_tests_patient_date ON tests(patient_id, test_date);
+CREATE INDEX IF NOT EXISTS idx_tests_date ON tests(test_date);
+CREATE TABLE IF NOT EXISTS phases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    test_id INTEGER NOT NULL REFERENCES tests(id),
+    name TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    params_json TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_phases_test ON phases(test_id);
+CREATE TABLE IF NOT EXISTS vitals (
+    test_id INTEGER NOT NULL REFERENCES tests(id),
+    seq INTEGER NOT NULL,
+    time REAL NOT NULL,
+    hr REAL,
+    sbp REAL,
+    dbp REAL,
+    symptoms INTEGER NOT NULL DEFAULT 0,
+    phase INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (test_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS checklist_templates (
+    category TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    items_json TEXT NOT NULL,
+    PRIMARY KEY (category, version)
+);
+CREATE TABLE IF NOT EXISTS checklists (
+    room TEXT NOT NULL,
+    shift TEXT NOT NULL,
+    category TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    mask INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (shift, room, category)
+) WITHOUT ROWID;
+"""
+
+
+def jsonable(data):
+    # Keep the JSON-serializable part of a session dict (drops stores, detectors...);
+    # objects with a to_json method are stored as what it returns
+    out = {}
+    for key, value in data.items():
+        if isinstance(value, np.generic):
+            value = value.item()
+        elif hasattr(value, 'to_json'):
+            value = value.to_json()
+        if isinstance(value, (str, int, float, bool, type(None), list, dict)):
+            out[key] = value
+    return out
+
+
+class StorageBackend:
+    """Interface every storage backend implements."""
+
+    def save_patient(self, patient_data):
+        raise NotImplementedError
+
+    def create_test(self, patient_data):
+        raise NotImplementedError
+
+    def update_test(self, test_id, setup=None, results=None):
+        raise NotImplementedError
+
+    def add_phase(self, test_id, name, params=None):
+        raise NotImplementedError
+
+    def append_vitals(self, test_id, seq, time, hr, sbp, dbp, symptoms, phase=0):
+        raise NotImplementedError
+
+    def flush(self):
+        raise NotImplementedError
+
+    def list_tests(self, patient_id=None, limit=100):
+        raise NotImplementedError
+
+    def get_test(self, test_id):
+        raise NotImplementedError
+
+    def iter_test_records(self, batch_size=1000):
+        raise NotImplementedError
+
+    def vitals_page(self, test_id, after_seq=-1, page_size=PAGE_SIZE):
+        raise NotImplementedError
+
+    def save_checklist_template(self, category, version, items):
+        raise NotImplementedError
+
+    def checklist_template(self, category, version):
+        raise NotImplementedError
+
+    def load_checklists(self, room, shift):
+        raise NotImplementedError
+
+    def set_checklist_item(self, room, shift, category, version, total, bit, value):
+        raise NotImplementedError
+
+    def replace_checklist(self, room, shift, category, version, mask, completed, total):
+        raise NotImplementedError
+
+    def checklist_overview(self, shift):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def iter_vitals(self, test_id, page_size=PAGE_SIZE):
+        # Keyset pagination: each page starts after the last seq of the previous one
+        after = -1
+        while True:
+            page = self.vitals_page(test_id, after, page_size)
+            if not len(page['seq']):
+                return
+            yield page
+            after = int(page['seq'][-1])
+
+    def load_vitals(self, test_id, page_size=PAGE_SIZE):
+        """Fill one VitalsStore a page at a time, yielding it after each page.
+
+        Nothing is read until the generator is advanced, and the store is
+        complete once it is exhausted, so a caller can show progress or stop
+        after the pages it needs. ``current_phase`` follows the last sample
+        loaded, so samples recorded after reopening continue its phase.
+        """
+        store = None
+        for page in self.iter_vitals(test_id, page_size):
+            if store is None:
+                store = VitalsStore(capacity=len(page['seq']))
+            store.extend(page['time'], page['hr'], page['sbp'], page['dbp'], page['symptoms'], page['phase'])
+            store.current_phase = int(page['phase'][-1])
+            yield store
+
+
+class SQLiteStorage(StorageBackend):
+
+    def __init__(self, path, batch_size=2000):
+        self.path = path
+        self.batch_size = batch_size
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._lock = threading.RLock()
+        self._pending = []
+
+    def _migrate(self):
+        # Columns added after the first release
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(vitals)")}
+        if 'phase' not in columns:
+            self._conn.execute("ALTER TABLE vitals ADD COLUMN phase INTEGER NOT NULL DEFAULT 0")
+
+    def save_patient(self, patient_data):
+        p = patient_data
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO patients (patient_id, age, gender, weight, indication, history, medications, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(patient_id) DO UPDATE SET age=excluded.age, gender=excluded.gender, "
+                "weight=excluded.weight, indication=excluded.indication, history=excluded.history, "
+                "medications=excluded.medications, updated_at=excluded.updated_at",
+                (p.get('patient_id', ''), p.get('age'), p.get('gender'), p.get('weight'),
+                 p.get('indication'), p.get('history'), p.get('medications'),
+                 datetime.now().isoformat(timespec='seconds')))
+
+    def create_test(self, patient_data):
+        self.save_patient(patient_data)
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO tests (patient_id, test_date, protocol, setup_json) VALUES (?, ?, ?, ?)",
+                (patient_data.get('patient_id', ''), datetime.now().isoformat(timespec='seconds'),
+                 patient_data.get('protocol'), json.dumps(jsonable(patient_data))))
+            return cur.lastrowid
+
+    def update_test(self, test_id, setup=None, results=None):
+        with self._lock, self._conn:
+            if setup is not None:
+                self._conn.execute("UPDATE tests SET setup_json = ?, protocol = ? WHERE id = ?",
+                                   (json.dumps(jsonable(setup)), setup.get('protocol'), test_id))
+            if results is not None:
+                self._conn.execute("UPDATE tests SET results_json = ? WHERE id = ?",
+                                   (json.dumps(jsonable(results)), test_id))
+
+    def add_phase(self, test_id, name, params=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO phases (test_id, name, started_at, params_json) VALUES (?, ?, ?, ?)",
+                (test_id, name, datetime.now().isoformat(timespec='seconds'), json.dumps(params or {})))
+
+    def append_vitals(self, test_id, seq, time, hr, sbp, dbp, symptoms, phase=0):
+        # Scalars or equal-length arrays; rows are buffered and written in batches
+        seq, time, hr, sbp, dbp, symptoms = (np.atleast_1d(a) for a in (seq, time, hr, sbp, dbp, symptoms))
+        phase = np.broadcast_to(np.asarray(phase, dtype=np.int64), seq.shape)
+        rows = zip([test_id] * len(seq), seq.tolist(), time.tolist(), hr.tolist(),
+                   sbp.tolist(), dbp.tolist(), symptoms.astype(np.int64).tolist(), phase.tolist())
+        with self._lock:
+            self._pending.extend(rows)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO vitals (test_id, seq, time, hr, sbp, dbp, symptoms, phase) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+            self._pending = []
+
+    def list_tests(self, patient_id=None, limit=100):
+        query = "SELECT id, patient_id, test_date, protocol FROM tests"
+        args = ()
+        if patient_id:
+            query += " WHERE patient_id = ?"
+            args = (patient_id,)
+        query += " ORDER BY test_date DESC, id DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(query, args + (limit,)).fetchall()
+        return [dict(zip(('id', 'patient_id', 'test_date', 'protocol'), r)) for r in rows]
+
+    def get_test(self, test_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, patient_id, test_date, setup_json, results_json FROM tests WHERE id = ?",
+                (test_id,)).fetchone()
+            if row is None:
+                return None
+            phases = self._conn.execute(
+                "SELECT name, started_at, params_json FROM phases WHERE test_id = ? ORDER BY id",
+                (test_id,)).fetchall()
+        return {
+            'id': row[0],
+            'patient_id': row[1],
+            'test_date': row[2],
+            'patient_data': json.loads(row[3]),
+            'test_results': json.loads(row[4]),
+            'phases': [{'name': n, 'started_at': s, 'params': json.loads(p)} for n, s, p in phases],
+        }
+
+    def iter_test_records(self, batch_size=1000):
+        # Every test's id, date, setup and results, in id order
+        after = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, test_date, setup_json, results_json FROM tests WHERE id > ? ORDER BY id LIMIT ?",
+                    (after, batch_size)).fetchall()
+            if not rows:
+                return
+            for test_id, test_date, setup, results in rows:
+                yield {'id': test_id, 'test_date': test_date,
+                       'patient_data': json.loads(setup), 'test_results': json.loads(results)}
+            after = rows[-1][0]
+
+    def vitals_page(self, test_id, after_seq=-1, page_size=PAGE_SIZE):
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, time, hr, sbp, dbp, symptoms, phase FROM vitals "
+                "WHERE test_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (test_id, after_seq, page_size)).fetchall()
+        cols = np.array(rows, dtype=np.float64).reshape(-1, 7).T
+        return {
+            'seq': cols[0].astype(np.int64),
+            'time': cols[1],
+            'hr': cols[2],
+            'sbp': cols[3],
+            'dbp': cols[4],
+            'symptoms': cols[5].astype(np.uint32),
+            'phase': cols[6].astype(np.uint8),
+        }
+
+    def save_checklist_template(self, category, version, items):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO checklist_templates (category, version, items_json) "
+                               "VALUES (?, ?, ?)", (category, version, json.dumps(list(items))))
+
+    def checklist_template(self, category, version):
+        with self._lock:
+            row = self._conn.execute("SELECT items_json FROM checklist_templates WHERE category = ? AND version = ?",
+                                     (category, version)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_checklists(self, room, shift):
+        with self._lock:
+            rows = self._conn.execute("SELECT category, version, mask, completed FROM checklists "
+                                      "WHERE shift = ? AND room = ?", (shift, room)).fetchall()
+        return {c: {'version': v, 'mask': m, 'completed': n} for c, v, m, n in rows}
+
+    def set_checklist_item(self, room, shift, category, version, total, bit, value):
+        # One statement, so ticks from several sessions never lose each other's bits;
+        # the count moves only when the bit actually changes
+        value = int(value)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO checklists (room, shift, category, version, mask, completed, total, updated_at) "
+                "VALUES (:room, :shift, :category, :version, :bit * :value, :value, :total, :now) "
+                "ON CONFLICT(shift, room, category) DO UPDATE SET "
+                "completed = completed + :value - ((mask & :bit) != 0), "
+                "mask = CASE WHEN :value THEN mask | :bit ELSE mask & ~:bit END, "
+                "updated_at = excluded.updated_at",
+                {'room': room, 'shift': shift, 'category': category, 'version': version, 'bit': bit,
+                 'value': value, 'total': total, 'now': datetime.now().isoformat(timespec='seconds')})
+
+    def replace_checklist(self, room, shift, category, version, mask, completed, total):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checklists (room, shift, category, version, mask, completed, total, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (room, shift, category, version, mask, completed, total, datetime.now().isoformat(timespec='seconds')))
+
+    def checklist_overview(self, shift):
+        # Every room's checklists for a shift in one query
+        with self._lock:
+            rows = self._conn.execute("SELECT room, category, completed, total, updated_at FROM checklists "
+                                      "WHERE shift = ? ORDER BY room, category", (shift,)).fetchall()
+        return [dict(zip(('room', 'category', 'completed', 'total', 'updated_at'), r)) for r in rows]
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+BACKENDS = {'sqlite': SQLiteStorage}
+
+
+def open_storage(url):
+    scheme, sep, rest = url.partition('://')
+    if not sep:
+        scheme, rest = 'sqlite', '/' + url
+    if scheme not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{scheme}' (available: {', '.join(BACKENDS)})")
+    return BACKENDS[scheme](rest[1:] if rest.startswith('/') else rest)
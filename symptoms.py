@@ -0,0 +1,105 @@
+"""Symptom vocabulary and bitmask encoding for recorded samples.
+
+Every symptom offered by the passive and drug phase multiselects maps to one
+bit of a ``Symptom`` flag; a sample stores the OR of its symptoms as a
+single integer. The queries below work on whole columns of masks at once.
+"""
+import enum
+
+import numpy as np
+
+
+class Symptom(enum.IntFlag):
+    LIGHTHEADEDNESS = 1 << 0
+    NAUSEA = 1 << 1
+    SWEATING = 1 << 2
+    BLURRED_VISION = 1 << 3
+    PALPITATIONS = 1 << 4
+    CHEST_DISCOMFORT = 1 << 5
+    TREMULOUSNESS = 1 << 6
+    LOC = 1 << 7
+    HEADACHE = 1 << 8
+
+
+# Multiselect labels; the drug phase's "LOC" is the same event as "Complete LOC"
+LABELS = {
+    "Lightheadedness": Symptom.LIGHTHEADEDNESS,
+    "Nausea": Symptom.NAUSEA,
+    "Sweating": Symptom.SWEATING,
+    "Blurred vision": Symptom.BLURRED_VISION,
+    "Palpitations": Symptom.PALPITATIONS,
+    "Chest discomfort": Symptom.CHEST_DISCOMFORT,
+    "Tremulousness": Symptom.TREMULOUSNESS,
+    "Complete LOC": Symptom.LOC,
+    "Headache": Symptom.HEADACHE,
+    "LOC": Symptom.LOC,
+}
+# One display name per flag, in bit order
+NAMES = {flag: label for label, flag in reversed(list(LABELS.items()))}
+MEMBERS = list(Symptom)
+
+PRODROME = (Symptom.LIGHTHEADEDNESS | Symptom.NAUSEA | Symptom.SWEATING
+            | Symptom.BLURRED_VISION | Symptom.TREMULOUSNESS)
+
+
+def encode_symptoms(symptoms):
+    mask = 0
+    for s in symptoms or ():
+        mask |= LABELS.get(s, 0)
+    return int(mask)
+
+
+def decode_symptoms(mask):
+    return [NAMES[flag] for flag in MEMBERS if mask & flag]
+
+
+def bit_matrix(masks):
+    # (samples, symptoms) boolean matrix, one column per Symptom member
+    masks = np.asarray(masks, dtype=np.uint32)
+    shifts = np.array([flag.bit_length() - 1 for flag in MEMBERS], dtype=np.uint32)
+    return ((masks[:, None] >> shifts) & 1).astype(bool)
+
+
+def first_onsets(time, masks):
+    """First time each symptom was recorded, or None."""
+    time = np.asarray(time, dtype=np.float64)
+    bits = bit_matrix(masks)
+    onset = np.where(bits, time[:, None], np.inf).min(axis=0, initial=np.inf)
+    return {NAMES[flag]: None if np.isinf(t) else float(t) for flag, t in zip(MEMBERS, onset)}
+
+
+def first_time_matching(time, masks, flags):
+    time = np.asarray(time, dtype=np.float64)
+    hit = (np.asarray(masks, dtype=np.uint32) & int(flags)) != 0
+    return float(time[hit].min()) if hit.any() else None
+
+
+def co_occurrence(masks):
+    """Symptom x symptom counts of samples where both were recorded.
+
+    The diagonal holds how many samples recorded each symptom.
+    """
+    bits = bit_matrix(masks).astype(np.int64)
+    return bits.T @ bits
+
+
+def prodrome_to_loc(time, masks):
+    prodrome = first_time_matching(time, masks, PRODROME)
+    loc = first_time_matching(time, masks, Symptom.LOC)
+    return {
+        'prodrome': prodrome,
+        'loc': loc,
+        'interval': loc - prodrome if prodrome is not None and loc is not None else None,
+    }
+
+
+def summarize(time, masks):
+    # Everything the Analysis step and report need from the symptom column
+    masks = np.asarray(masks, dtype=np.uint32)
+    present = int(np.bitwise_or.reduce(masks)) if len(masks) else 0
+    return {
+        'recorded': decode_symptoms(present),
+        'onsets': {k: v for k, v in first_onsets(time, masks).items() if v is not None},
+        'co_occurrence': co_occurrence(masks),
+        **prodrome_to_loc(time, masks),
+    }
@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import pytest
+
+from checklists import ChecklistState, Template, current_shift, overview, register_templates
+from storage import SQLiteStorage
+
+SHIFT = "2026-01-05 Day"
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'tilt.db'))
+    yield storage
+    storage.close()
+
+
+def templates(**checklists):
+    return {category: Template(category, items) for category, items in checklists.items()}
+
+
+def test_ticks_are_shared_by_sessions_in_a_room(storage):
+    v1 = register_templates(storage, templates(Prep=['IV line', 'ECG leads', 'BP cuff', 'Consent']))
+    a = ChecklistState(storage, 'Lab 1', SHIFT, v1)
+    b = ChecklistState(storage, 'Lab 1', SHIFT, v1)
+    a.set('Prep', 'IV line', True)
+    b.set('Prep', 'Consent', True)
+    b.set('Prep', 'Consent', True)  # ticking twice counts once
+    a.refresh()
+    assert a.checked('Prep', 'IV line') and a.checked('Prep', 'Consent')
+    assert not a.checked('Prep', 'ECG leads')
+    assert a.progress('Prep') == 50
+    b.set('Prep', 'IV line', False)
+    assert ChecklistState(storage, 'Lab 1', SHIFT, v1).progress('Prep') == 25
+    assert ChecklistState(storage, 'Lab 2', SHIFT, v1).progress('Prep') == 0
+    assert ChecklistState(storage, 'Lab 1', "2026-01-05 Night", v1).progress('Prep') == 0
+
+
+def test_new_template_version_remaps_ticks(storage):
+    v1 = register_templates(storage, templates(Prep=['IV line', 'ECG leads', 'BP cuff', 'Consent']))
+    state = ChecklistState(storage, 'Lab 1', SHIFT, v1)
+    for item in ('IV line', 'BP cuff', 'Consent'):
+        state.set('Prep', item, True)
+
+    # Items reordered, one removed and one added
+    v2 = register_templates(storage, templates(Prep=['Consent', 'Crash cart', 'IV line', 'ECG leads']))
+    assert v2['Prep'].version != v1['Prep'].version
+    state = ChecklistState(storage, 'Lab 1', SHIFT, v2)
+    assert [item for item in v2['Prep'].items if state.checked('Prep', item)] == ['Consent', 'IV line']
+    assert state.completed['Prep'] == 2 and state.progress('Prep') == 50
+    # The remapped state is saved under the new version
+    assert storage.load_checklists('Lab 1', SHIFT)['Prep']['version'] == v2['Prep'].version
+    state.set('Prep', 'Crash cart', True)
+    assert ChecklistState(storage, 'Lab 1', SHIFT, v2).progress('Prep') == 75
+
+
+def test_unknown_old_version_starts_empty(storage):
+    old = templates(Prep=['IV line', 'ECG leads'])
+    ChecklistState(storage, 'Lab 1', SHIFT, old).set('Prep', 'IV line', True)  # never registered
+    state = ChecklistState(storage, 'Lab 1', SHIFT, register_templates(storage, templates(Prep=['IV line'])))
+    assert not state.checked('Prep', 'IV line') and state.progress('Prep') == 0
+
+
+def test_overview(storage):
+    v1 = register_templates(storage, templates(Prep=['A', 'B'], Safety=['C', 'D', 'E', 'F']))
+    ChecklistState(storage, 'Lab 1', SHIFT, v1).set('Prep', 'A', True)
+    lab2 = ChecklistState(storage, 'Lab 2', SHIFT, v1)
+    lab2.set('Safety', 'C', True)
+    lab2.set('Safety', 'D', True)
+    assert overview(storage, SHIFT, v1) == {'Lab 1': {'Prep': 50}, 'Lab 2': {'Safety': 50}}
+
+
+def test_too_many_items():
+    with pytest.raises(ValueError):
+        Template('Long', [str(i) for i in range(64)])
+
+
+def test_current_shift():
+    assert current_shift(datetime(2026, 1, 5, 6, 59)) == "2026-01-04 Night"
+    assert current_shift(datetime(2026, 1, 5, 7, 0)) == "2026-01-05 Day"
+    assert current_shift(datetime(2026, 1, 5, 19, 0)) == "2026-01-05 Night"
@@ -0,0 +1,86 @@
+import io
+
+import numpy as np
+import pyarrow.parquet as pq
+
+import columnar
+from storage import SQLiteStorage
+from symptoms import Symptom
+from vitals_store import COLUMNS, VitalsStore
+
+
+def make_test():
+    store = VitalsStore()
+    t = np.arange(600) / 60.0
+    symptoms = np.zeros(600, dtype=np.uint32)
+    symptoms[400:] = int(Symptom.NAUSEA)
+    store.extend(t[:300], np.full(300, 70.0), np.full(300, 120.0), np.full(300, 80.0), symptoms[:300], 0)
+    store.extend(t[300:], np.linspace(80, 110, 300), np.linspace(118, 90, 300), np.full(300, 75.0),
+                 symptoms[300:], 1)
+    store.current_phase = 1
+    patient = {'patient_id': 'P1', 'age': 35, 'tilt_angle': 70}
+    return patient, {'result': 'Positive - POTS', 'vitals': store}
+
+
+def test_round_trip(tmp_path):
+    patient, results = make_test()
+    path = str(tmp_path / 'test.parquet')
+    columnar.export_test(path, patient, results)
+    patient_out, results_out, phases = columnar.import_test(path)
+    assert patient_out == patient and results_out['result'] == results['result']
+    store, vitals = results['vitals'], results_out['vitals']
+    for c in COLUMNS:
+        np.testing.assert_array_equal(vitals.column(c), store.column(c))
+    assert vitals.current_phase == 1
+    assert vitals.min('sbp') == store.min('sbp') and vitals.argmax('hr') == store.argmax('hr')
+    assert vitals.first_time_with(Symptom.NAUSEA) == store.first_time_with(Symptom.NAUSEA)
+    assert [(p['name'], p['start_time'], p['params']) for p in phases] == [
+        ('Supine', 0.0, {}), ('Tilt', 5.0, {'tilt_angle': 70})]
+
+
+def test_round_trip_through_a_buffer():
+    patient, results = make_test()
+    buffer = io.BytesIO()
+    columnar.export_test(buffer, patient, results)
+    buffer.seek(0)
+    _, results_out, _ = columnar.import_test(buffer)
+    assert len(results_out['vitals']) == 600
+
+
+def test_test_without_vitals(tmp_path):
+    path = str(tmp_path / 'empty.parquet')
+    columnar.export_test(path, {'patient_id': 'P2'}, {'result': None})
+    patient, results, phases = columnar.import_test(path)
+    assert patient == {'patient_id': 'P2'} and 'vitals' not in results and phases == []
+
+
+def test_time_range_read(tmp_path):
+    patient, results = make_test()
+    path = str(tmp_path / 'test.parquet')
+    columnar.export_test(path, patient, results)
+    table = columnar.read_test_vitals(path, time_range=(2.0, 3.0), columns=['time', 'hr'])
+    times = table.column('time').to_numpy()
+    assert table.column_names == ['time', 'hr'] and times.min() >= 2.0 and times.max() <= 3.0
+    assert len(times) == 61
+
+
+def test_archive(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'tilt.db'))
+    # More distinct protocols than an int8 dictionary index can hold
+    for i in range(200):
+        test_id = storage.create_test({'patient_id': f'P{i}', 'age': 20 + i % 60, 'protocol': f'Protocol {i}'})
+        storage.update_test(test_id, results={'result': 'Negative - No abnormality detected'})
+        storage.append_vitals(test_id, np.arange(3), np.arange(3) / 60.0, [70, 71, 72], [120, 119, 118],
+                              [80, 80, 80], [0, 0, 0])
+    storage.flush()
+    counts = columnar.export_archive(storage, str(tmp_path / 'archive'), row_group_rows=100)
+    storage.close()
+    assert counts == {'tests': 200, 'samples': 600}
+
+    tests = pq.read_table(str(tmp_path / 'archive' / columnar.TESTS_FILE))
+    assert len(set(tests.column('protocol').to_pylist())) == 200
+    assert tests.column('positive').to_pylist() == [False] * 200
+    vitals = pq.ParquetFile(str(tmp_path / 'archive' / columnar.VITALS_FILE))
+    assert vitals.metadata.num_rows == 600 and vitals.metadata.num_row_groups > 1
+    ids = vitals.read(columns=['test_id']).column('test_id').to_numpy()
+    assert (np.diff(ids) >= 0).all()
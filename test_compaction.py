@@ -0,0 +1,38 @@
+import numpy as np
+
+import compaction
+from vitals_store import VitalsStore
+
+MB = compaction.MB
+
+
+def store_of(samples):
+    store = VitalsStore()
+    ones = np.ones(samples)
+    store.extend(np.arange(samples) / 60.0, ones * 70, ones * 120, ones * 80)
+    return store
+
+
+def test_session_over_budget_is_spilled(tmp_path):
+    accountant = compaction.Accountant()
+    results = {'vitals': store_of(100_000)}
+    account = compaction.compact(results, str(tmp_path), budget=64 * MB, accountant=accountant)
+    assert not account['over'] and account['spilled'] == 0 and not results['vitals'].spilled
+    account = compaction.compact(results, str(tmp_path), budget=MB, accountant=accountant)
+    assert account['over'] and results['vitals'].spilled
+    assert account['spilled'] == results['vitals'].nbytes and account['resident'] < MB
+
+
+def test_beds_count_against_the_server_budget(tmp_path):
+    accountant = compaction.Accountant()
+    bed = store_of(100_000)
+    compaction.compact_store('bed:1', bed, str(tmp_path), server_budget=64 * MB, accountant=accountant)
+    assert accountant.totals() == (0, bed.nbytes, 0)
+    # A session is pushed over the server budget by the bed, and the bed spills next
+    results = {'vitals': store_of(10)}
+    assert compaction.compact(results, str(tmp_path), server_budget=MB, accountant=accountant)['over']
+    compaction.compact_store('bed:1', bed, str(tmp_path), server_budget=MB, accountant=accountant)
+    assert bed.spilled and accountant.totals() == (0, 0, bed.nbytes)
+    accountant.update('session', 1000, 0)
+    accountant.remove('bed:1')
+    assert accountant.totals() == (1, 1000, 0)
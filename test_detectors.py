@@ -0,0 +1,73 @@
+import numpy as np
+
+from detectors import OnlineDetector
+from symptoms import Symptom
+
+
+def feed(detector, hr, sbp, dbp, minutes, start=0.0, rate_hz=1.0, symptoms=0):
+    # Constant vitals for a stretch of time; returns the alerts raised
+    t = start + np.arange(int(minutes * 60 * rate_hz)) / (60.0 * rate_hz)
+    n = len(t)
+    return detector.update_many(t, np.full(n, hr), np.full(n, sbp), np.full(n, dbp),
+                                np.full(n, symptoms, dtype=np.uint32))
+
+
+def test_stable_vitals_raise_nothing():
+    detector = OnlineDetector(70, 120, 80)
+    assert feed(detector, 75, 118, 78, 20) == []
+    assert detector.met == {}
+
+
+def test_syncope_is_immediate():
+    detector = OnlineDetector(70, 120, 80)
+    feed(detector, 75, 118, 78, 5)
+    alerts = detector.update(5.0, 38, 110, 70)
+    assert [a['kind'] for a in alerts] == ['syncope']
+    assert detector.met['syncope'] == 5.0
+    assert detector.update(5.1, 30, 60, 40) == []  # raised once
+
+
+def test_loss_of_consciousness_is_syncope():
+    detector = OnlineDetector(70, 120, 80)
+    alerts = detector.update(1.0, 80, 115, 75, int(Symptom.LOC))
+    assert [a['kind'] for a in alerts] == ['syncope']
+
+
+def test_orthostatic_hypotension_must_be_sustained():
+    detector = OnlineDetector(70, 120, 80, sustain_s=30)
+    # A 20 s drop is interrupted, so its onset resets
+    assert feed(detector, 75, 95, 75, 20 / 60, start=1.0) == []
+    assert feed(detector, 75, 118, 78, 1, start=1.5) == []
+    alerts = feed(detector, 75, 95, 75, 1, start=3.0)
+    assert [a['kind'] for a in alerts] == ['orthostatic_hypotension']
+    assert alerts[0]['onset'] == 3.0
+    assert alerts[0]['time'] - alerts[0]['onset'] >= 0.5
+
+
+def test_pots_within_window():
+    detector = OnlineDetector(70, 120, 80, age=40)
+    assert feed(detector, 95, 118, 78, 2) == []  # a 25 bpm rise is below the criterion
+    alerts = feed(detector, 102, 118, 78, 2, start=2.0)
+    assert [a['kind'] for a in alerts] == ['pots']
+    assert alerts[0]['onset'] == 2.0
+
+
+def test_pots_threshold_for_young_patients():
+    detector = OnlineDetector(70, 120, 80, age=16)
+    assert feed(detector, 105, 118, 78, 2) == []
+    assert [a['kind'] for a in feed(detector, 111, 118, 78, 2, start=2.0)] == ['pots']
+
+
+def test_late_tachycardia_is_not_pots():
+    detector = OnlineDetector(70, 120, 80)
+    feed(detector, 75, 118, 78, 12)
+    assert feed(detector, 110, 118, 78, 5, start=12.0) == []
+
+
+def test_reset_keeps_the_detector():
+    detector = OnlineDetector(70, 120, 80)
+    assert [a['kind'] for a in feed(detector, 75, 95, 75, 1)] == ['orthostatic_hypotension']
+    detector.reset(70, 95, 75)
+    assert detector.alerts == [] and detector.met == {}
+    assert feed(detector, 75, 95, 75, 1, start=1.0) == []
+    assert [a['kind'] for a in feed(detector, 75, 70, 60, 1, start=2.0)] == ['orthostatic_hypotension']
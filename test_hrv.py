@@ -0,0 +1,71 @@
+import numpy as np
+
+import hrv
+from vitals_store import VitalsStore
+
+
+def beats(n, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.cumsum(rng.normal(0.85, 0.05, n))
+    rr = 850 + 40 * np.sin(2 * np.pi * 0.1 * t) + rng.normal(0, 15, n)
+    sbp = 120 + 5 * np.sin(2 * np.pi * 0.1 * t + 0.5) + rng.normal(0, 2, n)
+    return t / 60.0, 60000.0 / rr, sbp
+
+
+def record(phases, batch):
+    # A store fed in batches with an engine synced after each; phases: phase code per beat
+    t, hr, sbp = beats(len(phases))
+    store, engine = VitalsStore(), hrv.HRVEngine()
+    for a in range(0, len(t), batch):
+        b = a + batch
+        store.extend(t[a:b], hr[a:b], sbp[a:b], sbp[a:b] - 40, phase=phases[a:b])
+        engine.sync(store)
+    return store, engine, 60000.0 / hr
+
+
+def test_summary_does_not_depend_on_batching():
+    phases = np.repeat(np.array([0, 1], dtype=np.uint8), [800, 1200])
+    summaries = []
+    for batch in (1, 7, 2000):
+        store, engine, _ = record(phases, batch)
+        store.current_phase = 1
+        summaries.append(engine.summary(store))
+    for summary in summaries[1:]:
+        assert summary.keys() == summaries[0].keys() == {'Supine', 'Tilt'}
+        for phase, indices in summary.items():
+            for key, value in indices.items():
+                assert value == summaries[0][phase][key] or np.isclose(value, summaries[0][phase][key]), key
+
+
+def test_whole_phase_and_trailing_window():
+    phases = np.repeat(np.array([0, 1, 0], dtype=np.uint8), [500, 600, 400])
+    store, engine, rr = record(phases, 64)
+    assert engine.segments == {0: [[0, 500], [1100, 1500]], 1: [[500, 1100]]}
+    supine = engine.summary(store)['Supine']
+    rr0 = rr[phases == 0]
+    assert supine['beats'] == 900
+    assert np.isclose(supine['mean_rr'], rr0.mean()) and np.isclose(supine['sdnn'], rr0.std(ddof=1))
+    # The window is the last 300 s of supine beats
+    t = store.column('time')[phases == 0] * 60.0
+    window = rr0[t > t[-1] - hrv.SPECTRAL_WINDOW_S]
+    assert np.isclose(supine['window_sdnn'], window.std(ddof=1))
+    assert supine['lf_hf'] is not None
+
+
+def test_closed_phase_is_kept():
+    phases = np.repeat(np.array([0, 1], dtype=np.uint8), [600, 600])
+    store, engine, _ = record(phases, 100)
+    store.current_phase = 1
+    first = engine.summary(store)
+    t, hr, sbp = beats(10, seed=1)
+    store.extend(store.last_time() + t, hr, sbp, sbp - 40, phase=1)
+    engine.sync(store)
+    assert engine.summary(store)['Supine'] is first['Supine']
+
+
+def test_samples_faster_than_beats_get_no_indices():
+    n = 250 * 120
+    store, engine = VitalsStore(), hrv.HRVEngine()
+    store.extend(np.arange(n) / 250 / 60, np.full(n, 70.0), np.full(n, 120.0), np.full(n, 80.0), phase=1)
+    engine.sync(store)
+    assert engine.summary(store) == {}
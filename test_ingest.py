@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+from ingest import Ingestor, parse_record
+from symptoms import Symptom
+from vitals_store import VitalsStore
+
+
+def test_parse_csv():
+    assert parse_record("90,72,118,76\n") == (1.5, 72.0, 118.0, 76.0, 0)
+    assert parse_record("30,72,118,76,Nausea|Sweating") == (0.5, 72.0, 118.0, 76.0,
+                                                              int(Symptom.NAUSEA | Symptom.SWEATING))
+
+
+def test_parse_json():
+    rec = parse_record('{"time": 60, "hr": 80, "sbp": 110, "dbp": 70, "symptoms": ["Nausea"]}')
+    assert rec == (1.0, 80.0, 110.0, 70.0, int(Symptom.NAUSEA))
+
+
+@pytest.mark.parametrize('line', [
+    "", "  ", "time,hr,sbp,dbp", "1,2,3", "1,2,x,4", '{"time": 1, "hr": 2}', '{"time": 1,',
+    "1,nan,120,80", "1,72,inf,80", "nan,72,120,80", "1,72,120,-inf",
+    '{"time": 1, "hr": NaN, "sbp": 120, "dbp": 80}', '{"time": 1, "hr": "inf", "sbp": 120, "dbp": 80}',
+])
+def test_parse_rejects(line):
+    assert parse_record(line) is None
+
+
+def test_ingestor_reads_file(tmp_path):
+    path = tmp_path / 'feed.csv'
+    path.write_text("time,hr,sbp,dbp\n0,70,120,80\n1,nan,120,80\n2,72,118,79\n3,74,116,78\n")
+    store = VitalsStore()
+    ingestor = Ingestor('file', str(path), store, flush_interval=0.01)
+    ingestor.start()
+    deadline = time.monotonic() + 5
+    while ingestor.received < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    ingestor.stop()
+    ingestor.join(5)
+    assert ingestor.received == 3 and ingestor.rejected == 2
+    assert list(store.column('hr')) == [70, 72, 74]
+    assert store.last_time() == 3 / 60
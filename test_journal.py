@@ -0,0 +1,85 @@
+import numpy as np
+
+import journal
+from events import PHASE, EventLog
+from vitals_store import VitalsStore
+
+
+def start(path, test_id=7):
+    patient = {'patient_id': 'P1', 'age': 40}
+    return journal.open_journal(str(path), lambda: journal.snapshot_record(test_id, patient, {}))
+
+
+def test_recover_replays_records(tmp_path):
+    path = tmp_path / 'test_7.wal'
+    j = start(path)
+    j.append_vitals(np.arange(3) / 60.0, [70, 71, 72], [120, 119, 118], [80, 80, 79], [0, 0, 0], 0)
+    j.append('event', event=EventLog().add(0.05, PHASE, phase='Tilt'))
+    j.append_vitals([0.1], [90], [100], [70], [0], 1)
+    j.append_results({'result': 'Pending', 'vitals': VitalsStore()})
+    assert j.sync()
+
+    state = journal.recover(str(path))
+    assert state['test_id'] == 7 and state['patient_data']['patient_id'] == 'P1'
+    assert not state['finished'] and state['records'] == 5
+    results = state['test_results']
+    vitals = results['vitals']
+    assert len(vitals) == 4 and vitals.max('hr') == 90
+    assert list(vitals.column('phase')) == [0, 0, 0, 1]
+    assert vitals.current_phase == 1
+    assert results['result'] == 'Pending'
+    assert [e['kind'] for e in results['events']] == [PHASE]
+    assert [u['test_id'] for u in journal.unfinished(str(tmp_path))] == [7]
+    j.close()
+
+
+def test_close_marks_finished(tmp_path):
+    path = tmp_path / 'test_7.wal'
+    start(path).append_vitals([0.0], [70], [120], [80], [0], 0)
+    journal.close_journal(str(path))
+    assert journal.is_finished(str(path))
+    assert journal.recover(str(path))['finished']
+    assert journal.unfinished(str(tmp_path)) == []
+
+    # Reopening a finished test appends after its close record
+    j = start(path)
+    j.append_vitals([0.1], [72], [118], [79], [0], 0)
+    j.sync()
+    assert not journal.is_finished(str(path))
+    state = journal.recover(str(path))
+    assert not state['finished'] and len(state['test_results']['vitals']) == 2
+    j.close()
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    path = tmp_path / 'test_7.wal'
+    j = start(path)
+    j.append_vitals([0.0, 0.1], [70, 71], [120, 119], [80, 80], [0, 0], 0)
+    j.close(finished=False)
+    good = path.stat().st_size
+    with open(path, 'ab') as f:
+        f.write(journal.encode({'type': 'vitals'})[:-10])
+
+    records, valid = journal.read_records(str(path))
+    assert valid == good and len(records) == 2
+    assert len(journal.recover(str(path))['test_results']['vitals']) == 2
+
+    # Reopening truncates the torn line so new records follow the last good one
+    j = start(path)
+    j.append_vitals([0.2], [72], [118], [79], [0], 0)
+    j.close()
+    records, valid = journal.read_records(str(path))
+    assert valid == path.stat().st_size
+    assert [r['type'] for r in records] == ['open', 'vitals', 'vitals', 'close']
+
+
+def test_corrupt_record_stops_replay(tmp_path):
+    path = tmp_path / 'test_7.wal'
+    j = start(path)
+    j.append_vitals([0.0], [70], [120], [80], [0], 0)
+    j.append_vitals([0.1], [71], [119], [80], [0], 0)
+    j.close(finished=False)
+    lines = path.read_bytes().splitlines(keepends=True)
+    lines[1] = lines[1].replace(b'70', b'99')
+    path.write_bytes(b"".join(lines))
+    assert journal.recover(str(path))['records'] == 1
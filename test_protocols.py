@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+import protocols
+
+ISOPROTERENOL = protocols.load_protocols()["Isoproterenol Protocol"]
+
+
+class Clock:
+
+    def __init__(self):
+        self.minutes = 0.0
+
+    def __call__(self):
+        return self.minutes * 60.0
+
+
+def phase_name(action):
+    return protocols.PHASES[action['phase']]
+
+
+def start(schedule):
+    clock = Clock()
+    scheduler = protocols.PhaseScheduler(schedule, clock=clock)
+    scheduler.start()
+    return scheduler, clock
+
+
+def test_compile():
+    schedule = protocols.compile_protocol(ISOPROTERENOL, angle=60, max_tilt=10)
+    assert [(s['phase'], s['start'], s['end']) for s in schedule.steps] == [
+        ('Supine', 0, 5), ('Tilt', 5, 15), ('Drug', 15, 30), ('Recovery', 30, 35)]
+    assert schedule.origin == 5 and schedule.steps[1]['angle'] == 60
+    assert [d['time'] for d in schedule.doses] == [15, 20, 25]
+    state = schedule.at(21.0)
+    assert state['phase'] == 2 and state['dose'] == 2 and state['next_vitals'] == 21.0
+    # Sample times are minutes since tilt-up
+    assert list(schedule.phases_at([-1.0, 0.0, 12.0, 26.0])) == [0, 1, 2, 3]
+
+
+def test_invalid_definitions(tmp_path):
+    with pytest.raises(ValueError):
+        protocols.validate({'name': "X", 'phases': [{'phase': 'Standing', 'minutes': 5}]})
+    with pytest.raises(ValueError):
+        protocols.validate({'name': "X", 'phases': [{'phase': 'Tilt', 'minutes': 5}], 'stop_on': ['nausea']})
+    (tmp_path / 'bad.json').write_text(json.dumps({'name': "X", 'phases': []}))
+    with pytest.raises(ValueError, match="bad.json"):
+        protocols.load_protocols(str(tmp_path))
+
+
+def test_scheduler_time_is_minutes_since_tilt():
+    scheduler, clock = start(protocols.compile_protocol(ISOPROTERENOL))
+    actions = scheduler.tick()
+    assert [a['action'] for a in actions] == ['phase', 'vitals']
+    assert actions[0]['time'] == -5.0 and scheduler.time() == -5.0
+    clock.minutes = 5.0
+    actions = scheduler.tick()
+    assert actions[0]['action'] == 'phase' and phase_name(actions[0]) == 'Tilt' and actions[0]['time'] == 0.0
+    clock.minutes = 25.0
+    doses = [a for a in scheduler.tick() if a['action'] == 'dose']
+    assert [(d['dose'], d['time']) for d in doses] == [(1, 20.0)]
+
+
+def test_advance_moves_tilt_up():
+    scheduler, clock = start(protocols.compile_protocol(ISOPROTERENOL))
+    scheduler.tick()
+    clock.minutes = 2.0
+    scheduler.advance()  # tilted 3 min early
+    assert scheduler.time() == 0.0 and phase_name(scheduler.tick()[0]) == 'Tilt'
+    clock.minutes = 4.0
+    assert scheduler.time() == 2.0 and scheduler.position() == 7.0
+
+
+def test_stop_criterion_moves_to_recovery():
+    scheduler, clock = start(protocols.compile_protocol(ISOPROTERENOL))
+    scheduler.tick()
+    assert scheduler.check(['syncope']) is None  # not tilted yet
+    clock.minutes = 12.0
+    scheduler.tick()
+    assert scheduler.check(['pots', 'syncope']) == 'syncope'
+    assert scheduler.stopped == {'reason': 'syncope', 'time': 7.0}
+    actions = scheduler.tick()
+    assert phase_name(actions[0]) == 'Recovery' and not [a for a in actions if a['action'] == 'dose']
+    clock.minutes = 17.0
+    assert scheduler.finished
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from storage import SQLiteStorage, open_storage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'tilt.db'), batch_size=100)
+    yield storage
+    storage.close()
+
+
+def record(storage, n, phase_at):
+    test_id = storage.create_test({'patient_id': 'P1', 'protocol': "Short Passive (15 min)"})
+    seq = np.arange(n)
+    storage.append_vitals(test_id, seq, seq / 60.0, 70 + seq % 10, 120 - seq % 7, np.full(n, 80.0),
+                          np.zeros(n), np.searchsorted(phase_at, seq, 'right'))
+    storage.flush()
+    return test_id
+
+
+def test_load_vitals_pages_lazily(storage):
+    test_id = record(storage, 2500, [1000, 2000])
+    pages = storage.load_vitals(test_id, page_size=1000)
+    sizes = [len(store) for store in pages]
+    assert sizes == [1000, 2000, 2500]
+    store = next(iter(storage.load_vitals(test_id, page_size=1000)))
+    assert len(store) == 1000 and store.current_phase == 0
+
+
+def test_load_vitals_restores_contents_and_phase(storage):
+    test_id = record(storage, 2500, [1000, 2000])
+    *_, store = storage.load_vitals(test_id, page_size=700)
+    assert len(store) == 2500 and store.current_phase == 2
+    assert store.min('hr') == 70 and store.max('hr') == 79
+    np.testing.assert_array_equal(store.column('phase')[[0, 999, 1000, 2499]], [0, 0, 1, 2])
+    assert list(storage.load_vitals(record(storage, 0, []))) == []
+
+
+def test_tests_and_phases(storage):
+    test_id = record(storage, 10, [])
+    storage.add_phase(test_id, 'Tilt', {'tilt_angle': 70})
+    storage.update_test(test_id, results={'result': 'Negative'})
+    test = storage.get_test(test_id)
+    assert test['test_results'] == {'result': 'Negative'}
+    assert [(p['name'], p['params']) for p in test['phases']] == [('Tilt', {'tilt_angle': 70})]
+    assert [t['id'] for t in storage.list_tests(patient_id='P1')] == [test_id]
+
+
+def test_open_storage(tmp_path):
+    open_storage(f"sqlite:///{tmp_path / 'a.db'}").close()
+    with pytest.raises(ValueError):
+        open_storage("postgres://localhost/tilt")
@@ -0,0 +1,75 @@
+import numpy as np
+
+from symptoms import Symptom
+from vitals_store import VitalsStore
+
+
+def test_append_grows_and_tracks_extremes():
+    store = VitalsStore(capacity=16)
+    for i in range(40):
+        store.append(i / 10, 70 + i, 120 - i, 80, phase=1)
+    assert len(store) == 40 and store.capacity >= 40
+    assert store.min('hr') == 70 and store.argmin('hr') == 0
+    assert store.max('hr') == 109 and store.argmax('hr') == 39
+    assert store.min('sbp') == 81 and store.argmin('sbp') == 39
+    assert store.last_time() == 3.9
+    assert (store.column('phase') == 1).all()
+
+
+def test_extend_matches_append():
+    rng = np.random.default_rng(0)
+    t = np.arange(500) / 60.0
+    hr, sbp, dbp = rng.normal(75, 10, (3, 500))
+    one, batched = VitalsStore(), VitalsStore()
+    for i in range(500):
+        one.append(t[i], hr[i], sbp[i], dbp[i])
+    for i in range(0, 500, 37):
+        batched.extend(t[i:i + 37], hr[i:i + 37], sbp[i:i + 37], dbp[i:i + 37])
+    for c in ('hr', 'sbp', 'dbp'):
+        assert one.min(c) == batched.min(c) and one.argmin(c) == batched.argmin(c)
+        assert one.max(c) == batched.max(c) and one.argmax(c) == batched.argmax(c)
+        np.testing.assert_array_equal(one.column(c), batched.column(c))
+
+
+def test_missing_readings_are_not_extremes():
+    store = VitalsStore()
+    store.append(0.0, np.nan, 120, 80)
+    assert store.min('hr') is None and store.max('hr') is None and store.argmin('hr') is None
+    store.extend([0.1, 0.2, 0.3], [np.nan, 72, np.inf], [np.nan, np.nan, np.nan], [80, 79, 81])
+    assert store.min('hr') == 72 and store.argmin('hr') == 2
+    assert store.max('hr') == 72 and store.argmax('hr') == 2
+    assert store.min('sbp') == 120 and store.argmin('sbp') == 0
+    store.append(0.4, 65, -np.inf, 80)
+    assert store.min('hr') == 65 and store.argmin('hr') == 4
+    assert store.min('sbp') == 120
+
+
+def test_symptom_onsets():
+    store = VitalsStore()
+    store.append(2.0, 80, 110, 70, symptoms=int(Symptom.NAUSEA))
+    store.extend([3.0, 1.5], [80, 80], [110, 110], [70, 70],
+                 np.array([0, int(Symptom.NAUSEA)], dtype=np.uint32))
+    assert store.first_time_with(Symptom.NAUSEA) == 1.5
+    assert store.first_time_with(Symptom.LOC) is None
+
+
+def test_unsorted_times():
+    store = VitalsStore()
+    store.extend([0.0, 1.0, 2.0, 3.0], [70] * 4, [120] * 4, [80] * 4)
+    store.append(1.5, 90, 100, 60)  # a manual entry between feed samples
+    assert store.last_time() == 3.0
+    np.testing.assert_array_equal(store.index_at([-1.0, 1.2, 1.5, 2.5, 10.0]), [-1, 1, 4, 2, 3])
+    window = store.time_slice(1.0, 2.0)
+    np.testing.assert_array_equal(np.sort(window['time']), [1.0, 1.5, 2.0])
+
+
+def test_spill_keeps_contents(tmp_path):
+    store = VitalsStore()
+    store.extend(np.arange(100) / 60.0, np.full(100, 70.0), np.full(100, 120.0), np.full(100, 80.0))
+    before = {c: v.copy() for c, v in store.slice().items()}
+    store.spill(str(tmp_path))
+    assert store.spilled
+    store.append(2.0, 60, 100, 70)
+    assert len(store) == 101 and store.min('hr') == 60
+    for c, v in before.items():
+        np.testing.assert_array_equal(store.column(c)[:100], v)
@@ -0,0 +1,254 @@
+import math
+import os
+import shutil
+import threading
+import uuid
+import weakref
+
+import numpy as np
+
+from symptoms import LABELS, MEMBERS, encode_symptoms
+
+PHASES = ("Supine", "Tilt", "Drug", "Recovery")
+COLUMNS = ('time', 'hr', 'sbp', 'dbp', 'symptoms', 'phase')
+# Columns with running min/max tracking
+TRACKED = ('hr', 'sbp', 'dbp')
+
+
+class VitalsStore:
+    """Columnar store for the vital signs recorded during a test.
+
+    Samples live in preallocated NumPy arrays that grow by doubling, so
+    appends are amortized O(1). Running min/max/argmin/argmax and the first
+    onset time of every symptom are maintained on append, so the analysis
+    step reads them without scanning the data.
+
+    Feeds writing from a background thread hold ``lock`` while extending;
+    readers on the script thread take it to get a consistent snapshot.
+    Samples are tagged with ``current_phase`` (an index into PHASES)
+    unless a phase is given. ``version`` changes on every write, so (``uid``, ``version``) identifies
+    the contents for caching.
+
+    ``spill`` moves the columns into memory-mapped files; reads are
+    unchanged, but the samples no longer count against the process's memory.
+    """
+
+    def __init__(self, capacity=1024):
+        capacity = max(int(capacity), 16)
+        self.time = np.empty(capacity, dtype=np.float64)
+        self.hr = np.empty(capacity, dtype=np.float32)
+        self.sbp = np.empty(capacity, dtype=np.float32)
+        self.dbp = np.empty(capacity, dtype=np.float32)
+        self.symptoms = np.empty(capacity, dtype=np.uint32)
+        self.phase = np.empty(capacity, dtype=np.uint8)
+        self.current_phase = 0
+        self.n = 0
+        self._min = {c: np.inf for c in TRACKED}
+        self._max = {c: -np.inf for c in TRACKED}
+        self._argmin = {c: -1 for c in TRACKED}
+        self._argmax = {c: -1 for c in TRACKED}
+        self._onset = np.full(len(MEMBERS), np.inf)
+        self._last_time = -np.inf
+        self._sorted = True
+        self.lock = threading.RLock()
+        self.uid = uuid.uuid4().hex
+        self.version = 0
+        self.spill_dir = None
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def capacity(self):
+        return len(self.time)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, c).nbytes for c in COLUMNS)
+
+    @property
+    def spilled(self):
+        return self.spill_dir is not None
+
+    def _allocate(self, name, dtype, capacity):
+        if self.spill_dir is None:
+            return np.empty(capacity, dtype=dtype)
+        # One file per size; views of the old file stay valid after it is removed
+        path = os.path.join(self.spill_dir, f"{name}.{capacity}.npy")
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(capacity,))
+
+    def _move(self, capacity):
+        old_cap = self.capacity
+        for c in COLUMNS:
+            old = getattr(self, c)
+            arr = self._allocate(c, old.dtype, capacity)
+            arr[:self.n] = old[:self.n]
+            setattr(self, c, arr)
+            if isinstance(old, np.memmap):
+                os.remove(os.path.join(self.spill_dir, f"{c}.{old_cap}.npy"))
+
+    def _reserve(self, extra):
+        need = self.n + extra
+        if need <= self.capacity:
+            return
+        new_cap = self.capacity
+        while new_cap < need:
+            new_cap *= 2
+        self._move(new_cap)
+
+    def spill(self, directory):
+        """Move the columns into memory-mapped files under directory.
+
+        The OS pages samples in as they are read and can drop them again, so a
+        long recording no longer has to fit in memory. Later growth stays on
+        disk, and the files are removed with the store.
+        """
+        with self.lock:
+            if self.spill_dir is not None:
+                return
+            self.spill_dir = os.path.join(directory, self.uid)
+            os.makedirs(self.spill_dir, exist_ok=True)
+            weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+            self._move(self.capacity)
+
+    def append(self, time, hr, sbp, dbp, symptoms=(), phase=None):
+        self._reserve(1)
+        i = self.n
+        if i and time < self.time[i - 1]:
+            self._sorted = False
+        if time > self._last_time:
+            self._last_time = float(time)
+        self.time[i] = time
+        self.hr[i] = hr
+        self.sbp[i] = sbp
+        self.dbp[i] = dbp
+        mask = symptoms if isinstance(symptoms, (int, np.integer)) else encode_symptoms(symptoms)
+        self.symptoms[i] = mask
+        self.phase[i] = self.current_phase if phase is None else phase
+        self.n += 1
+        self.version += 1
+
+        for c in TRACKED:
+            # As stored (float32), so extremes match the column and extend()
+            v = getattr(self, c)[i].item()
+            # Missing (NaN) and non-finite readings never become an extreme
+            if not math.isfinite(v):
+                continue
+            if v < self._min[c]:
+                self._min[c], self._argmin[c] = v, i
+            if v > self._max[c]:
+                self._max[c], self._argmax[c] = v, i
+        if mask:
+            for b in range(len(MEMBERS)):
+                if mask >> b & 1 and time < self._onset[b]:
+                    self._onset[b] = time
+
+    def extend(self, time, hr, sbp, dbp, symptoms=None, phase=None):
+        time = np.asarray(time, dtype=np.float64)
+        k = len(time)
+        if k == 0:
+            return
+        self._reserve(k)
+        i, j = self.n, self.n + k
+        if (i and time[0] < self.time[i - 1]) or np.any(np.diff(time) < 0):
+            self._sorted = False
+        self._last_time = max(self._last_time, float(time.max()))
+        self.time[i:j] = time
+        self.hr[i:j] = hr
+        self.sbp[i:j] = sbp
+        self.dbp[i:j] = dbp
+        if symptoms is None:
+            self.symptoms[i:j] = 0
+        else:
+            symptoms = np.asarray(symptoms)
+            if symptoms.dtype == object:
+                symptoms = np.fromiter((encode_symptoms(s) for s in symptoms), dtype=np.uint32, count=k)
+            self.symptoms[i:j] = symptoms
+        self.phase[i:j] = self.current_phase if phase is None else phase
+        self.n = j
+        self.version += 1
+
+        for c in TRACKED:
+            block = getattr(self, c)[i:j]
+            finite = np.isfinite(block)
+            if not finite.any():
+                continue
+            lo = int(np.where(finite, block, np.inf).argmin())
+            hi = int(np.where(finite, block, -np.inf).argmax())
+            if block[lo] < self._min[c]:
+                self._min[c], self._argmin[c] = block[lo].item(), i + lo
+            if block[hi] > self._max[c]:
+                self._max[c], self._argmax[c] = block[hi].item(), i + hi
+        masks = self.symptoms[i:j]
+        if masks.any():
+            for b in range(len(MEMBERS)):
+                hit = (masks >> b) & 1
+                if hit.any():
+                    self._onset[b] = min(self._onset[b], time[hit.astype(bool)].min())
+
+    def column(self, name):
+        return getattr(self, name)[:self.n]
+
+    # None until a finite value of the column has been recorded
+    def min(self, name):
+        return self._min[name] if self._argmin[name] >= 0 else None
+
+    def max(self, name):
+        return self._max[name] if self._argmax[name] >= 0 else None
+
+    def argmin(self, name):
+        return self._argmin[name] if self._argmin[name] >= 0 else None
+
+    def argmax(self, name):
+        return self._argmax[name] if self._argmax[name] >= 0 else None
+
+    def last_time(self):
+        # Latest sample time, kept on write rather than scanned (None if empty)
+        return self._last_time if self.n else None
+
+    def first_time_with(self, symptom):
+        flag = LABELS[symptom] if isinstance(symptom, str) else symptom
+        t = self._onset[flag.bit_length() - 1]
+        return None if np.isinf(t) else float(t)
+
+    def slice(self, start=None, stop=None):
+        # Zero-copy views of the recorded columns
+        s = slice(start, stop)
+        return {c: self.column(c)[s] for c in COLUMNS}
+
+    def time_slice(self, t0, t1):
+        t = self.column('time')
+        if self._sorted:
+            return self.slice(int(np.searchsorted(t, t0, 'left')), int(np.searchsorted(t, t1, 'right')))
+        keep = (t >= t0) & (t <= t1)
+        return {c: self.column(c)[keep] for c in COLUMNS}
+
+    def index_at(self, times):
+        """Index of the last sample at or before each time (-1 if none).
+
+        Manual entries can land between feed samples out of time order, so an
+        unsorted store is searched through a sorted permutation.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        t = self.column('time')
+        if self._sorted:
+            return np.searchsorted(t, times, 'right') - 1
+        order = np.argsort(t, kind='stable')
+        pos = np.searchsorted(t[order], times, 'right') - 1
+        return np.where(pos >= 0, order[np.maximum(pos, 0)], -1)
+
+    def rolling(self, name, window, func='mean'):
+        values = self.column(name).astype(np.float64)
+        if window <= 0 or len(values) < window:
+            return np.empty(0)
+        if func == 'mean':
+            csum = np.cumsum(np.concatenate(([0.0], values)))
+            return (csum[window:] - csum[:-window]) / window
+        windows = np.lib.stride_tricks.sliding_window_view(values, window)
+        if func == 'min':
+            return windows.min(axis=1)
+        if func == 'max':
+            return windows.max(axis=1)
+        if func == 'std':
+            return windows.std(axis=1)
+        raise ValueError(f"Unknown rolling function: {func}")
@@ -0,0 +1,180 @@
+"""Append-only raw waveform files (ECG, plethysmography) per test.
+
+Each test has a data file of interleaved float32 frames (one value per
+channel) behind a fixed-size JSON header, plus an index file of
+``(start_time, first_sample)`` pairs, one per appended block. Times are
+seconds from the start of the test. Readers memory-map both files and look
+up a time window with a binary search on the index, so only the samples in
+the window are paged in however long the recording is.
+"""
+import argparse
+import itertools
+import json
+import os
+
+import numpy as np
+
+MAGIC = b'TILTWAV1'
+HEADER_SIZE = 4096
+DATA_SUFFIX = '.twf'
+INDEX_SUFFIX = '.twi'
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('sample', '<i8')])
+DEFAULT_CHANNELS = ('ECG', 'Pleth')
+DEFAULT_RATE = 500.0
+
+
+def waveform_path(directory, test_id):
+    return os.path.join(directory, f"test_{test_id}")
+
+
+def exists(base):
+    return os.path.exists(base + DATA_SUFFIX)
+
+
+class WaveformWriter:
+    """Appends blocks of samples; reopening an existing file continues it."""
+
+    def __init__(self, base, channels=DEFAULT_CHANNELS, sample_rate=DEFAULT_RATE):
+        self.base = base
+        if exists(base):
+            header = read_header(base)
+            self.channels, self.sample_rate = tuple(header['channels']), header['sample_rate']
+        else:
+            os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+            self.channels, self.sample_rate = tuple(channels), float(sample_rate)
+            header = json.dumps({'channels': self.channels, 'sample_rate': self.sample_rate}).encode()
+            if len(MAGIC) + len(header) > HEADER_SIZE:
+                raise ValueError("Too many channels for the waveform header")
+            with open(base + DATA_SUFFIX, 'wb') as f:
+                f.write((MAGIC + header).ljust(HEADER_SIZE, b' '))
+            open(base + INDEX_SUFFIX, 'wb').close()
+        self._data = open(base + DATA_SUFFIX, 'ab')
+        self._index = open(base + INDEX_SUFFIX, 'ab')
+        self.samples = (os.path.getsize(base + DATA_SUFFIX) - HEADER_SIZE) // (4 * len(self.channels))
+
+    def append(self, start_time, samples):
+        # samples: (n, channels) array starting at start_time seconds
+        samples = np.ascontiguousarray(samples, dtype='<f4')
+        if samples.ndim != 2 or samples.shape[1] != len(self.channels):
+            raise ValueError(f"Expected an (n, {len(self.channels)}) array")
+        if not len(samples):
+            return
+        self._data.write(samples.tobytes())
+        self._index.write(np.array([(start_time, self.samples)], dtype=INDEX_DTYPE).tobytes())
+        self.samples += len(samples)
+
+    def flush(self):
+        # Data before index, so a reader never sees an index entry without its samples
+        self._data.flush()
+        self._index.flush()
+
+    def close(self):
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_header(base):
+    with open(base + DATA_SUFFIX, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if not raw.startswith(MAGIC):
+        raise ValueError(f"{base + DATA_SUFFIX} is not a waveform file")
+    return json.loads(raw[len(MAGIC):].rstrip())
+
+
+class WaveformReader:
+    """Memory-mapped view of a waveform file; ``refresh`` picks up appended blocks."""
+
+    def __init__(self, base):
+        self.base = base
+        header = read_header(base)
+        self.channels = tuple(header['channels'])
+        self.sample_rate = header['sample_rate']
+        self._size = None
+        self.refresh()
+
+    def refresh(self):
+        frame = 4 * len(self.channels)
+        samples = (os.path.getsize(self.base + DATA_SUFFIX) - HEADER_SIZE) // frame
+        blocks = os.path.getsize(self.base + INDEX_SUFFIX) // INDEX_DTYPE.itemsize
+        if (samples, blocks) == self._size:
+            return
+        self._size = (samples, blocks)
+        self.data = (np.memmap(self.base + DATA_SUFFIX, dtype='<f4', mode='r', offset=HEADER_SIZE,
+                               shape=(samples, len(self.channels))) if samples else
+                     np.empty((0, len(self.channels)), dtype='<f4'))
+        index = (np.memmap(self.base + INDEX_SUFFIX, dtype=INDEX_DTYPE, mode='r', shape=(blocks,))
+                 if blocks else np.empty(0, dtype=INDEX_DTYPE))
+        # Ignore index entries whose samples are not fully written yet
+        self.index = index[index['sample'] < samples]
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def duration(self):
+        if not len(self.index):
+            return 0.0
+        last = self.index[-1]
+        return float(last['time'] + (len(self.data) - last['sample']) / self.sample_rate)
+
+    def sample_at(self, t):
+        # First sample at or after time t
+        if not len(self.index):
+            return 0
+        block = max(int(np.searchsorted(self.index['time'], t, 'right')) - 1, 0)
+        start_time, start = self.index[block]
+        end = self.index[block + 1]['sample'] if block + 1 < len(self.index) else len(self.data)
+        offset = int(np.ceil(max(t - start_time, 0) * self.sample_rate))
+        return int(min(start + offset, end))
+
+    def times(self, start, stop):
+        # Timestamps of samples [start, stop), following gaps between blocks
+        samples = np.arange(start, stop)
+        block = np.searchsorted(self.index['sample'], samples, 'right') - 1
+        return self.index['time'][block] + (samples - self.index['sample'][block]) / self.sample_rate
+
+    def window(self, t0, t1):
+        """(times, samples) for t0 <= t < t1; samples is a view into the mapped file."""
+        start, stop = self.sample_at(t0), self.sample_at(t1)
+        return self.times(start, stop), self.data[start:stop]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Append a monitor waveform export (CSV, one column per channel) to a test")
+    parser.add_argument('test_id', type=int)
+    parser.add_argument('csv')
+    parser.add_argument('--dir', default=os.environ.get('TILT_WAVEFORM_DIR', 'waveforms'))
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help="Sample rate (Hz)")
+    parser.add_argument('--start', type=float, help="Start time in seconds (default: end of the recording)")
+    parser.add_argument('--chunk', type=int, default=65536, help="Rows per appended block")
+    args = parser.parse_args(argv)
+
+    with open(args.csv) as f:
+        channels = [c.strip() for c in f.readline().split(',')]
+    base = waveform_path(args.dir, args.test_id)
+    with WaveformWriter(base, channels, args.rate) as writer:
+        t = args.start
+        if t is None:
+            t = WaveformReader(base).duration if writer.samples else 0.0
+        # Stream the CSV in chunks so large exports are never held in memory
+        with open(args.csv) as f:
+            f.readline()
+            while True:
+                lines = list(itertools.islice(f, args.chunk))
+                if not lines:
+                    break
+                block = np.loadtxt(lines, delimiter=',', dtype=np.float32, ndmin=2)
+                writer.append(t, block)
+                t += len(block) / writer.sample_rate
+    print(f"{base}{DATA_SUFFIX}: {writer.samples} samples")
+
+
+if __name__ == '__main__':
+    main()